@@ -3,7 +3,7 @@ import os
 import time
 import random
 from dotenv import load_dotenv
-from db import get_db
+from repository import REPOSITORY
 
 # Load env safely
 load_dotenv()
@@ -15,8 +15,66 @@ if not api_key:
 else:
     genai.configure(api_key=api_key)
 
-import math
-from datetime import datetime, timedelta
+import re
+
+import offline_engine
+from log_config import get_logger
+from metrics import LLM_CALL_LATENCY, LLM_RETRIES
+from cache import TTLCache, SingleFlight
+from shared_state import DEVICE_STATE, DEVICE_HISTORY, DEVICE_VERSION
+
+log = get_logger("agent")
+
+# ---------------------------
+# RESPONSE CACHE
+# ---------------------------
+
+CHAT_CACHE_TTL = 30        # seconds
+CHAT_CACHE_SIZE = 256      # entries (LRU beyond this)
+
+CHAT_CACHE = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+CHAT_FLIGHTS = SingleFlight()
+
+# Politeness and articles only: words like "now", "today" or "is"/"are"
+# change what is being asked and must stay in the key
+_FILLER_WORDS = {
+    "a", "an", "the", "please", "pls", "hey", "hi",
+    "can", "could", "would", "you", "tell", "me",
+}
+
+_SYNONYMS = {
+    "temp": "temperature",
+    "temps": "temperature",
+    "humid": "humidity",
+    "pm2.5": "pm25",
+    "aq": "air",
+    "whats": "what is",
+    "hows": "how is",
+}
+
+
+def normalize_message(message: str) -> str:
+    """
+    Reduces a chat message to a semantic key so that trivially different
+    phrasings ("How is the air?" / "hey, how's the air please") share a
+    cache entry.
+    """
+    text = message.lower().replace("'", "")
+    tokens = re.findall(r"[a-z0-9.]+", text)
+    words = []
+    for tok in tokens:
+        tok = tok.strip(".")
+        tok = _SYNONYMS.get(tok, tok)
+        if tok and tok not in _FILLER_WORDS:
+            words.append(tok)
+    return " ".join(words)
+
+
+def chat_cache_key(user_message: str, device_id: str):
+    # DEVICE_VERSION only moves when the device's derived results or band
+    # vector change (ingest_pipeline.derived_stage), not on every reading
+    return (device_id, DEVICE_VERSION.get(device_id, 0), normalize_message(user_message))
+
 
 def simple_linear_regression(y_values):
     """
@@ -54,71 +112,112 @@ def simple_linear_regression(y_values):
     
     return predictions
 
-def get_live_context(device_id: str):
-    """Fetches live context AND calculates 5-hour forecast."""
-    context_str = f"Context for Device '{device_id}':\n"
-    
+def get_live_snapshot(device_id: str):
+    """
+    Fetches the latest reading and 5-hour forecast as structured data.
+    Prefers the in-memory live state and only falls back to the DB.
+    """
+    snapshot = {"device_id": device_id, "reading": None, "forecast": None, "error": None}
+
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # 1. Get Latest Reading
-        cursor.execute("""
-            SELECT * FROM sensor_readings 
-            WHERE device_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 1
-        """, (device_id,))
-        row = cursor.fetchone()
-        
-        if row:
-            data = dict(row)
-            context_str += f"[Live Reading] Temp: {data.get('temperature')}C, Humidity: {data.get('humidity')}%, PM2.5: {data.get('pm25')}, AQI: {data.get('aqi')}, Score: {data.get('air_quality_score')}\n"
-        else:
-            context_str += "[Live Reading] No recent data found.\n"
-            conn.close()
-            return context_str
-
-        # 2. Get Historical Data (Last 24 hours) for Prediction
-        # We limit to 50 points to keep it fast/simple
-        cursor.execute("""
-            SELECT temperature, humidity, pm25 FROM sensor_readings 
-            WHERE device_id = ? 
-            ORDER BY timestamp ASC 
-            LIMIT 100
-        """, (device_id,))
-        history = cursor.fetchall()
-        conn.close()
-        
+        reading = DEVICE_STATE.get(device_id)
+        history = DEVICE_HISTORY.get(device_id) or []
+
+        if reading is None:
+            # 1. Get Latest Reading
+            reading = REPOSITORY.get_latest_reading(device_id)
+
+        if reading is None:
+            return snapshot
+        snapshot["reading"] = reading
+
+        # 2. Get Historical Data for Prediction
         if len(history) > 5:
-            temps = [r[0] for r in history if r[0] is not None]
-            hums = [r[1] for r in history if r[1] is not None]
-            pm25s = [r[2] for r in history if r[2] is not None]
-            
-            pred_temp = simple_linear_regression(temps)
-            pred_hum = simple_linear_regression(hums)
-            pred_pm25 = simple_linear_regression(pm25s)
-            
-            context_str += (
-                f"\n[AI Forecast - Next 5 Hours]\n"
-                f"Based on historical trend (Linear Regression):\n"
-                f"- Predicted Temperature: {pred_temp} (Trend)\n"
-                f"- Predicted Humidity: {pred_hum} (Trend)\n"
-                f"- Predicted PM2.5: {pred_pm25} (Trend)\n"
-            )
+            series = [(r.get("temperature"), r.get("humidity"), r.get("pm25")) for r in history]
         else:
-            context_str += "\n[AI Forecast] Not enough data to predict trends yet.\n"
-            
+            rows = REPOSITORY.get_readings(device_id, columns="temperature, humidity, pm25, timestamp", limit=100)
+            series = [(r["temperature"], r["humidity"], r["pm25"]) for r in rows]
+
+        if len(series) > 5:
+            snapshot["forecast"] = {
+                "temperature": simple_linear_regression([r[0] for r in series if r[0] is not None]),
+                "humidity": simple_linear_regression([r[1] for r in series if r[1] is not None]),
+                "pm25": simple_linear_regression([r[2] for r in series if r[2] is not None]),
+            }
+
     except Exception as e:
-        context_str += f"[Error] Could not fetch live data: {e}\n"
-        
+        snapshot["error"] = str(e)
+
+    return snapshot
+
+
+def format_context(snapshot: dict):
+    """Renders a live snapshot as the text context given to the LLM."""
+    context_str = f"Context for Device '{snapshot['device_id']}':\n"
+
+    if snapshot["error"]:
+        return context_str + f"[Error] Could not fetch live data: {snapshot['error']}\n"
+
+    data = snapshot["reading"]
+    if data is None:
+        return context_str + "[Live Reading] No recent data found.\n"
+
+    context_str += f"[Live Reading] Temp: {data.get('temperature')}C, Humidity: {data.get('humidity')}%, PM2.5: {data.get('pm25')}, AQI: {data.get('aqi')}, Score: {data.get('air_quality_score')}\n"
+
+    forecast = snapshot["forecast"]
+    if forecast:
+        context_str += (
+            f"\n[AI Forecast - Next 5 Hours]\n"
+            f"Based on historical trend (Linear Regression):\n"
+            f"- Predicted Temperature: {forecast['temperature']} (Trend)\n"
+            f"- Predicted Humidity: {forecast['humidity']} (Trend)\n"
+            f"- Predicted PM2.5: {forecast['pm25']} (Trend)\n"
+        )
+    else:
+        context_str += "\n[AI Forecast] Not enough data to predict trends yet.\n"
+
     return context_str
 
+
+def get_live_context(device_id: str):
+    """Fetches live context AND calculates 5-hour forecast."""
+    return format_context(get_live_snapshot(device_id))
+
 def run_agent(user_message: str, device_id: str):
+    """
+    Answers a chat message, serving repeats from CHAT_CACHE and coalescing
+    identical in-flight questions into a single upstream call.
+    """
+    key = chat_cache_key(user_message, device_id)
+    cached = CHAT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    def compute():
+        text, cacheable = _run_agent_uncached(user_message, device_id)
+        if cacheable:
+            CHAT_CACHE.set(key, text)
+        return text
+
+    return CHAT_FLIGHTS.do(key, compute)
+
+
+def _run_agent_uncached(user_message: str, device_id: str):
+    """
+    Returns (response_text, cacheable). Only real model answers are cacheable;
+    errors and offline fallbacks are not.
+    """
+    snapshot = get_live_snapshot(device_id)
+
+    # Simple factual questions are answered locally without an LLM round trip
+    fast_answer = offline_engine.answer(user_message, snapshot, offline=False)
+    if fast_answer is not None:
+        return fast_answer, False
+
     if not api_key:
-        return "System Error: GOOGLE_API_KEY not found in backend configuration."
+        return "System Error: GOOGLE_API_KEY not found in backend configuration.", False
 
-    context = get_live_context(device_id)
+    context = format_context(snapshot)
     
     system_instruction = (
         "You are 'Monacos Health Guardian', an AI assistant for indoor air quality. "
@@ -144,6 +243,7 @@ def run_agent(user_message: str, device_id: str):
     base_delay = 2
     
     for attempt in range(max_retries):
+        started = time.perf_counter()
         try:
             model = genai.GenerativeModel(
                 model_name="models/gemini-flash-latest",
@@ -151,51 +251,27 @@ def run_agent(user_message: str, device_id: str):
             )
             chat = model.start_chat()
             response = chat.send_message(final_prompt)
-            return response.text
+            LLM_CALL_LATENCY.observe(time.perf_counter() - started, "ok")
+            return response.text, True
             
         except Exception as e:
             error_msg = str(e)
-            print(f"Gemini Attempt {attempt+1} failed: {error_msg}")
+            LLM_CALL_LATENCY.observe(time.perf_counter() - started, "error")
+            log.warning("gemini attempt failed", extra={"fields": {"attempt": attempt + 1, "error": error_msg}})
             
             # Check for Quota/Rate Limit
             if "429" in error_msg or "quota" in error_msg.lower() or "resource_exhausted" in error_msg.lower():
                 if attempt < max_retries - 1:
                     sleep_time = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                    print(f"Retrying in {sleep_time:.2f}s...")
+                    log.info("retrying gemini", extra={"fields": {"delay_s": round(sleep_time, 2)}})
+                    LLM_RETRIES.inc()
                     time.sleep(sleep_time)
                     continue
                 else:
                     # Fallback to smart offline mode
-                    import re
-                    
-                    # Parse values
-                    temp_match = re.search(r"Temp: ([\d.]+)C", context)
-                    score_match = re.search(r"Score: ([\d.]+)", context)
-                    aqi_match = re.search(r"AQI: ([\d.]+)", context)
-                    
-                    temp = temp_match.group(1) if temp_match else "Unknown"
-                    score = score_match.group(1) if score_match else "Unknown"
-                    aqi = aqi_match.group(1) if aqi_match else "Unknown"
-                    
-                    msg_lower = user_message.lower()
-                    
-                    # Smart Rule-Based Responses
-                    if "temp" in msg_lower:
-                        return f"Offline Mode: The current temperature is {temp}°C."
-                    elif "score" in msg_lower or "health" in msg_lower:
-                        return f"Offline Mode: Your room health score is {score}/100."
-                    elif "aqi" in msg_lower or "air" in msg_lower:
-                        return f"Offline Mode: The Air Quality Index (AQI) is {aqi}."
-                    elif "hello" in msg_lower or "hi" in msg_lower:
-                        return "Offline Mode: Hello! I'm currently running in low-power mode, but I can still read your sensors. Ask me about temperature or AQI."
-                    else:
-                        return (f"Offline Mode (API Quota)\n\n"
-                                f"I can't chat normally right now, but here are your stats:\n"
-                                f"- Temp: {temp}°C\n"
-                                f"- AQI: {aqi}\n"
-                                f"- Score: {score}/100")
+                    return offline_engine.answer(user_message, snapshot), False
             else:
                 # Other error
-                return f"I encountered an error: {error_msg}"
+                return f"I encountered an error: {error_msg}", False
     
-    return "Something went wrong. Please try again."
+    return "Something went wrong. Please try again.", False
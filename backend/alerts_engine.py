@@ -1,24 +1,32 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 import uuid
 
+from bands import above, band_vector, below, default_vector, with_defaults
+from metrics import ALERTS_EMITTED
+
 # ----------------------------------
 # Alert deduplication cache
 # ----------------------------------
 ALERT_CACHE = {}
 ALERT_COOLDOWN = timedelta(seconds=60)  # 1 alert per type per minute
 
+# Alert types whose condition held at the last generate_alerts call, emitted or not
+ACTIVE_CONDITIONS = {}
+
 
-def _can_emit(device_id: str, alert_type: str) -> bool:
+def _can_emit(device_id: str, alert_type: str, now: datetime = None) -> bool:
     """
     Prevent alert spam by enforcing cooldown per device + alert type
     """
-    now = datetime.utcnow()
+    now = now or datetime.utcnow()
     last_time = ALERT_CACHE.get((device_id, alert_type))
 
     if last_time and (now - last_time) < ALERT_COOLDOWN:
         return False
 
     ALERT_CACHE[(device_id, alert_type)] = now
+    ALERTS_EMITTED.inc(alert_type)
     return True
 
 
@@ -29,152 +37,105 @@ def _new_alert_id(alert_type: str) -> str:
     return f"{alert_type}-{uuid.uuid4().hex}"
 
 
-def generate_alerts(data: dict):
-    alerts = []
-    now = datetime.utcnow().isoformat()
-    device_id = data.get("device_id", "unknown")
-
-    # -----------------------------
-    # PM2.5 (PMS5003)
-    # -----------------------------
-    pm25 = data.get("pm25", 0)
-
-    if pm25 > 55:
-        alert_type = "PM25_HIGH"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "High",
-                "title": "High PM2.5 Pollution",
-                "message": "Fine particulate matter is very high. Use an air purifier and reduce exposure.",
-                "sensor": "PMS5003",
-                "timestamp": now
-            })
+def has_active_conditions(device_id: str) -> bool:
+    """
+    True if an alert condition held at the last evaluation, even if the
+    cooldown suppressed it; such devices must keep being evaluated.
+    """
+    return bool(ACTIVE_CONDITIONS.get(device_id))
 
-    elif pm25 > 35:
-        alert_type = "PM25_MEDIUM"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "Medium",
-                "title": "Elevated PM2.5 Levels",
-                "message": "PM2.5 levels are above recommended limits. Improve ventilation.",
-                "sensor": "PMS5003",
-                "timestamp": now
-            })
 
-    # -----------------------------
+# ----------------------------------
+# Alert definitions
+# ----------------------------------
+# alert_type -> (severity, title, message, sensor)
+ALERT_TYPES = {
+    # PM2.5 (PMS5003)
+    "PM25_HIGH": ("High", "High PM2.5 Pollution",
+                  "Fine particulate matter is very high. Use an air purifier and reduce exposure.", "PMS5003"),
+    "PM25_MEDIUM": ("Medium", "Elevated PM2.5 Levels",
+                    "PM2.5 levels are above recommended limits. Improve ventilation.", "PMS5003"),
     # PM10 (PMS5003)
-    # -----------------------------
-    pm10 = data.get("pm10", 0)
-
-    if pm10 > 100:
-        alert_type = "PM10_HIGH"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "High",
-                "title": "High PM10 Levels",
-                "message": "Coarse particulate pollution is high. Avoid dust sources indoors.",
-                "sensor": "PMS5003",
-                "timestamp": now
-            })
-
-    elif pm10 > 50:
-        alert_type = "PM10_MEDIUM"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "Medium",
-                "title": "Elevated PM10 Levels",
-                "message": "PM10 levels are elevated. Clean surfaces and improve airflow.",
-                "sensor": "PMS5003",
-                "timestamp": now
-            })
-
-    # -----------------------------
+    "PM10_HIGH": ("High", "High PM10 Levels",
+                  "Coarse particulate pollution is high. Avoid dust sources indoors.", "PMS5003"),
+    "PM10_MEDIUM": ("Medium", "Elevated PM10 Levels",
+                    "PM10 levels are elevated. Clean surfaces and improve airflow.", "PMS5003"),
     # Noise (Sound Sensor)
-    # -----------------------------
-    noise = data.get("noise", 0)
-
-    if noise > 90:
-        alert_type = "NOISE_HIGH"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "High",
-                "title": "Excessive Noise Exposure",
-                "message": "Noise levels are hazardous. Prolonged exposure may cause hearing discomfort.",
-                "sensor": "Sound Sensor",
-                "timestamp": now
-            })
-
-    elif noise > 75:
-        alert_type = "NOISE_MEDIUM"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "Medium",
-                "title": "Elevated Noise Levels",
-                "message": "Noise levels exceed comfort limits. Consider reducing volume or relocating.",
-                "sensor": "Sound Sensor",
-                "timestamp": now
-            })
-
-    # -----------------------------
+    "NOISE_HIGH": ("High", "Excessive Noise Exposure",
+                   "Noise levels are hazardous. Prolonged exposure may cause hearing discomfort.", "Sound Sensor"),
+    "NOISE_MEDIUM": ("Medium", "Elevated Noise Levels",
+                     "Noise levels exceed comfort limits. Consider reducing volume or relocating.", "Sound Sensor"),
     # Humidity (BME680)
-    # -----------------------------
-    humidity = data.get("humidity", 0)
-
-    if humidity > 75:
-        alert_type = "HUMIDITY_HIGH"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "Medium",
-                "title": "High Humidity Detected",
-                "message": "High humidity may increase mold growth risk. Use a dehumidifier.",
-                "sensor": "BME680",
-                "timestamp": now
-            })
-
-    elif humidity < 30:
-        alert_type = "HUMIDITY_LOW"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "Low",
-                "title": "Low Humidity Detected",
-                "message": "Low humidity may cause dryness and discomfort. Consider a humidifier.",
-                "sensor": "BME680",
-                "timestamp": now
-            })
-
-    # -----------------------------
+    "HUMIDITY_HIGH": ("Medium", "High Humidity Detected",
+                      "High humidity may increase mold growth risk. Use a dehumidifier.", "BME680"),
+    "HUMIDITY_LOW": ("Low", "Low Humidity Detected",
+                     "Low humidity may cause dryness and discomfort. Consider a humidifier.", "BME680"),
     # Temperature (DHT11/BME680)
-    # -----------------------------
-    temp = data.get("temperature", 22)
+    "TEMP_HIGH": ("High", "High Temperature",
+                  "Room temperature is excessively high (>30°C). Improve cooling.", "Temperature Sensor"),
+    "TEMP_LOW": ("Medium", "Low Temperature",
+                 "Room is too cold (<16°C). Check heating.", "Temperature Sensor"),
+}
+
+# Missing metrics: 0, except temperature which assumes a comfortable 22°C
+_DEFAULT_BANDS = default_vector({"pm25": 0, "pm10": 0, "noise": 0, "humidity": 0, "temperature": 22})
+
+
+@lru_cache(maxsize=4096)
+def alert_types_for_bands(bands: tuple) -> tuple:
+    """Alert types whose condition holds for a band vector (bands.py), in emit order."""
+    bands = with_defaults(bands, _DEFAULT_BANDS)
+    types = []
+
+    if above(bands, "pm25", 55):
+        types.append("PM25_HIGH")
+    elif above(bands, "pm25", 35):
+        types.append("PM25_MEDIUM")
+
+    if above(bands, "pm10", 100):
+        types.append("PM10_HIGH")
+    elif above(bands, "pm10", 50):
+        types.append("PM10_MEDIUM")
+
+    if above(bands, "noise", 90):
+        types.append("NOISE_HIGH")
+    elif above(bands, "noise", 75):
+        types.append("NOISE_MEDIUM")
+
+    if above(bands, "humidity", 75):
+        types.append("HUMIDITY_HIGH")
+    elif below(bands, "humidity", 30):
+        types.append("HUMIDITY_LOW")
+
+    if above(bands, "temperature", 30):
+        types.append("TEMP_HIGH")
+    elif below(bands, "temperature", 16):
+        types.append("TEMP_LOW")
+
+    return tuple(types)
+
+
+def generate_alerts(data: dict, bands: tuple = None):
+    """`bands`: the reading's band_vector, when the caller already has it."""
+    if bands is None:
+        bands = band_vector(data)
+    device_id = data.get("device_id", "unknown")
+    types = ACTIVE_CONDITIONS[device_id] = alert_types_for_bands(bands)
+    if not types:
+        return []
 
-    if temp > 30:
-        alert_type = "TEMP_HIGH"
-        if _can_emit(device_id, alert_type):
-            alerts.append({
-                "id": _new_alert_id(alert_type),
-                "severity": "High",
-                "title": "High Temperature",
-                "message": "Room temperature is excessively high (>30°C). Improve cooling.",
-                "sensor": "Temperature Sensor",
-                "timestamp": now
-            })
-    elif temp < 16:
-        alert_type = "TEMP_LOW"
-        if _can_emit(device_id, alert_type):
+    alerts = []
+    now_dt = datetime.utcnow()
+    now = now_dt.isoformat()
+    for alert_type in types:
+        if _can_emit(device_id, alert_type, now_dt):
+            severity, title, message, sensor = ALERT_TYPES[alert_type]
             alerts.append({
                 "id": _new_alert_id(alert_type),
-                "severity": "Medium",
-                "title": "Low Temperature",
-                "message": "Room is too cold (<16°C). Check heating.",
-                "sensor": "Temperature Sensor",
+                "severity": severity,
+                "title": title,
+                "message": message,
+                "sensor": sensor,
                 "timestamp": now
             })
 
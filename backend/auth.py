@@ -1,26 +1,128 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
 from jose import JWTError, jwt
 import bcrypt
 
+from cache import TTLCache
+
 # SECRET KEY (in production, use env variable!)
 SECRET_KEY = "supersecretkey_healthhack_change_me"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300
 
+# Verified tokens are remembered briefly so dashboard polling doesn't redo
+# the HMAC check on every request. Entries never outlive the token's "exp".
+TOKEN_CACHE_TTL = 60  # seconds
+TOKEN_CACHE = TTLCache(maxsize=1024, ttl=TOKEN_CACHE_TTL)
+
+# bcrypt cost factor (log2 rounds). Changing it rehashes users on their next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashing runs in its own process pool so a login burst can't stall the
+# request threadpool. Work beyond HASH_MAX_PENDING is rejected, not queued.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "32"))
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     # bcrypt.checkpw expects bytes
     password_bytes = plain_password.encode('utf-8')
     hashed_bytes = hashed_password.encode('utf-8')
     return bcrypt.checkpw(password_bytes, hashed_bytes)
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: int = None) -> str:
     # bcrypt.hashpw returns bytes
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a different cost factor than BCRYPT_ROUNDS."""
+    # Format: $2b$<rounds>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+# ---------------------------
+# HASHING POOL
+# ---------------------------
+
+class HashQueueFull(Exception):
+    pass
+
+_HASH_POOL = None
+_HASH_LOCK = threading.Lock()
+HASH_STATS = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "pending": 0,
+    "max_pending": 0,
+    "total_seconds": 0.0,
+}
+
+def _get_hash_pool():
+    global _HASH_POOL
+    with _HASH_LOCK:
+        if _HASH_POOL is None:
+            # Not fork: by the time the first login arrives the logging,
+            # ingest writer and retention threads are running, and a forked
+            # child would inherit their locks in whatever state they were in
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _HASH_POOL = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=context)
+        return _HASH_POOL
+
+async def _run_in_hash_pool(fn, *args):
+    with _HASH_LOCK:
+        if HASH_STATS["pending"] >= HASH_MAX_PENDING:
+            HASH_STATS["rejected"] += 1
+            raise HashQueueFull()
+        HASH_STATS["submitted"] += 1
+        HASH_STATS["pending"] += 1
+        HASH_STATS["max_pending"] = max(HASH_STATS["max_pending"], HASH_STATS["pending"])
+
+    started = time.perf_counter()
+    outcome = "failed"
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_get_hash_pool(), fn, *args)
+        outcome = "completed"
+        return result
+    finally:
+        with _HASH_LOCK:
+            HASH_STATS["pending"] -= 1
+            HASH_STATS[outcome] += 1
+            HASH_STATS["total_seconds"] += time.perf_counter() - started
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hash_pool(get_password_hash, password, BCRYPT_ROUNDS)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+def hash_pool_stats() -> dict:
+    finished = HASH_STATS["completed"] + HASH_STATS["failed"]
+    return {
+        **HASH_STATS,
+        "workers": HASH_WORKERS,
+        "avg_seconds": round(HASH_STATS["total_seconds"] / finished, 4) if finished else 0.0,
+    }
+
+def shutdown_hash_pool():
+    global _HASH_POOL
+    with _HASH_LOCK:
+        if _HASH_POOL is not None:
+            _HASH_POOL.shutdown(wait=False, cancel_futures=True)
+            _HASH_POOL = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -38,3 +140,18 @@ def decode_access_token(token: str):
         return payload
     except JWTError:
         return None
+
+def decode_access_token_cached(token: str):
+    payload = TOKEN_CACHE.get(token)
+    if payload is not None:
+        return payload
+
+    payload = decode_access_token(token)
+    if payload:
+        remaining = payload.get("exp", 0) - time.time()
+        if remaining > 0:
+            TOKEN_CACHE.set(token, payload, ttl=min(TOKEN_CACHE_TTL, remaining))
+    return payload
+
+def invalidate_token(token: str):
+    TOKEN_CACHE.invalidate(token)
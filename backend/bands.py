@@ -0,0 +1,85 @@
+from bisect import bisect_left, bisect_right
+
+# ---------------------------
+# THRESHOLD BANDS
+# ---------------------------
+# Every threshold the health, alerts and recommendation engines compare a
+# metric against. Two readings with the same band vector get the same
+# health level, recommendations and alert conditions; only the numbers
+# quoted in the health reasons (and the continuous AQI) can differ.
+# Keep this in sync when an engine gains or moves a threshold.
+#
+# The ingest pipeline computes the vector once per reading and hands it to
+# all three engines, which memoize their band-dependent output on it.
+
+BAND_THRESHOLDS = {
+    "pm25": (15, 35, 55),
+    "pm10": (45, 50, 75, 100),
+    "co2": (800, 1200),
+    "vocs": (500,),
+    "temperature": (15, 16, 18, 27, 28, 30, 32),
+    "humidity": (30, 60, 65, 70, 75),
+    "noise": (55, 70, 75, 80, 90),
+    "light": (50, 100, 1000),
+}
+
+BAND_METRICS = tuple(BAND_THRESHOLDS)
+
+_POSITION = {m: i for i, m in enumerate(BAND_METRICS)}
+_SPECS = tuple((m, t, len(t)) for m, t in BAND_THRESHOLDS.items())
+
+MISSING = -1
+
+
+def band(value, thresholds) -> int:
+    """
+    Band index of `value`. Sitting exactly on a threshold is its own band,
+    so both `>` and `<` comparisons in the engines are respected.
+    """
+    if value is None:
+        return MISSING
+    return bisect_left(thresholds, value) + bisect_right(thresholds, value)
+
+
+def band_vector(reading: dict) -> tuple:
+    """Missing / None metrics are MISSING; engines fill in their own defaults."""
+    # band() inlined: this runs once per ingested reading
+    get = reading.get
+    out = []
+    for metric, thresholds, count in _SPECS:
+        value = get(metric)
+        if value is None:
+            out.append(MISSING)
+        else:
+            i = bisect_left(thresholds, value)
+            out.append(2 * i + 1 if i < count and thresholds[i] == value else 2 * i)
+    return tuple(out)
+
+
+def with_defaults(bands: tuple, default_bands: tuple) -> tuple:
+    """
+    Projects a band vector onto one engine (see default_vector): MISSING
+    entries take the engine's default band and metrics the engine never
+    reads are blanked, so they don't split its memo cache.
+    """
+    return tuple(
+        MISSING if d is None else (d if b == MISSING else b) for b, d in zip(bands, default_bands)
+    )
+
+
+def default_vector(defaults: dict) -> tuple:
+    """Band vector of an engine's fallback values; None for metrics it never reads."""
+    return tuple(
+        band(defaults[m], BAND_THRESHOLDS[m]) if m in defaults else None for m in BAND_METRICS
+    )
+
+
+def above(bands: tuple, metric: str, threshold) -> bool:
+    """value > threshold"""
+    return bands[_POSITION[metric]] >= 2 * BAND_THRESHOLDS[metric].index(threshold) + 2
+
+
+def below(bands: tuple, metric: str, threshold) -> bool:
+    """value < threshold (a MISSING metric is never below)"""
+    b = bands[_POSITION[metric]]
+    return b != MISSING and b <= 2 * BAND_THRESHOLDS[metric].index(threshold)
@@ -0,0 +1,262 @@
+"""
+Micro-benchmarks for the pure-Python engines on the request path.
+
+Each engine runs over a fixed, seeded synthetic dataset. For every engine we
+report per-call latency (best of --repeat runs), batch throughput and
+allocations per call (tracemalloc, measured in a separate pass so tracing
+does not skew the timings).
+
+Run from the backend folder:
+
+    python -m benchmarks.engine_bench
+    python -m benchmarks.engine_bench --save-baseline benchmarks/engine_baseline.json
+    python -m benchmarks.engine_bench --compare benchmarks/engine_baseline.json
+
+Exits with status 1 if any engine exceeds its budget in BUDGETS or, with
+--compare, regresses beyond the tolerances vs the saved baseline.
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import alerts_engine
+from agent_engine import simple_linear_regression
+from aqi_engine import calculate_pm_aqi
+from bands import band_vector
+from health_engine import calculate_health_score
+from recommendation_engine import generate_recommendations
+
+DATASET_SIZE = 1000
+HISTORY_LENGTH = 60
+
+# Absolute ceilings per engine. Roughly 5x what a laptop measures today, so
+# they only trip on real algorithmic regressions, not noisy machines.
+BUDGETS = {
+    "health_score":      {"us_per_call": 15.0, "alloc_bytes_per_call": 2048},
+    "alerts":            {"us_per_call": 50.0, "alloc_bytes_per_call": 4096},
+    "recommendations":   {"us_per_call": 5.0, "alloc_bytes_per_call": 2048},
+    "aqi":               {"us_per_call": 10.0, "alloc_bytes_per_call": 2048},
+    "band_vector":       {"us_per_call": 10.0, "alloc_bytes_per_call": 1024},
+    "linear_regression": {"us_per_call": 50.0, "alloc_bytes_per_call": 2048},
+}
+
+# Allowed change vs a saved baseline before --compare fails
+LATENCY_TOLERANCE = 0.25
+ALLOC_TOLERANCE = 0.25
+
+
+# ---------------------------
+# SYNTHETIC DATASETS
+# ---------------------------
+
+def make_readings(n: int = DATASET_SIZE, seed: int = 7):
+    """
+    Readings spread across every band the engines branch on (clean air,
+    moderate, hazardous, cold/hot, loud, dim...) so all code paths run.
+    """
+    rng = random.Random(seed)
+    readings = []
+    for i in range(n):
+        readings.append({
+            "device_id": f"bench_dev_{i:05d}",
+            "temperature": round(rng.uniform(10, 36), 2),
+            "humidity": round(rng.uniform(15, 90), 2),
+            "pm25": round(rng.choice((rng.uniform(1, 12), rng.uniform(12, 60), rng.uniform(60, 240))), 2),
+            "pm10": round(rng.uniform(5, 400), 2),
+            "noise": round(rng.uniform(25, 95), 1),
+            "light": round(rng.uniform(10, 1500), 1),
+            "co2": round(rng.uniform(400, 2000), 1),
+            "vocs": round(rng.uniform(10, 900), 1),
+            "pressure": round(rng.uniform(990, 1030), 1),
+            "timestamp": datetime(2026, 1, 1).isoformat(),
+        })
+    return readings
+
+
+def make_series(n: int = DATASET_SIZE, length: int = HISTORY_LENGTH, seed: int = 11):
+    """Random-walk series the size of DEVICE_HISTORY, as fed to the forecast."""
+    rng = random.Random(seed)
+    series = []
+    for _ in range(n):
+        value = rng.uniform(5, 50)
+        values = []
+        for _ in range(length):
+            value = max(0.0, value + rng.gauss(0, 1.5))
+            values.append(round(value, 2))
+        series.append(values)
+    return series
+
+
+def _alerts(reading):
+    # Cooldown state would suppress every call after the first per device
+    alerts_engine.ALERT_CACHE.clear()
+    return alerts_engine.generate_alerts(reading)
+
+
+def _aqi(reading):
+    return calculate_pm_aqi(reading["pm25"], reading["pm10"])
+
+
+def build_cases():
+    readings = make_readings()
+    series = make_series()
+    return {
+        "health_score": (calculate_health_score, readings),
+        "alerts": (_alerts, readings),
+        "recommendations": (generate_recommendations, readings),
+        "aqi": (_aqi, readings),
+        "band_vector": (band_vector, readings),
+        "linear_regression": (simple_linear_regression, series),
+    }
+
+
+# ---------------------------
+# MEASUREMENT
+# ---------------------------
+
+def time_batch(fn, items) -> float:
+    """Seconds to run fn over every item once."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        return time.perf_counter() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure_allocations(fn, items):
+    """(bytes retained per call by the results, peak bytes over the batch) via tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        snapshot_before = tracemalloc.take_snapshot()
+        results = [fn(item) for item in items]
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = snapshot_after.compare_to(snapshot_before, "filename")
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    del results
+    return allocated / len(items), peak - before
+
+
+def run_benchmarks(repeat: int = 5, only=None):
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "dataset_size": DATASET_SIZE,
+            "repeat": repeat,
+        },
+        "engines": {},
+    }
+
+    for name, (fn, items) in build_cases().items():
+        if only and name not in only:
+            continue
+        time_batch(fn, items[:50])  # warm-up
+        best = min(time_batch(fn, items) for _ in range(repeat))
+        per_call_alloc, peak = measure_allocations(fn, items)
+
+        report["engines"][name] = {
+            "calls": len(items),
+            "us_per_call": round(best / len(items) * 1e6, 3),
+            "calls_per_s": round(len(items) / best, 1),
+            "alloc_bytes_per_call": round(per_call_alloc, 1),
+            "peak_kb": round(peak / 1024, 1),
+        }
+    return report
+
+
+# ---------------------------
+# BUDGETS / BASELINES
+# ---------------------------
+
+def check_budgets(report, budgets=BUDGETS) -> list:
+    failures = []
+    for name, result in report["engines"].items():
+        budget = budgets.get(name)
+        if not budget:
+            continue
+        for key, limit in budget.items():
+            if result[key] > limit:
+                failures.append(f"{name}: {key} {result[key]} > budget {limit}")
+    return failures
+
+
+def compare(report, baseline) -> list:
+    regressions = []
+    for name, base in baseline["engines"].items():
+        cur = report["engines"].get(name)
+        if cur is None:
+            continue
+        if cur["us_per_call"] > base["us_per_call"] * (1 + LATENCY_TOLERANCE):
+            regressions.append(f"{name}: {base['us_per_call']}us -> {cur['us_per_call']}us per call")
+        if cur["alloc_bytes_per_call"] > base["alloc_bytes_per_call"] * (1 + ALLOC_TOLERANCE):
+            regressions.append(
+                f"{name}: {base['alloc_bytes_per_call']}B -> {cur['alloc_bytes_per_call']}B allocated per call"
+            )
+    return regressions
+
+
+def print_report(report):
+    meta = report["meta"]
+    print(f"\nEngine micro-benchmarks: {meta['dataset_size']} items, best of {meta['repeat']}, python {meta['python']}\n")
+    print(f"{'engine':<20}{'us/call':>10}{'calls/s':>12}{'B/call':>10}{'peak KB':>10}")
+    for name, e in report["engines"].items():
+        print(f"{name:<20}{e['us_per_call']:>10}{e['calls_per_s']:>12}{e['alloc_bytes_per_call']:>10}{e['peak_kb']:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the Monacos engines")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", choices=sorted(BUDGETS), help="engines to run")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.repeat, args.only)
+
+    print_report(report)
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    failures = check_budgets(report)
+    if args.compare:
+        with open(args.compare) as f:
+            failures += compare(report, json.load(f))
+
+    if failures:
+        print("\nBUDGET / BASELINE FAILURES:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nAll engines within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,345 @@
+"""
+Reproducible load test for the ingest and query paths.
+
+Drives the FastAPI app in-process (httpx ASGITransport, no network, no
+uvicorn) with a simulated device fleet at fixed request rates, then reports
+throughput and p50/p99 latency per endpoint, plus RSS. Python allocation
+peaks come from a short separate tracemalloc pass, never the measured one.
+
+Run from the backend folder:
+
+    python -m benchmarks.load_test                       # default scenario
+    python -m benchmarks.load_test --devices 500 --ingest-rate 2000 --duration 20
+    python -m benchmarks.load_test --save-baseline benchmarks/load_baseline.json
+    python -m benchmarks.load_test --compare benchmarks/load_baseline.json
+
+--compare exits with status 1 if any endpoint regressed beyond the tolerances.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import httpx
+
+# Isolated database so runs are reproducible and never touch monacos.db
+_TMP_DIR = tempfile.mkdtemp(prefix="monacos_load_")
+os.environ.setdefault("LOG_LEVEL", "WARNING")  # keep app logs out of the report
+
+import db  # noqa: E402
+db.DB_NAME = os.path.join(_TMP_DIR, "load.db")
+
+import main  # noqa: E402
+
+# Allowed change vs baseline before --compare fails
+P99_TOLERANCE = 0.30          # p99 may grow by 30%
+THROUGHPUT_TOLERANCE = 0.20   # throughput may drop by 20%
+
+
+# ---------------------------
+# SIMULATED FLEET
+# ---------------------------
+
+class FleetGenerator:
+    """
+    Produces realistic SensorPayload dicts for N devices: slow diurnal
+    temperature/humidity drift, occasional PM spikes (cooking), noise and
+    light following occupancy. Seeded, so runs are reproducible.
+    """
+
+    def __init__(self, devices: int, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.device_ids = [f"load_dev_{i:05d}" for i in range(devices)]
+        self.state = {
+            d: {
+                "temperature": self.rng.uniform(19, 25),
+                "humidity": self.rng.uniform(35, 60),
+                "pm25": self.rng.uniform(3, 15),
+                "co2": self.rng.uniform(420, 700),
+                "phase": self.rng.uniform(0, 2 * math.pi),
+                "spike": 0,
+            }
+            for d in self.device_ids
+        }
+        self.clock = datetime.utcnow()
+
+    def _walk(self, value, step, low, high):
+        return min(high, max(low, value + self.rng.gauss(0, step)))
+
+    def reading(self, device_id: str) -> dict:
+        s = self.state[device_id]
+        self.clock += timedelta(milliseconds=10)
+        hour = (self.clock.hour + self.clock.minute / 60) / 24 * 2 * math.pi + s["phase"]
+
+        s["temperature"] = self._walk(s["temperature"], 0.05, 15, 32) + 0.02 * math.sin(hour)
+        s["humidity"] = self._walk(s["humidity"], 0.2, 20, 85)
+        s["co2"] = self._walk(s["co2"], 8, 400, 2000)
+        if s["spike"] == 0 and self.rng.random() < 0.002:
+            s["spike"] = self.rng.randint(20, 120)
+        if s["spike"]:
+            s["spike"] -= 1
+            s["pm25"] = self._walk(s["pm25"] + 1.5, 1.0, 1, 250)
+        else:
+            s["pm25"] = self._walk(s["pm25"] * 0.98, 0.3, 1, 250)
+
+        occupied = 0.5 + 0.5 * math.sin(hour)
+        return {
+            "device_id": device_id,
+            "temperature": round(s["temperature"], 2),
+            "humidity": round(s["humidity"], 2),
+            "pm25": round(s["pm25"], 2),
+            "pm10": round(s["pm25"] * self.rng.uniform(1.2, 1.8), 2),
+            "noise": round(35 + 30 * occupied + self.rng.gauss(0, 3), 1),
+            "light": round(50 + 450 * occupied + self.rng.gauss(0, 20), 1),
+            "co2": round(s["co2"], 1),
+            "vocs": round(self.rng.uniform(50, 400), 1),
+            "pressure": round(1013 + self.rng.gauss(0, 2), 1),
+            "timestamp": self.clock.isoformat(),
+        }
+
+    def random_device(self) -> str:
+        return self.rng.choice(self.device_ids)
+
+
+# ---------------------------
+# SCENARIO
+# ---------------------------
+
+def build_endpoints(fleet: FleetGenerator, args):
+    """name -> (rate per second, request factory)"""
+    def ingest():
+        return "POST", "/api/ingest", fleet.reading(fleet.random_device())
+
+    def ingest_batch():
+        return "POST", "/api/ingest/batch", [fleet.reading(fleet.random_device()) for _ in range(args.batch_size)]
+
+    def get(path):
+        return lambda: ("GET", path.format(device=fleet.random_device()), None)
+
+    return {
+        "ingest": (args.ingest_rate, ingest),
+        "ingest_batch": (args.batch_rate, ingest_batch),
+        "latest": (args.read_rate, get("/api/latest/{device}")),
+        "history": (args.history_rate, get("/api/history/{device}")),
+        "devices": (args.devices_rate, get("/api/devices")),
+        "health_score": (args.read_rate, get("/api/health-score/{device}")),
+        "alerts": (args.read_rate, get("/api/alerts/{device}")),
+        "aqi": (args.read_rate, get("/api/aqi/{device}")),
+        "recommendations": (args.read_rate, get("/api/recommendations/{device}")),
+    }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+async def _drive(client, name, rate, factory, duration, slots, results):
+    """
+    Open-loop: requests are issued on schedule whether or not earlier ones
+    finished. Latency runs from the scheduled send time, so time spent
+    queued behind the scheduler or the concurrency cap counts (no
+    coordinated omission).
+    """
+    if rate <= 0:
+        return
+    latencies, errors = results[name]["latencies"], results[name]
+    interval = 1.0 / rate
+    pending = set()
+    start = time.perf_counter()
+    n = 0
+
+    async def one(t0, method, path, body):
+        async with slots:
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 500:
+                    errors["errors"] += 1
+                elif response.status_code >= 400:
+                    errors["client_errors"] += 1
+            except Exception:
+                errors["errors"] += 1
+            latencies.append(time.perf_counter() - t0)
+
+    while True:
+        due = start + n * interval
+        now = time.perf_counter()
+        if due - start >= duration:
+            break
+        if due > now:
+            await asyncio.sleep(due - now)
+        task = asyncio.create_task(one(due, *factory()))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        n += 1
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def current_rss_mb():
+    """Resident set size right now (Linux /proc); None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 1e6, 2)
+
+
+async def _run_pass(client, endpoints, args, duration):
+    results = {name: {"latencies": [], "errors": 0, "client_errors": 0} for name in endpoints}
+    slots = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        _drive(client, name, rate, factory, duration, slots, results)
+        for name, (rate, factory) in endpoints.items()
+    ])
+    return results, time.perf_counter() - started
+
+
+async def run_scenario(args):
+    fleet = FleetGenerator(args.devices, args.seed)
+    endpoints = build_endpoints(fleet, args)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            # Warm-up: every device reports once so reads have live state
+            for device_id in fleet.device_ids:
+                await client.post("/api/ingest", json=fleet.reading(device_id))
+
+            # Measured pass: RSS only, tracemalloc would slow every request
+            rss_before = current_rss_mb()
+            results, elapsed = await _run_pass(client, endpoints, args, args.duration)
+            rss_after = current_rss_mb()
+
+            # Separate, unmeasured pass for Python allocation peaks
+            peak = None
+            if args.tracemalloc_duration > 0:
+                tracemalloc.start()
+                await _run_pass(client, endpoints, args, args.tracemalloc_duration)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "devices": args.devices,
+            "duration_s": args.duration,
+            "elapsed_s": round(elapsed, 3),
+            "seed": args.seed,
+        },
+        "memory": {
+            "rss_before_mb": rss_before,
+            "rss_after_mb": rss_after,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+            "tracemalloc_peak_mb": None if peak is None else round(peak / 1e6, 2),
+        },
+        "endpoints": {},
+    }
+    for name, r in results.items():
+        lat = sorted(r["latencies"])
+        if not lat:
+            continue
+        report["endpoints"][name] = {
+            "requests": len(lat),
+            "throughput_rps": round(len(lat) / elapsed, 1),
+            "p50_ms": round(percentile(lat, 50) * 1000, 3),
+            "p99_ms": round(percentile(lat, 99) * 1000, 3),
+            "max_ms": round(lat[-1] * 1000, 3),
+            "errors": r["errors"],
+            "client_errors": r["client_errors"],
+        }
+    return report
+
+
+# ---------------------------
+# REPORTING / BASELINES
+# ---------------------------
+
+def print_report(report):
+    meta, mem = report["meta"], report["memory"]
+    print(f"\nLoad test: {meta['devices']} devices, {meta['elapsed_s']}s, python {meta['python']}")
+    print(f"Memory: RSS {mem['rss_before_mb']} -> {mem['rss_after_mb']} MB over the measured run, "
+          f"max RSS {mem['max_rss_mb']} MB, tracemalloc peak {mem['tracemalloc_peak_mb']} MB (separate pass)\n")
+    print(f"{'endpoint':<16}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, e in report["endpoints"].items():
+        print(f"{name:<16}{e['requests']:>10}{e['throughput_rps']:>10}{e['p50_ms']:>10}{e['p99_ms']:>10}{e['errors']:>8}")
+
+
+def compare(report, baseline) -> list:
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        cur = report["endpoints"].get(name)
+        if cur is None:
+            continue
+        if cur["p99_ms"] > base["p99_ms"] * (1 + P99_TOLERANCE):
+            regressions.append(f"{name}: p99 {base['p99_ms']}ms -> {cur['p99_ms']}ms")
+        if cur["throughput_rps"] < base["throughput_rps"] * (1 - THROUGHPUT_TOLERANCE):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {cur['throughput_rps']} rps")
+        if cur["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {cur['errors']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="In-process load test for the Monacos API")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--ingest-rate", type=float, default=300.0, help="single ingests per second")
+    parser.add_argument("--batch-rate", type=float, default=5.0, help="batch ingests per second")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--read-rate", type=float, default=50.0, help="per derived/latest endpoint")
+    parser.add_argument("--history-rate", type=float, default=10.0)
+    parser.add_argument("--devices-rate", type=float, default=2.0)
+    parser.add_argument("--tracemalloc-duration", type=float, default=3.0,
+                        help="seconds of the separate tracemalloc pass after the measured run (0 = skip)")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_scenario(args))
+
+    print_report(report)
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline)
+        if regressions:
+            print("\nREGRESSIONS vs baseline:")
+            for r in regressions:
+                print(f"  - {r}")
+            return 1
+        print("\nNo regressions vs baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
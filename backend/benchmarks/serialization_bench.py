@@ -0,0 +1,231 @@
+"""
+Serialization benchmark for large JSON responses.
+
+Builds a seeded 100k-row history payload (the shape /api/history and
+/api/export?format=json return) and times, best of --repeat:
+
+  fastapi_default   jsonable_encoder + starlette JSONResponse (the old path)
+  encoder_fast      jsonable_encoder + FastJSONResponse (plain return value
+                    under the default response class)
+  fast_direct       FastJSONResponse(rows), as the history endpoints return
+
+once with timestamps as strings (rows read back from SQLite) and once as
+datetimes (live readings). With NumPy installed, a 100k float64 forecast
+array is added (fast_direct vs .tolist() + json.dumps). Every fast output
+is checked to decode to the same JSON as the default path.
+
+Run from the backend folder:
+
+    python -m benchmarks.serialization_bench
+    python -m benchmarks.serialization_bench --rows 20000 --save-baseline benchmarks/serialization_baseline.json
+    python -m benchmarks.serialization_bench --compare benchmarks/serialization_baseline.json
+
+Exits with status 1 if an output differs, fast_direct is less than
+MIN_SPEEDUP times faster than fastapi_default, or (with --compare) a case
+regressed beyond LATENCY_TOLERANCE vs the saved baseline.
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import fast_json
+from fast_json import FastJSONResponse
+
+DATASET_ROWS = 100_000
+MIN_SPEEDUP = 3.0          # fast_direct vs fastapi_default
+LATENCY_TOLERANCE = 0.25
+
+METRICS = (
+    "temperature", "humidity", "pm25", "pm10", "noise", "light",
+    "altitude", "pressure", "co2", "vocs", "aqi", "air_quality_score",
+)
+
+
+# ---------------------------
+# SYNTHETIC PAYLOADS
+# ---------------------------
+
+def make_history(rows: int = DATASET_ROWS, seed: int = 11, datetimes: bool = False):
+    """History rows as read_history returns them: id, device_id, metrics, timestamp."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    history = []
+    for i in range(rows):
+        row = {"id": i + 1, "device_id": "bench_dev_00001"}
+        for metric in METRICS:
+            row[metric] = None if rng.random() < 0.05 else round(rng.uniform(0, 500), 2)
+        ts = start + timedelta(seconds=5 * i, microseconds=rng.randrange(1_000_000))
+        row["timestamp"] = ts if datetimes else ts.isoformat(" ")
+        history.append(row)
+    return history
+
+
+def _default_render(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def _encoder_fast_render(content) -> bytes:
+    return FastJSONResponse(jsonable_encoder(content)).body
+
+
+def _fast_render(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def build_cases(rows: int):
+    """name -> (payload, {variant: fn}); the first variant is the reference output."""
+    paths = {
+        "fastapi_default": _default_render,
+        "encoder_fast": _encoder_fast_render,
+        "fast_direct": _fast_render,
+    }
+    cases = {
+        "history_str_ts": (make_history(rows), paths),
+        "history_datetime": (make_history(rows, datetimes=True), paths),
+    }
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        series = {"pm25": numpy.random.default_rng(3).uniform(0, 500, rows)}
+        cases["numpy_forecast"] = (series, {
+            "fastapi_default": lambda c: JSONResponse({k: v.tolist() for k, v in c.items()}).body,
+            "fast_direct": _fast_render,
+        })
+    return cases
+
+
+# ---------------------------
+# MEASUREMENT
+# ---------------------------
+
+def time_once(fn, payload) -> float:
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        fn(payload)
+        return time.perf_counter() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def run_benchmarks(rows: int = DATASET_ROWS, repeat: int = 3):
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "rows": rows,
+            "repeat": repeat,
+            "orjson": fast_json.orjson is not None,
+        },
+        "cases": {},
+        "mismatches": [],
+    }
+
+    for case, (payload, variants) in build_cases(rows).items():
+        reference = None
+        for variant, fn in variants.items():
+            body = fn(payload)
+            decoded = json.loads(body)
+            if reference is None:
+                reference = decoded
+            elif decoded != reference:
+                report["mismatches"].append(f"{case}/{variant}: output differs from {next(iter(variants))}")
+
+            best = min(time_once(fn, payload) for _ in range(repeat))
+            report["cases"][f"{case}/{variant}"] = {
+                "ms": round(best * 1000, 2),
+                "rows_per_s": round(rows / best),
+                "mb": round(len(body) / 1e6, 2),
+            }
+    return report
+
+
+# ---------------------------
+# CHECKS / BASELINES
+# ---------------------------
+
+def check_speedup(report) -> list:
+    failures = list(report["mismatches"])
+    for name, result in report["cases"].items():
+        case, variant = name.split("/")
+        if variant != "fast_direct":
+            continue
+        default = report["cases"].get(f"{case}/fastapi_default")
+        if default and default["ms"] < result["ms"] * MIN_SPEEDUP:
+            failures.append(
+                f"{case}: fast_direct {result['ms']}ms is not {MIN_SPEEDUP}x faster than {default['ms']}ms"
+            )
+    return failures
+
+
+def compare(report, baseline) -> list:
+    regressions = []
+    if baseline["meta"]["rows"] != report["meta"]["rows"]:
+        return [f"baseline has {baseline['meta']['rows']} rows, this run {report['meta']['rows']}"]
+    for name, base in baseline["cases"].items():
+        cur = report["cases"].get(name)
+        if cur and cur["ms"] > base["ms"] * (1 + LATENCY_TOLERANCE):
+            regressions.append(f"{name}: {base['ms']}ms -> {cur['ms']}ms")
+    return regressions
+
+
+def print_report(report):
+    meta = report["meta"]
+    backend = "orjson" if meta["orjson"] else "stdlib json fallback"
+    print(f"\nSerialization: {meta['rows']} rows, best of {meta['repeat']}, {backend}, python {meta['python']}\n")
+    print(f"{'case':<36}{'ms':>10}{'rows/s':>12}{'MB':>8}")
+    for name, r in report["cases"].items():
+        print(f"{name:<36}{r['ms']:>10}{r['rows_per_s']:>12}{r['mb']:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="JSON serialization benchmark for large responses")
+    parser.add_argument("--rows", type=int, default=DATASET_ROWS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.rows, args.repeat)
+
+    print_report(report)
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    failures = check_speedup(report)
+    if args.compare:
+        with open(args.compare) as f:
+            failures += compare(report, json.load(f))
+
+    if failures:
+        print("\nSERIALIZATION FAILURES:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nFast path within expectations.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,80 +1,445 @@
+import argparse
 import asyncio
 import json
+import random
+import time
+from datetime import datetime, timezone
 import aiohttp
-from bleak import BleakScanner, BleakClient
+
+from ble_transport import BleakTransport, SimulatedHub, SimulatedTransport
+from gateway_spool import Spool
+import reading_codec
 
 # Configuration
-# Service UUID and Characteristic UUID from scanner output
-SERVICE_UUID = "00001234-0000-1000-8000-00805f9b34fb"
-CHARACTERISTIC_UUID = "0000abcd-0000-1000-8000-00805f9b34fb"
+# Every hub advertising a name starting with this is relayed
 DEVICE_NAME = "Monacos_Indoor_Hub"
 
-API_URL = "http://localhost:8001/api/ingest"
+# Scanning / reconnect
+SCAN_INTERVAL = 10.0     # seconds between discovery scans
+SCAN_TIMEOUT = 5.0
+RECONNECT_BASE = 1.0     # first reconnect delay, doubled per failure...
+RECONNECT_MAX = 60.0     # ...up to this
+STATS_INTERVAL = 30.0
+
+BATCH_API_URL = "http://localhost:8001/api/ingest/batch"
+BINARY_API_URL = "http://localhost:8001/api/ingest/binary"
+
+# Forwarding
+BATCH_SIZE = 50          # flush when this many readings are queued...
+FLUSH_INTERVAL = 1.0     # ...or after this many seconds, whichever comes first
+MAX_QUEUE = 5000         # readings buffered in memory before dropping the oldest
+MAX_CONCURRENCY = 4      # simultaneous POSTs to the backend
+
+# Offline buffering
+SPOOL_PATH = "gateway_spool.bin"
+SPOOL_CAPACITY = 64 * 1024 * 1024   # bytes on disk before the oldest readings are dropped
+REPLAY_INTERVAL = 2.0               # seconds between replay attempts while the spool is non-empty
+REPLAY_BATCH = 500                  # readings per replay POST
+
+# 4xx replies mean the backend will never accept the batch as sent, so it is
+# dropped (and counted) instead of spooled. These two are worth retrying.
+RETRYABLE_4XX = (408, 429)
 
-async def send_to_api(data):
+
+def stamp_received(payload, when: float):
     """
-    Sends the received JSON data to the backend API.
+    Gives a reading without a device timestamp its receive time (unix
+    seconds), before it is queued or spooled. Otherwise the backend would
+    stamp it on arrival, and a reading replayed from the spool hours later
+    would pass as current.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(API_URL, json=data) as response:
+    if isinstance(payload, bytes):
+        return reading_codec.stamp_record(payload, when)
+    if isinstance(payload, dict) and payload.get("timestamp") is None:
+        # Naive UTC, as the backend stores timestamps
+        payload["timestamp"] = datetime.fromtimestamp(when, timezone.utc).replace(tzinfo=None).isoformat()
+    return payload
+
+
+class ApiForwarder:
+    """
+    Relays readings to the backend over one long-lived keep-alive session.
+    Readings are queued and posted in bulk to the batch endpoint. Batches the
+    backend doesn't accept go to the on-disk spool and are replayed in order.
+    """
+
+    def __init__(self, url=BATCH_API_URL, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queue=MAX_QUEUE, max_concurrency=MAX_CONCURRENCY, spool=None,
+                 binary_url=BINARY_API_URL):
+        self.url = url
+        self.binary_url = binary_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_concurrency = max_concurrency
+
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.session = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._worker = None
+        self._inflight = set()
+        self._building = []
+
+        self.spool = spool
+        self._replayer = None
+        self._syncs = set()   # spool fsyncs running in the default executor
+
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "rejected": 0, "dropped": 0, "batches": 0, "spooled": 0}
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        self._worker = asyncio.create_task(self._run())
+        if self.spool:
+            self._replayer = asyncio.create_task(self._replay_loop())
+
+    def submit(self, payload):
+        """
+        Non-blocking enqueue, safe to call from BLE callbacks. `payload` is a
+        reading dict (JSON path) or one raw binary record (bytes).
+        When the queue is full the oldest reading is dropped.
+        """
+        payload = stamp_received(payload, time.time())
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.stats["dropped"] += 1
+        self.queue.put_nowait(payload)
+        self.stats["queued"] += 1
+
+    async def _next_batch(self):
+        # Kept on self so close() can flush a partially collected batch
+        self._building = batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._building = []
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Blocks here when MAX_CONCURRENCY posts are in flight (backpressure)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._post(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _post_body(self, url, count, **kwargs) -> bool:
+        """
+        Returns False only when the POST is worth retrying (network error,
+        5xx, 408/429). A batch rejected with any other 4xx is dropped and
+        counted, or it would block the spool replay forever.
+        """
+        try:
+            async with self.session.post(url, **kwargs) as response:
                 if response.status == 200:
-                    print(f"✅ Data forwarded to API: {data}")
-                else:
-                    print(f"⚠️ API Error {response.status}: {await response.text()}")
-    except Exception as e:
-        print(f"❌ Failed to send to API: {e}")
+                    self.stats["sent"] += count
+                    self.stats["batches"] += 1
+                    return True
+                detail = await response.text()
+                if 400 <= response.status < 500 and response.status not in RETRYABLE_4XX:
+                    self.stats["rejected"] += count
+                    print(f"🚫 API rejected {count} readings ({response.status}), dropping them: {detail}")
+                    return True
+                print(f"⚠️ API Error {response.status}: {detail}")
+        except Exception as e:
+            print(f"❌ Failed to send to API: {e}")
+        self.stats["failed"] += count
+        return False
+
+    async def _send(self, batch):
+        """
+        Posts JSON readings to the batch endpoint and binary records to the
+        binary endpoint. Returns the readings that were not delivered and
+        should be retried (rejected ones are not).
+        """
+        json_items = [p for p in batch if not isinstance(p, bytes)]
+        binary_items = [p for p in batch if isinstance(p, bytes)]
+        undelivered = []
+
+        if json_items and not await self._post_body(self.url, len(json_items), json=json_items):
+            undelivered += json_items
+        if binary_items and not await self._post_body(
+            self.binary_url, len(binary_items),
+            data=b"".join(binary_items),
+            headers={"Content-Type": reading_codec.CONTENT_TYPE},
+        ):
+            undelivered += binary_items
+        return undelivered
+
+    async def _post(self, batch):
+        try:
+            undelivered = await self._send(batch)
+            if len(undelivered) < len(batch):
+                print(f"✅ Forwarded {len(batch) - len(undelivered)} readings to API")
+            if undelivered and self.spool:
+                self.spool.append_many(undelivered, sync=False)
+                self.stats["spooled"] += len(undelivered)
+                await self._sync_spool()
+        finally:
+            self._slots.release()
+
+    async def _sync_spool(self):
+        """fsyncs the spool on a worker thread so BLE callbacks keep running."""
+        future = asyncio.get_running_loop().run_in_executor(None, self.spool.sync)
+        self._syncs.add(future)
+        try:
+            await future
+        finally:
+            self._syncs.discard(future)
+
+    async def _replay_loop(self):
+        while True:
+            await asyncio.sleep(REPLAY_INTERVAL)
+            if self.spool.pending:
+                await self.replay()
+
+    async def replay(self):
+        """
+        Drains the spool oldest-first until it is empty or a POST fails.
+        Batches the backend rejected (4xx) are released like delivered ones.
+        """
+        started = time.monotonic()
+        records = nbytes = 0
+
+        while self.spool.pending:
+            before = self.spool.pending_bytes
+            batch, first_seq = self.spool.read_batch(REPLAY_BATCH)
+            if await self._send(batch):
+                # Nothing is released; anything already delivered is resent
+                # later. Every reading carries its receive time (see
+                # stamp_received), so the backend stores it only once
+                # (unique device_id + timestamp) and keeps it out of live state.
+                break
+            self.spool.commit(first_seq, len(batch), sync=False)
+            records += len(batch)
+            nbytes += before - self.spool.pending_bytes
+
+        if records:
+            # A lost commit only means a resend, which the backend dedupes
+            await self._sync_spool()
+            self.spool.record_replay_run(records, nbytes, time.monotonic() - started)
+            print(f"🔁 Replayed {records} spooled readings ({self.spool.pending} still pending)")
+
+    async def close(self):
+        """Flushes whatever is queued, waits for in-flight posts and closes the session."""
+        for task in (self._worker, self._replayer):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        pending = self._building
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for i in range(0, len(pending), self.batch_size):
+            await self._slots.acquire()
+            await self._post(pending[i:i + self.batch_size])
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._syncs:
+            await asyncio.gather(*self._syncs, return_exceptions=True)
+        if self.session:
+            await self.session.close()
+        if self.spool:
+            self.spool.close()
 
-def notification_handler(sender, data):
+
+# ---------------------------
+# MULTI-DEVICE GATEWAY
+# ---------------------------
+
+class DeviceSession:
     """
-    Callback for when a BLE notification is received.
+    Owns the link to one hub: connects, relays notifications to the
+    forwarder, and reconnects with exponential backoff when the link drops.
     """
-    try:
-        # Decode bytes to string
-        json_str = data.decode('utf-8')
-        print(f"📩 Received from BLE: {json_str}")
-        
-        # Parse JSON
-        payload = json.loads(json_str)
-        
-        # Forward to API asynchronously
-        # Since this callback is synchronous, we create a task
-        asyncio.create_task(send_to_api(payload))
-        
-    except Exception as e:
-        print(f"Error processing notification: {e}")
-
-async def run():
-    print("🔍 Scanning for Monacos Indoor Hub...")
-    device = await BleakScanner.find_device_by_filter(
-        lambda d, ad: d.name and d.name == DEVICE_NAME
-    )
-
-    if not device:
-        print(f"❌ Device '{DEVICE_NAME}' not found.")
-        return
-
-    print(f"Found device: {device.name} ({device.address})")
-    print("Connecting...")
-
-    async with BleakClient(device) as client:
-        print(f"✅ Connected to {device.name}")
-
-        # Subscribe to notifications
-        await client.start_notify(CHARACTERISTIC_UUID, notification_handler)
-        
-        print("Waiting for data... (Press Ctrl+C to stop)")
-        
-        # Keep the script running
+
+    def __init__(self, address, name, transport, forwarder):
+        self.address = address
+        self.name = name
+        self.transport = transport
+        self.forwarder = forwarder
+
+        self.state = "idle"
+        self.stats = {
+            "connects": 0,
+            "disconnects": 0,
+            "failed_connects": 0,
+            "packets": 0,
+            "decode_errors": 0,
+            "last_packet": None,
+        }
+        self._disconnected = None
+
+    def notification_handler(self, data):
+        """
+        Callback for when a BLE notification is received.
+        """
+        try:
+            if reading_codec.is_binary(data):
+                # Validate in place, then relay the compact record untouched
+                reading_codec.decode_reading(memoryview(data))
+                payload = bytes(data)
+            else:
+                # JSON fallback: decode bytes and parse
+                payload = json.loads(data.decode('utf-8'))
+        except Exception as e:
+            self.stats["decode_errors"] += 1
+            print(f"Error processing notification from {self.name}: {e}")
+            return
+
+        self.stats["packets"] += 1
+        self.stats["last_packet"] = time.time()
+
+        # Hand off to the forwarder; batching and posting happen on its worker
+        self.forwarder.submit(payload)
+
+    def _on_disconnect(self):
+        self._disconnected.set()
+
+    async def run(self):
+        failures = 0
+        while True:
+            self.state = "connecting"
+            self._disconnected = asyncio.Event()
+            try:
+                connection = await self.transport.connect(
+                    self.address, self.notification_handler, self._on_disconnect
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.stats["failed_connects"] += 1
+                delay = min(RECONNECT_MAX, RECONNECT_BASE * 2 ** (failures - 1))
+                delay *= random.uniform(0.8, 1.2)
+                self.state = "backoff"
+                print(f"❌ {self.name} ({self.address}) connect failed: {e}. Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+            self.state = "connected"
+            self.stats["connects"] += 1
+            print(f"✅ Connected to {self.name} ({self.address})")
+
+            try:
+                await self._disconnected.wait()
+            finally:
+                self.state = "disconnected"
+                await connection.close()
+
+            self.stats["disconnects"] += 1
+            print(f"⚠️ {self.name} ({self.address}) disconnected, reconnecting...")
+
+
+class Gateway:
+    """
+    Manages many hubs concurrently in one asyncio loop: scans continuously
+    and keeps one DeviceSession task per discovered hub.
+    """
+
+    def __init__(self, transport, forwarder, name_prefix=DEVICE_NAME, scan_interval=SCAN_INTERVAL):
+        self.transport = transport
+        self.forwarder = forwarder
+        self.name_prefix = name_prefix
+        self.scan_interval = scan_interval
+        self.sessions = {}
+        self._tasks = {}
+
+    async def scan_once(self):
         try:
-            while True:
-                await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            print("Stopping...")
-            await client.stop_notify(CHARACTERISTIC_UUID)
+            found = await self.transport.scan(SCAN_TIMEOUT)
+        except Exception as e:
+            print(f"❌ Scan failed: {e}")
+            return
+
+        for address, name in found:
+            if not name or not name.startswith(self.name_prefix) or address in self.sessions:
+                continue
+            print(f"Found device: {name} ({address})")
+            session = DeviceSession(address, name, self.transport, self.forwarder)
+            self.sessions[address] = session
+            self._tasks[address] = asyncio.create_task(session.run())
+
+    async def run(self):
+        print(f"🔍 Scanning for {self.name_prefix}* hubs...")
+        while True:
+            await self.scan_once()
+            await asyncio.sleep(self.scan_interval)
+
+    def stats(self):
+        return {
+            address: {"name": s.name, "state": s.state, **s.stats}
+            for address, s in self.sessions.items()
+        }
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+async def _report_stats(gateway):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        for address, st in gateway.stats().items():
+            print(f"📊 {st['name']} ({address}) {st['state']}: {st['packets']} packets, "
+                  f"{st['connects']} connects, {st['failed_connects']} failed connects")
+        print(f"📊 Forwarder: {gateway.forwarder.stats}")
+        if gateway.forwarder.spool:
+            print(f"📊 Spool: {gateway.forwarder.spool.info()}")
+
+
+async def run(transport=None, forwarder=None):
+    transport = transport or BleakTransport()
+    forwarder = forwarder or ApiForwarder(spool=Spool(SPOOL_PATH, SPOOL_CAPACITY))
+    await forwarder.start()
+
+    gateway = Gateway(transport, forwarder)
+    reporter = asyncio.create_task(_report_stats(gateway))
+
+    print("Waiting for data... (Press Ctrl+C to stop)")
+    try:
+        await gateway.run()
+    except asyncio.CancelledError:
+        print("Stopping...")
+    finally:
+        reporter.cancel()
+        await gateway.close()
+        await forwarder.close()
+        print(f"Device stats: {gateway.stats()}")
+        print(f"Forwarder stats: {forwarder.stats}")
+
+
+def simulated_transport(count: int, interval: float = 1.0, binary: bool = False):
+    hubs = [
+        SimulatedHub(f"SIM:00:00:00:00:{i:02X}", f"{DEVICE_NAME}_{i}", f"monacos_sim_{i:02d}", interval, binary)
+        for i in range(count)
+    ]
+    return SimulatedTransport(hubs)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relay Monacos BLE hubs to the backend API")
+    parser.add_argument("--simulate", type=int, metavar="N", help="use N simulated hubs instead of Bluetooth")
+    parser.add_argument("--binary", action="store_true", help="simulated hubs send the binary reading format")
+    args = parser.parse_args()
+
+    transport = simulated_transport(args.simulate, binary=args.binary) if args.simulate else None
     try:
-        asyncio.run(run())
+        asyncio.run(run(transport))
     except KeyboardInterrupt:
         print("\nExited.")
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import random
+from datetime import datetime
+
+import reading_codec
+
+# ---------------------------
+# BLE TRANSPORTS
+# ---------------------------
+# The gateway only talks to a transport, never to bleak directly:
+#
+#   await transport.scan(timeout)                         -> [(address, name), ...]
+#   await transport.connect(address, on_data, on_disconnect) -> connection
+#   await connection.close()
+#
+# on_data(bytes) is called for every notification and on_disconnect() once
+# when the link drops. This lets the gateway run against SimulatedTransport
+# on machines with no Bluetooth.
+
+SERVICE_UUID = "00001234-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUID = "0000abcd-0000-1000-8000-00805f9b34fb"
+
+
+class BleakTransport:
+    """Real Bluetooth LE via bleak (imported lazily)."""
+
+    def __init__(self, characteristic_uuid=CHARACTERISTIC_UUID):
+        self.characteristic_uuid = characteristic_uuid
+
+    async def scan(self, timeout: float = 5.0):
+        from bleak import BleakScanner
+
+        devices = await BleakScanner.discover(timeout=timeout)
+        return [(d.address, d.name) for d in devices if d.name]
+
+    async def connect(self, address, on_data, on_disconnect):
+        from bleak import BleakClient
+
+        client = BleakClient(address, disconnected_callback=lambda _client: on_disconnect())
+        await client.connect()
+        await client.start_notify(self.characteristic_uuid, lambda _sender, data: on_data(data))
+        return _BleakConnection(client, self.characteristic_uuid)
+
+
+class _BleakConnection:
+    def __init__(self, client, characteristic_uuid):
+        self.client = client
+        self.characteristic_uuid = characteristic_uuid
+
+    async def close(self):
+        try:
+            if self.client.is_connected:
+                await self.client.stop_notify(self.characteristic_uuid)
+        finally:
+            await self.client.disconnect()
+
+
+# ---------------------------
+# SIMULATED BACKEND
+# ---------------------------
+
+class SimulatedHub:
+    """
+    A fake Monacos hub that emits a reading every `interval` seconds, as JSON
+    or in the binary format from reading_codec.
+    """
+
+    def __init__(self, address, name, device_id=None, interval=1.0, binary=False):
+        self.address = address
+        self.name = name
+        self.device_id = device_id or address.replace(":", "").lower()
+        self.interval = interval
+        self.binary = binary
+        self.visible = True
+        self.fail_connects = 0  # next N connect attempts fail
+
+    def make_reading(self) -> bytes:
+        reading = {
+            "device_id": self.device_id,
+            "temperature": round(random.uniform(19, 28), 1),
+            "humidity": round(random.uniform(30, 65), 1),
+            "pm25": round(random.uniform(2, 40), 1),
+            "pm10": round(random.uniform(5, 60), 1),
+            "noise": round(random.uniform(30, 70), 1),
+            "light": round(random.uniform(100, 600), 1),
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        if self.binary:
+            return reading_codec.encode_reading(reading)
+        return json.dumps(reading).encode("utf-8")
+
+
+class SimulatedTransport:
+    """In-process stand-in for BleakTransport driven by SimulatedHub objects."""
+
+    def __init__(self, hubs=None):
+        self.hubs = {hub.address: hub for hub in (hubs or [])}
+        self.connections = {}
+
+    def add_hub(self, hub: SimulatedHub):
+        self.hubs[hub.address] = hub
+
+    def drop(self, address):
+        """Simulates the hub going out of range / resetting."""
+        connection = self.connections.get(address)
+        if connection:
+            connection.disconnect()
+
+    async def scan(self, timeout: float = 5.0):
+        await asyncio.sleep(0)
+        return [(hub.address, hub.name) for hub in self.hubs.values() if hub.visible]
+
+    async def connect(self, address, on_data, on_disconnect):
+        hub = self.hubs.get(address)
+        if hub is None or not hub.visible:
+            raise ConnectionError(f"Device {address} not found")
+        if hub.fail_connects:
+            hub.fail_connects -= 1
+            raise ConnectionError(f"Simulated connect failure for {address}")
+
+        connection = _SimulatedConnection(hub, on_data, on_disconnect)
+        self.connections[address] = connection
+        return connection
+
+
+class _SimulatedConnection:
+    def __init__(self, hub, on_data, on_disconnect):
+        self.hub = hub
+        self.on_data = on_data
+        self.on_disconnect = on_disconnect
+        self.task = asyncio.create_task(self._emit())
+
+    async def _emit(self):
+        while True:
+            await asyncio.sleep(self.hub.interval)
+            self.on_data(self.hub.make_reading())
+
+    def disconnect(self):
+        if not self.task.done():
+            self.task.cancel()
+            self.on_disconnect()
+
+    async def close(self):
+        self.task.cancel()
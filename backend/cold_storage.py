@@ -0,0 +1,310 @@
+import math
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from db import get_db, tables_for_range
+from log_config import get_logger
+from repository import REPOSITORY
+from retention import fold_sql
+
+# ---------------------------
+# COLD TIER
+# ---------------------------
+# Raw readings older than COLD_AFTER_DAYS are compacted, per device and per
+# day, into one compressed columnar chunk in cold_chunks:
+#
+#   timestamps  microseconds, delta-of-delta, zigzag varints
+#   each metric null bitmap + values quantized to 1/QUANT_SCALE, delta, zigzag varints
+#   whole chunk zlib-compressed
+#
+# Quantization keeps 2 decimals (what the sensors and the binary codec
+# carry). Rows are folded into sensor_rollups as they are compacted, so
+# retention only has to delete expired chunks. read_history() merges cold
+# chunks with hot rows for /api/history and exports.
+
+COLD_AFTER_DAYS = float(os.getenv("COLD_AFTER_DAYS", "7"))
+COLD_INTERVAL = float(os.getenv("COLD_INTERVAL", "3600"))   # seconds between compaction runs
+COLD_CHUNK = timedelta(days=1)
+COLD_BATCH_PAUSE = 0.05
+
+FORMAT_VERSION = 1
+QUANT_SCALE = 100
+
+COLD_COLUMNS = (
+    "temperature", "humidity", "pm25", "pm10", "noise", "light",
+    "altitude", "pressure", "co2", "vocs", "aqi", "air_quality_score",
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+log = get_logger("cold_storage")
+
+
+class ChunkFormatError(ValueError):
+    pass
+
+
+# ---------------------------
+# VARINTS
+# ---------------------------
+
+def _put_varint(out: bytearray, value: int):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(buf, pos):
+    result = shift = 0
+    while True:
+        try:
+            byte = buf[pos]
+        except IndexError:
+            raise ChunkFormatError("truncated varint")
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+
+# ---------------------------
+# ENCODE / DECODE
+# ---------------------------
+
+def _to_micros(value) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def encode_chunk(rows) -> bytes:
+    """rows: reading dicts sorted by timestamp (one device)."""
+    out = bytearray()
+    _put_varint(out, len(rows))
+
+    prev = prev_delta = 0
+    for i, row in enumerate(rows):
+        ts = _to_micros(row["timestamp"])
+        if i == 0:
+            _put_varint(out, ts)
+        else:
+            delta = ts - prev
+            _put_varint(out, delta - prev_delta)
+            prev_delta = delta
+        prev = ts
+
+    for column in COLD_COLUMNS:
+        bitmap = bytearray((len(rows) + 7) // 8)
+        values = bytearray()
+        last = 0
+        for i, row in enumerate(rows):
+            value = row.get(column)
+            # inf/NaN (rows stored before validate_stage dropped them) can't be quantized
+            if value is None or not math.isfinite(value):
+                continue
+            bitmap[i >> 3] |= 1 << (i & 7)
+            q = round(value * QUANT_SCALE)
+            _put_varint(values, q - last)
+            last = q
+        out += bitmap
+        out += values
+
+    return bytes([FORMAT_VERSION]) + zlib.compress(bytes(out), 6)
+
+
+def decode_chunk(blob: bytes, device_id: str):
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise ChunkFormatError(f"unsupported chunk format {blob[:1]!r}")
+    try:
+        buf = zlib.decompress(blob[1:])
+    except zlib.error as e:
+        raise ChunkFormatError(str(e))
+
+    count, pos = _get_varint(buf, 0)
+    timestamps = []
+    prev = prev_delta = 0
+    for i in range(count):
+        value, pos = _get_varint(buf, pos)
+        if i == 0:
+            prev = value
+        else:
+            prev_delta += value
+            prev += prev_delta
+        timestamps.append(prev)
+
+    rows = [
+        {"id": None, "device_id": device_id, "timestamp": _from_micros(ts).isoformat(" ")}
+        for ts in timestamps
+    ]
+    bitmap_len = (count + 7) // 8
+    for column in COLD_COLUMNS:
+        bitmap = buf[pos:pos + bitmap_len]
+        pos += bitmap_len
+        last = 0
+        for i, row in enumerate(rows):
+            if bitmap[i >> 3] & (1 << (i & 7)):
+                delta, pos = _get_varint(buf, pos)
+                last += delta
+                row[column] = last / QUANT_SCALE
+            else:
+                row[column] = None
+    return rows
+
+
+# ---------------------------
+# READER
+# ---------------------------
+
+def get_cold_readings(device_id: str, since=None, until=None):
+    where = "WHERE device_id = ?"
+    params = [device_id]
+    if since is not None:
+        where += " AND end_ts >= ?"
+        params.append(since)
+    if until is not None:
+        where += " AND start_ts < ?"
+        params.append(until)
+
+    conn = get_db()
+    try:
+        chunks = conn.execute(
+            f"SELECT data FROM cold_chunks {where} ORDER BY start_ts", params
+        ).fetchall()
+    finally:
+        conn.close()
+
+    since_s = since.isoformat(" ") if isinstance(since, datetime) else since
+    until_s = until.isoformat(" ") if isinstance(until, datetime) else until
+    rows = []
+    for chunk in chunks:
+        for row in decode_chunk(chunk["data"], device_id):
+            if since_s is not None and row["timestamp"] < since_s:
+                continue
+            if until_s is not None and row["timestamp"] >= until_s:
+                continue
+            rows.append(row)
+    return rows
+
+
+def read_history(device_id: str, since=None, until=None):
+    """Cold chunks followed by hot rows, oldest first, as one list of dicts."""
+    # The cold tier only exists on SQLite; other backends keep everything hot
+    cold = get_cold_readings(device_id, since, until) if REPOSITORY.supports_maintenance else []
+    hot = REPOSITORY.get_readings(device_id, since=since, until=until)
+    if cold and hot and cold[-1]["timestamp"] > hot[0]["timestamp"]:
+        # Late rows landed in the hot tier behind compacted data
+        return sorted(cold + hot, key=lambda r: r["timestamp"])
+    return cold + hot
+
+
+# ---------------------------
+# COMPACTION
+# ---------------------------
+
+class ColdCompactor:
+    def __init__(self, cold_after_days=COLD_AFTER_DAYS, interval=COLD_INTERVAL, batch_pause=COLD_BATCH_PAUSE):
+        self.cold_after = timedelta(days=cold_after_days)
+        self.interval = interval
+        self.batch_pause = batch_pause
+        self.stats = {"runs": 0, "chunks_written": 0, "rows_compacted": 0, "raw_bytes_estimate": 0, "chunk_bytes": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now: datetime = None) -> dict:
+        # Whole days only, so a chunk never overlaps data still arriving hot
+        cutoff = ((now or datetime.utcnow()) - self.cold_after).replace(hour=0, minute=0, second=0, microsecond=0)
+        conn = get_db()
+        chunks = rows = 0
+        try:
+            for table in tables_for_range(conn, None, cutoff):
+                keys = conn.execute(f"""
+                    SELECT DISTINCT device_id, date(timestamp) AS day
+                    FROM {table} WHERE timestamp < ?
+                """, (cutoff,)).fetchall()
+                for device_id, day in keys:
+                    if self._stop.is_set():
+                        break
+                    rows += self._compact(conn, table, device_id, datetime.fromisoformat(day))
+                    chunks += 1
+                    time.sleep(self.batch_pause)
+        finally:
+            conn.close()
+
+        self.stats["runs"] += 1
+        self.stats["chunks_written"] += chunks
+        self.stats["rows_compacted"] += rows
+        if rows:
+            log.info("cold compaction", extra={"fields": {"chunks": chunks, "rows": rows}})
+        return {"chunks": chunks, "rows": rows}
+
+    def _compact(self, conn, table, device_id, day) -> int:
+        start, end = day, day + COLD_CHUNK
+        where = "device_id = ? AND timestamp >= ? AND timestamp < ?"
+        params = (device_id, start, end)
+        rows = [dict(r) for r in conn.execute(
+            f"SELECT * FROM {table} WHERE {where} ORDER BY timestamp", params
+        ).fetchall()]
+        if not rows:
+            return 0
+
+        # Rows already compacted for this device/day (late arrivals) are re-encoded together
+        existing = conn.execute(
+            "SELECT data FROM cold_chunks WHERE device_id = ? AND start_ts = ?", (device_id, start)
+        ).fetchone()
+        merged = rows
+        if existing:
+            merged = sorted(decode_chunk(existing["data"], device_id) + rows, key=lambda r: str(r["timestamp"]))
+
+        blob = encode_chunk(merged)
+        try:
+            conn.execute(fold_sql(table, where), params)
+            conn.execute("""
+                INSERT OR REPLACE INTO cold_chunks (device_id, start_ts, end_ts, count, format, data)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (device_id, start, end, len(merged), FORMAT_VERSION, blob))
+            conn.execute(f"DELETE FROM {table} WHERE {where}", params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        self.stats["raw_bytes_estimate"] += len(rows) * 8 * (len(COLD_COLUMNS) + 1)
+        self.stats["chunk_bytes"] += len(blob)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("cold compaction failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cold-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+COMPACTOR = ColdCompactor()
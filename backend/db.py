@@ -1,14 +1,47 @@
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+from metrics import DB_QUERY_LATENCY, statement_labels
+
 DB_NAME = "monacos.db"
 
 
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records statement execution time in metrics.DB_QUERY_LATENCY."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started, *statement_labels(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started, *statement_labels(sql))
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
 def get_db():
     """
-    Returns a SQLite connection
+    Returns a SQLite connection (statements are timed, see TimedCursor)
     """
-    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -20,6 +53,10 @@ def init_db():
     db = get_db()
     cursor = db.cursor()
 
+    # Lets retention.py hand freed pages back to the OS without a full VACUUM.
+    # Only takes effect on a new database file (see retention.py for old ones).
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     # -----------------------------
     # Devices table
     # -----------------------------
@@ -54,6 +91,53 @@ def init_db():
     )
     """)
 
+    # -----------------------------
+    # Hourly rollups (raw readings are folded in here before retention deletes them)
+    # -----------------------------
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sensor_rollups (
+        device_id TEXT NOT NULL,
+        bucket DATETIME NOT NULL,
+        count INTEGER NOT NULL,
+        temperature REAL,
+        humidity REAL,
+        pm25 REAL,
+        pm10 REAL,
+        noise REAL,
+        light REAL,
+        co2 REAL,
+        vocs REAL,
+        pressure REAL,
+        pm25_max REAL,
+        pm10_max REAL,
+        noise_max REAL,
+        PRIMARY KEY (device_id, bucket)
+    )
+    """)
+
+    # -----------------------------
+    # Cold tier: compressed per-device/day columnar chunks (see cold_storage.py)
+    # -----------------------------
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS cold_chunks (
+        device_id TEXT NOT NULL,
+        start_ts DATETIME NOT NULL,
+        end_ts DATETIME NOT NULL,
+        count INTEGER NOT NULL,
+        format INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (device_id, start_ts)
+    )
+    """)
+
+    # Progress of retention folding whole partitions into rollups
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS retention_progress (
+        table_name TEXT PRIMARY KEY,
+        folded_to_id INTEGER NOT NULL
+    )
+    """)
+
     # -----------------------------
     # Alerts table
     # -----------------------------
@@ -103,6 +187,18 @@ def init_db():
         except sqlite3.OperationalError:
             pass
 
+    # Per-device time lookups (latest, history, warm start)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sensor_readings_device_ts
+    ON sensor_readings (device_id, timestamp)
+    """)
+
+    # UNION ALL view over the legacy table + monthly partitions
+    names = _load_partitions(db, force=True)["names"]
+    for name in names:
+        ensure_unique_device_ts(db, name)
+    _rebuild_view(db, names)
+
     db.commit()
     db.close()
 
@@ -166,6 +262,17 @@ def get_user_by_username(username: str):
     return user
 
 
+def update_user_password_hash(username: str, password_hash: str):
+    """
+    Replace a user's password hash (rehash on login)
+    """
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username))
+    db.commit()
+    db.close()
+
+
 def update_user_profile(username: str, email: str, full_name: str):
     """
     Update user profile details
@@ -195,6 +302,298 @@ def get_all_devices():
     return [dict(d) for d in devices]
 
 
+# -------------------------------------------------
+# Partitioned sensor storage
+# -------------------------------------------------
+# Readings live in one table per calendar month (sensor_readings_YYYYMM).
+# Writers and the hot read paths go through the helpers below, which only
+# touch partitions overlapping the requested time range. The original
+# sensor_readings table is kept as a legacy partition (pre-partitioning data)
+# and is included while it still has rows. sensor_readings_all is a UNION ALL
+# view over everything for ad-hoc queries and exports.
+
+SENSOR_COLUMNS = (
+    "device_id", "temperature", "humidity", "pm25", "pm10", "noise", "light",
+    "altitude", "pressure", "co2", "vocs", "aqi", "air_quality_score", "timestamp",
+)
+
+LEGACY_TABLE = "sensor_readings"
+PARTITION_PREFIX = "sensor_readings_"
+ALL_READINGS_VIEW = "sensor_readings_all"
+PARTITION_CACHE_TTL = 5.0  # seconds; other workers may create partitions
+
+_partitions = {"names": [], "legacy": False, "loaded_at": 0.0}
+_partitions_lock = threading.Lock()
+
+
+def partition_for(timestamp) -> str:
+    """Partition table name for a datetime or SQLite timestamp string."""
+    if isinstance(timestamp, str):
+        return f"{PARTITION_PREFIX}{timestamp[:4]}{timestamp[5:7]}"
+    return f"{PARTITION_PREFIX}{timestamp.year:04d}{timestamp.month:02d}"
+
+
+def partition_bounds(name: str):
+    """[start, end) datetimes covered by a partition table."""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def _load_partitions(conn, force=False):
+    now = time.monotonic()
+    if not force and now - _partitions["loaded_at"] < PARTITION_CACHE_TTL:
+        return _partitions
+    names = sorted(
+        r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+            (PARTITION_PREFIX + "[0-9][0-9][0-9][0-9][0-9][0-9]",),
+        ).fetchall()
+    )
+    legacy = conn.execute(f"SELECT 1 FROM {LEGACY_TABLE} LIMIT 1").fetchone() is not None
+    with _partitions_lock:
+        _partitions.update(names=names, legacy=legacy, loaded_at=now)
+    return _partitions
+
+
+def list_partitions(conn=None, refresh=False):
+    own = conn is None
+    conn = conn or get_db()
+    try:
+        return list(_load_partitions(conn, force=refresh)["names"])
+    finally:
+        if own:
+            conn.close()
+
+
+def tables_for_range(conn, start=None, end=None):
+    """Tables that can hold readings in [start, end), legacy table first."""
+    state = _load_partitions(conn)
+    tables = [LEGACY_TABLE] if state["legacy"] else []
+    for name in state["names"]:
+        p_start, p_end = partition_bounds(name)
+        if (start is None or p_end > start) and (end is None or p_start < end):
+            tables.append(name)
+    return tables
+
+
+def _rebuild_view(conn, names):
+    columns = "id, " + ", ".join(SENSOR_COLUMNS)
+    selects = [f"SELECT {columns} FROM {t}" for t in [LEGACY_TABLE] + names]
+    conn.execute(f"DROP VIEW IF EXISTS {ALL_READINGS_VIEW}")
+    conn.execute(f"CREATE VIEW {ALL_READINGS_VIEW} AS " + " UNION ALL ".join(selects))
+
+
+def ensure_partition(conn, name: str):
+    if name in _partitions["names"]:
+        return
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id TEXT,
+        temperature REAL,
+        humidity REAL,
+        pm25 REAL,
+        pm10 REAL,
+        noise REAL,
+        light REAL,
+        altitude REAL,
+        pressure REAL,
+        co2 REAL,
+        vocs REAL,
+        aqi REAL,
+        air_quality_score REAL,
+        timestamp DATETIME
+    )
+    """)
+    ensure_unique_device_ts(conn, name)
+    names = _load_partitions(conn, force=True)["names"]
+    _rebuild_view(conn, names)
+
+
+def ensure_unique_device_ts(conn, name: str):
+    """
+    One row per (device_id, timestamp) in a partition, so insert_readings can
+    ignore replays of readings that are already stored (gateway spool replays
+    land far behind the ingest reorder window). Existing duplicates are
+    deleted first, keeping the oldest row; replaces the plain index.
+    """
+    sql = f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{name}_device_ts ON {name} (device_id, timestamp)"
+    try:
+        conn.execute(sql)
+    except sqlite3.IntegrityError:
+        conn.execute(f"""
+            DELETE FROM {name} WHERE id NOT IN (
+                SELECT MIN(id) FROM {name} GROUP BY device_id, timestamp
+            )
+        """)
+        conn.execute(sql)
+    conn.execute(f"DROP INDEX IF EXISTS idx_{name}_device_ts")
+
+
+def drop_partition(name: str, max_id: int = None) -> bool:
+    """
+    Drops a whole month of readings: a table drop instead of a mass DELETE.
+    With `max_id`, only drops if no row past it exists, checked in the same
+    transaction (rows the writer inserted after a fold are kept). Returns
+    whether the table was dropped.
+    """
+    if not name.startswith(PARTITION_PREFIX) or name == LEGACY_TABLE:
+        raise ValueError(f"Not a partition table: {name}")
+    db = get_db()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        if max_id is not None:
+            try:
+                newest = db.execute(f"SELECT MAX(id) FROM {name}").fetchone()[0] or 0
+            except sqlite3.OperationalError:   # already dropped
+                newest = 0
+            if newest > max_id:
+                db.rollback()
+                return False
+        db.execute(f"DROP TABLE IF EXISTS {name}")
+        names = [n for n in _load_partitions(db, force=True)["names"] if n != name]
+        _rebuild_view(db, names)
+        db.commit()
+        _load_partitions(db, force=True)
+        return True
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _union(tables, columns="*", where="", params=()):
+    """UNION ALL of the same SELECT over several tables; params repeated per table."""
+    sql = " UNION ALL ".join(f"SELECT {columns} FROM {t} {where}" for t in tables)
+    return sql, tuple(params) * len(tables)
+
+
+def insert_readings(readings: list) -> int:
+    """
+    Bulk-inserts reading dicts into their monthly partitions and registers /
+    touches their devices, all in one transaction (used by the ingest writer).
+    Readings already stored for the same device and timestamp are skipped.
+    Returns the number of rows inserted.
+    """
+    by_partition = {}
+    for r in readings:
+        by_partition.setdefault(partition_for(r["timestamp"]), []).append(r)
+
+    db = get_db()
+    try:
+        before = db.total_changes
+        for name, rows in by_partition.items():
+            sql = (
+                f"INSERT OR IGNORE INTO {name} ({', '.join(SENSOR_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(SENSOR_COLUMNS))})"
+            )
+            values = [tuple(r.get(c) for c in SENSOR_COLUMNS) for r in rows]
+            ensure_partition(db, name)
+            try:
+                db.executemany(sql, values)
+            except sqlite3.OperationalError:
+                # Cached partition list was stale (dropped by retention in another worker)
+                _load_partitions(db, force=True)
+                ensure_partition(db, name)
+                db.executemany(sql, values)
+        inserted = db.total_changes - before
+
+        last_seen = {}
+        for r in readings:
+            last_seen[r["device_id"]] = r["timestamp"]
+        db.executemany("""
+            INSERT INTO devices (device_id, last_seen) VALUES (?, ?)
+            ON CONFLICT(device_id) DO UPDATE SET last_seen = excluded.last_seen
+        """, list(last_seen.items()))
+
+        db.commit()
+        return inserted
+    finally:
+        db.close()
+
+
+def get_latest_reading(device_id: str):
+    """Newest reading for a device, probing partitions newest-first."""
+    db = get_db()
+    try:
+        tables = tables_for_range(db)
+        for table in reversed(tables):
+            row = db.execute(
+                f"SELECT * FROM {table} WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (device_id,),
+            ).fetchone()
+            if row:
+                return dict(row)
+        return None
+    finally:
+        db.close()
+
+
+def get_readings(device_id: str, since=None, until=None, columns="*", limit=None):
+    """
+    Readings for one device in [since, until), oldest first, read only from
+    the partitions overlapping that range.
+    """
+    where = "WHERE device_id = ?"
+    params = [device_id]
+    if since is not None:
+        where += " AND timestamp >= ?"
+        params.append(since)
+    if until is not None:
+        where += " AND timestamp < ?"
+        params.append(until)
+
+    db = get_db()
+    try:
+        tables = tables_for_range(db, since, until)
+        if not tables:
+            return []
+        sql, all_params = _union(tables, columns, where, params)
+        sql = f"SELECT * FROM ({sql}) ORDER BY timestamp ASC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            all_params += (limit,)
+        return [dict(r) for r in db.execute(sql, all_params).fetchall()]
+    finally:
+        db.close()
+
+
+def get_recent_readings_by_device(per_device: int, since):
+    """
+    Last `per_device` readings (oldest first) for every device that reported
+    after `since`, in one set-based query instead of one query per device.
+    Returns {device_id: [row dict, ...]}.
+    """
+    db = get_db()
+    try:
+        tables = tables_for_range(db, since)
+        if not tables:
+            return {}
+        union, params = _union(tables, "*", "WHERE timestamp >= ?", (since,))
+        rows = db.execute(f"""
+            SELECT * FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY device_id ORDER BY timestamp DESC
+                ) AS rn
+                FROM ({union})
+            )
+            WHERE rn <= ?
+            ORDER BY device_id, timestamp ASC
+        """, params + (per_device,)).fetchall()
+    finally:
+        db.close()
+
+    windows = {}
+    for row in rows:
+        reading = dict(row)
+        del reading["rn"]
+        windows.setdefault(reading["device_id"], []).append(reading)
+    return windows
+
+
 # -------------------------------------------------
 # Manual test (run: python db.py)
 # -------------------------------------------------
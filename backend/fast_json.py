@@ -0,0 +1,62 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+from reading import Reading
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib fallback produces the same JSON, slower
+    orjson = None
+
+# ---------------------------
+# FAST JSON RESPONSES
+# ---------------------------
+# FastJSONResponse is the app's default response class. It renders with
+# orjson, which serializes dicts, datetimes and NumPy arrays / scalars in C
+# (naive datetimes as "2026-01-01T12:00:00", like isoformat()).
+#
+# FastAPI still runs jsonable_encoder over a plain return value before the
+# response class sees it. High-volume endpoints (/api/history,
+# /api/devices, JSON exports) return FastJSONResponse(...) themselves to
+# skip that walk; see benchmarks/serialization_bench.py.
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(value):
+    """Types neither orjson nor json handle natively."""
+    if isinstance(value, Reading):
+        return value.to_dict()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "model_dump"):      # pydantic models
+        return value.model_dump(mode="json")
+    if hasattr(value, "tolist"):          # NumPy values orjson doesn't take natively (e.g. float16)
+        return value.tolist()
+    if hasattr(value, "keys"):            # sqlite3.Row and other mappings
+        return {k: value[k] for k in value.keys()}
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _stdlib_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return _default(value)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        content, default=_stdlib_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,247 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+
+# ---------------------------
+# ON-DISK SPOOL
+# ---------------------------
+# Append-only, memory-mapped ring of readings the gateway could not deliver.
+# The file is preallocated to `capacity` bytes:
+#
+#   [header][record][record]...            (free space)
+#           ^read_offset       ^write_offset
+#
+#   header = magic "MSPL", version, reserved, read_offset (u64), write_offset (u64)
+#   record = length (u32), crc32 (u32), payload
+#
+# A payload is either a JSON reading or a raw binary record from
+# reading_codec; JSON always starts with "{", binary with the version byte.
+#
+# Records are replayed from read_offset in append order and only released
+# (commit) once the backend accepted them. Commits are by record sequence
+# number, so appends that drop or compact records while a replay POST is in
+# flight can't release the wrong records. On open, records are re-validated
+# by CRC and anything after the first torn record is discarded.
+
+HEADER = struct.Struct("<4sHHQQ")
+RECORD = struct.Struct("<II")
+MAGIC = b"MSPL"
+VERSION = 1
+
+DEFAULT_CAPACITY = 64 * 1024 * 1024   # 64 MB
+
+
+class Spool:
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        self.path = path
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER.size
+        self._file = open(path, "r+b" if exists else "w+b")
+        size = os.path.getsize(path)
+        if size < capacity:
+            self._file.truncate(capacity)
+        self.capacity = max(capacity, size)
+        self._mm = mmap.mmap(self._file.fileno(), self.capacity)
+
+        self.read_offset = HEADER.size
+        self.write_offset = HEADER.size
+        self.pending = 0
+        self.head_seq = 0   # sequence number of the record at read_offset
+
+        self.stats = {
+            "appended": 0,
+            "replayed": 0,
+            "dropped": 0,
+            "compactions": 0,
+            "recovered": 0,
+            "corrupt_bytes": 0,
+            "replay_records_per_sec": 0.0,
+            "replay_bytes_per_sec": 0.0,
+        }
+
+        if exists:
+            self._load()
+        else:
+            self._write_header()
+
+    # ---------------------------
+    # HEADER / RECOVERY
+    # ---------------------------
+
+    def _write_header(self):
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, 0, self.read_offset, self.write_offset)
+
+    def _load(self):
+        magic, version, _, read_offset, write_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or not (
+            HEADER.size <= read_offset <= write_offset <= self.capacity
+        ):
+            print(f"⚠️ Spool {self.path} has an invalid header, starting empty")
+            self._write_header()
+            return
+
+        self.read_offset = read_offset
+        offset = read_offset
+        while offset < write_offset:
+            end = self._record_end(offset, write_offset)
+            if end is None:
+                self.stats["corrupt_bytes"] = write_offset - offset
+                print(f"⚠️ Spool {self.path}: discarding {write_offset - offset} bytes after torn record")
+                break
+            offset = end
+            self.pending += 1
+
+        self.write_offset = offset
+        self.stats["recovered"] = self.pending
+        self._write_header()
+
+    def _record_end(self, offset, limit):
+        """Returns the offset after a valid record at `offset`, or None."""
+        if offset + RECORD.size > limit:
+            return None
+        length, crc = RECORD.unpack_from(self._mm, offset)
+        start = offset + RECORD.size
+        end = start + length
+        if end > limit or zlib.crc32(self._mm[start:end]) != crc:
+            return None
+        return end
+
+    # ---------------------------
+    # WRITE PATH
+    # ---------------------------
+
+    def append_many(self, payloads, sync: bool = True):
+        """
+        Appends readings; oldest records are dropped if the cap is hit. Durable
+        on return unless sync=False, in which case the caller runs sync()
+        (e.g. off the event loop).
+        """
+        encoded = [
+            p if isinstance(p, bytes) else json.dumps(p, default=str).encode("utf-8")
+            for p in payloads
+        ]
+        usable = self.capacity - HEADER.size
+
+        # A batch larger than the whole spool keeps only its newest records
+        total = sum(RECORD.size + len(b) for b in encoded)
+        while encoded and total > usable:
+            total -= RECORD.size + len(encoded.pop(0))
+            self.stats["dropped"] += 1
+
+        # Size cap: make room by dropping the oldest undelivered readings
+        while self.pending_bytes + total > usable and self.pending:
+            self._drop_oldest()
+        if self.write_offset + total > self.capacity:
+            self.compact(sync=False)
+
+        offset = self.write_offset
+        for body in encoded:
+            RECORD.pack_into(self._mm, offset, len(body), zlib.crc32(body))
+            offset += RECORD.size
+            self._mm[offset:offset + len(body)] = body
+            offset += len(body)
+
+        self.write_offset = offset
+        self.pending += len(encoded)
+        self.stats["appended"] += len(encoded)
+        self._write_header()
+        if sync:
+            self.sync()
+
+    def _drop_oldest(self):
+        length, _ = RECORD.unpack_from(self._mm, self.read_offset)
+        self.read_offset += RECORD.size + length
+        self.pending -= 1
+        self.head_seq += 1
+        self.stats["dropped"] += 1
+
+    def compact(self, sync: bool = True):
+        """Moves unreplayed records to the front of the file to reclaim space."""
+        if self.read_offset == HEADER.size:
+            return
+        live = self.write_offset - self.read_offset
+        if live:
+            self._mm.move(HEADER.size, self.read_offset, live)
+        self.read_offset = HEADER.size
+        self.write_offset = HEADER.size + live
+        self._write_header()
+        if sync:
+            self.sync()
+        self.stats["compactions"] += 1
+
+    # ---------------------------
+    # REPLAY PATH
+    # ---------------------------
+
+    def read_batch(self, max_records: int):
+        """
+        Returns (payloads, first_seq) for up to `max_records` of the oldest
+        records. Nothing is released until commit(first_seq, len(payloads)).
+        """
+        payloads = []
+        offset = self.read_offset
+        view = memoryview(self._mm)
+        try:
+            while offset < self.write_offset and len(payloads) < max_records:
+                length, _ = RECORD.unpack_from(self._mm, offset)
+                start = offset + RECORD.size
+                body = bytes(view[start:start + length])
+                payloads.append(json.loads(body) if body[:1] == b"{" else body)
+                offset = start + length
+        finally:
+            view.release()
+        return payloads, self.head_seq
+
+    def commit(self, first_seq: int, count: int, sync: bool = True):
+        # Records dropped by the size cap meanwhile are already gone
+        release = min(first_seq + count - self.head_seq, self.pending)
+        for _ in range(max(release, 0)):
+            length, _ = RECORD.unpack_from(self._mm, self.read_offset)
+            self.read_offset += RECORD.size + length
+        release = max(release, 0)
+        self.pending -= release
+        self.head_seq += release
+        self.stats["replayed"] += release
+
+        if self.read_offset == self.write_offset:
+            # Empty: rewind for free instead of moving bytes later
+            self.read_offset = self.write_offset = HEADER.size
+        self._write_header()
+        if sync:
+            self.sync()
+
+    def sync(self):
+        """
+        Writes the mapped pages to disk. fsync on the file covers the shared
+        mapping and, unlike mmap.flush(), releases the GIL, so asyncio callers
+        can run it in an executor without stalling the loop.
+        """
+        os.fsync(self._file.fileno())
+
+    def record_replay_run(self, records: int, nbytes: int, seconds: float):
+        if seconds > 0 and records:
+            self.stats["replay_records_per_sec"] = round(records / seconds, 1)
+            self.stats["replay_bytes_per_sec"] = round(nbytes / seconds, 1)
+
+    # ---------------------------
+    # INFO
+    # ---------------------------
+
+    @property
+    def pending_bytes(self):
+        return self.write_offset - self.read_offset
+
+    def info(self):
+        return {
+            **self.stats,
+            "pending": self.pending,
+            "pending_bytes": self.pending_bytes,
+            "capacity": self.capacity,
+        }
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
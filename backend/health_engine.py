@@ -1,4 +1,24 @@
-def calculate_health_score(data: dict):
+from functools import lru_cache
+
+from bands import above, band_vector, below, default_vector, with_defaults
+
+# Fallback values when a metric is missing
+DEFAULTS = {
+    "pm25": 0, "pm10": 0, "co2": 400, "vocs": 0,
+    "temperature": 22, "humidity": 50, "noise": 40, "light": 350,
+}
+_DEFAULT_BANDS = default_vector(DEFAULTS)
+
+
+@lru_cache(maxsize=4096)
+def score_for_bands(bands: tuple):
+    """
+    Score, level and reason templates for a band vector (bands.py). Only
+    the numbers quoted in the reasons depend on the exact reading, so the
+    rest is computed once per vector. Templates are (format, metric or None).
+    """
+    bands = with_defaults(bands, _DEFAULT_BANDS)
+
     # Base Score for each category (weighted approach)
     # Total Score = 100
     # Category A: Respiratory Health (Weight: 50 points max)
@@ -8,54 +28,42 @@ def calculate_health_score(data: dict):
     score_a = 50
     score_b = 30
     score_c = 20
-    
+
     reasons = []
 
     # ==========================================
     # CATEGORY A: RESPIRATORY HEALTH (Max 50)
     # Focus: PM2.5, PM10, CO2, VOCs
     # ==========================================
-    
+
     # PM2.5
-    pm25 = data.get("pm25")
-    if pm25 is None: pm25 = 0
-    
-    if pm25 > 35:
+    if above(bands, "pm25", 35):
         score_a -= 30
-        reasons.append(f"High PM2.5 ({pm25})")
-    elif pm25 > 15:
+        reasons.append(("High PM2.5 ({})", "pm25"))
+    elif above(bands, "pm25", 15):
         score_a -= 15
-        reasons.append(f"Moderate PM2.5 ({pm25})")
+        reasons.append(("Moderate PM2.5 ({})", "pm25"))
 
     # PM10
-    pm10 = data.get("pm10")
-    if pm10 is None: pm10 = 0
-    
-    if pm10 > 100:
+    if above(bands, "pm10", 100):
         score_a -= 20
-        reasons.append(f"High PM10 ({pm10})")
-    elif pm10 > 45:
+        reasons.append(("High PM10 ({})", "pm10"))
+    elif above(bands, "pm10", 45):
         score_a -= 10
-        reasons.append(f"Elevated PM10 ({pm10})")
+        reasons.append(("Elevated PM10 ({})", "pm10"))
 
     # CO2
-    co2 = data.get("co2")
-    if co2 is None: co2 = 400 # default outdoors
-
-    if co2 > 1200:
+    if above(bands, "co2", 1200):
         score_a -= 15
-        reasons.append(f"High CO2 ({co2})")
-    elif co2 > 800:
+        reasons.append(("High CO2 ({})", "co2"))
+    elif above(bands, "co2", 800):
         score_a -= 5
-        reasons.append(f"Poor Ventilation (CO2: {co2})")
+        reasons.append(("Poor Ventilation (CO2: {})", "co2"))
 
     # VOCs
-    vocs = data.get("vocs")
-    if vocs is None: vocs = 0
-
-    if vocs > 500:
+    if above(bands, "vocs", 500):
         score_a -= 10
-        reasons.append(f"High VOCs ({vocs})")
+        reasons.append(("High VOCs ({})", "vocs"))
 
     # Cap Score A at 0 minimum
     score_a = max(score_a, 0)
@@ -67,26 +75,20 @@ def calculate_health_score(data: dict):
     # ==========================================
 
     # Temperature (Ideal: 20-25)
-    temp = data.get("temperature")
-    if temp is None: temp = 22
-
-    if temp < 15 or temp > 32:
+    if below(bands, "temperature", 15) or above(bands, "temperature", 32):
         score_b -= 20
-        reasons.append("Extreme Temp")
-    elif temp < 18 or temp > 27:
+        reasons.append(("Extreme Temp", None))
+    elif below(bands, "temperature", 18) or above(bands, "temperature", 27):
         score_b -= 10
-        reasons.append("Uncomfortable Temp")
+        reasons.append(("Uncomfortable Temp", None))
 
     # Humidity (Ideal: 30-60)
-    humidity = data.get("humidity")
-    if humidity is None: humidity = 50
-
-    if humidity > 70:
+    if above(bands, "humidity", 70):
         score_b -= 15
-        reasons.append("High Humidity (Mold Risk)")
-    elif humidity < 30 or humidity > 60:
+        reasons.append(("High Humidity (Mold Risk)", None))
+    elif below(bands, "humidity", 30) or above(bands, "humidity", 60):
         score_b -= 10
-        reasons.append("Poor Humidity")
+        reasons.append(("Poor Humidity", None))
 
     # Cap Score B
     score_b = max(score_b, 0)
@@ -98,26 +100,20 @@ def calculate_health_score(data: dict):
     # ==========================================
 
     # Noise (Ideal < 45dB)
-    noise = data.get("noise")
-    if noise is None: noise = 40
-
-    if noise > 75:
+    if above(bands, "noise", 75):
         score_c -= 15
-        reasons.append("High Noise Stress")
-    elif noise > 55:
+        reasons.append(("High Noise Stress", None))
+    elif above(bands, "noise", 55):
         score_c -= 5
-        reasons.append("Distracting Noise")
+        reasons.append(("Distracting Noise", None))
 
     # Light (Ideal 300-500 lux)
-    light = data.get("light")
-    if light is None: light = 350
-
-    if light < 100:
+    if below(bands, "light", 100):
         score_c -= 5
-        reasons.append("Dim Lighting (Strain)")
-    elif light > 1000:
+        reasons.append(("Dim Lighting (Strain)", None))
+    elif above(bands, "light", 1000):
         score_c -= 5
-        reasons.append("Glare / Bright Light")
+        reasons.append(("Glare / Bright Light", None))
 
     # Cap Score C
     score_c = max(score_c, 0)
@@ -125,7 +121,7 @@ def calculate_health_score(data: dict):
     # ==========================================
     # FINAL CALCULATION
     # ==========================================
-    
+
     total_score = score_a + score_b + score_c
     total_score = max(0, min(100, total_score))
 
@@ -138,8 +134,25 @@ def calculate_health_score(data: dict):
     else:
         level = "Hazardous"
 
+    return total_score, level, tuple(reasons)
+
+
+def calculate_health_score(data: dict, bands: tuple = None):
+    """`bands`: the reading's band_vector, when the caller already has it."""
+    if bands is None:
+        bands = band_vector(data)
+    score, level, templates = score_for_bands(bands)
+
+    reasons = []
+    for template, metric in templates:
+        if metric is None:
+            reasons.append(template)
+        else:
+            value = data.get(metric)
+            reasons.append(template.format(DEFAULTS[metric] if value is None else value))
+
     return {
-        "score": total_score,
+        "score": score,
         "level": level,
         "reasons": reasons
     }
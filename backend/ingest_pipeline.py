@@ -0,0 +1,513 @@
+import logging
+import math
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from aqi_engine import calculate_pm_aqi
+from alerts_engine import generate_alerts, has_active_conditions
+from bands import band_vector
+from health_engine import calculate_health_score
+from recommendation_engine import generate_recommendations
+from log_config import get_logger, log_sampled
+from metrics import Counter, Histogram, INGEST_READINGS
+from reading import Reading
+from repository import REPOSITORY
+from shared_state import DEVICE_STATE, DEVICE_ALERTS, DEVICE_DERIVED, append_history, bump_version, device_lock
+
+# ---------------------------
+# INGEST PIPELINE
+# ---------------------------
+# Every entry point (/api/ingest, /data, /api/ingest/batch,
+# /api/ingest/binary) hands reading dicts to PIPELINE, which runs them
+# through named stages in order:
+#
+#   validate -> order -> state -> derived -> alerts -> persist
+#
+# The order stage drops retransmitted duplicates and marks readings older
+# than the device's watermark as late: those are persisted but skip the
+# live stages, so replays never roll DEVICE_STATE back or recompute
+# derived metrics from stale data.
+#
+# The derived and alerts stages only re-run the engines when a metric moved
+# past its deadband or crossed a threshold band (see bands.py); otherwise
+# the cached results are reused.
+#
+# Each stage is fn(ctx) and is timed into monacos_ingest_stage_duration_seconds.
+# Stages can be swapped or added at startup:
+#
+#   PIPELINE.add_stage("enrich", my_fn, after="validate")
+#   PIPELINE.replace_stage("persist", my_writer)
+
+MAX_HISTORY = 60           # last 60 readings per device
+MAX_ALERTS = 20            # alerts kept per device
+
+PERSIST_BATCH_SIZE = 500
+PERSIST_FLUSH_INTERVAL = 0.5   # seconds
+PERSIST_MAX_QUEUE = 20000
+
+REORDER_WINDOW = timedelta(seconds=30)   # how far behind the watermark duplicates are still caught
+DEDUP_CAPACITY = 256                     # fingerprints remembered per device
+
+# Stages a late reading skips; it is still validated and persisted
+LIVE_STAGES = frozenset(("state", "derived", "alerts"))
+
+# Smallest change that makes derived results worth recomputing. Threshold
+# crossings always count, however small.
+DEADBANDS = {
+    "temperature": 0.2,
+    "humidity": 1.0,
+    "pm25": 0.5,
+    "pm10": 1.0,
+    "noise": 1.0,
+    "light": 10.0,
+    "co2": 20.0,
+    "vocs": 10.0,
+}
+
+NUMERIC_FIELDS = ("temperature", "humidity", "pm25", "pm10", "noise", "light")
+OPTIONAL_FIELDS = ("altitude", "pressure", "co2", "vocs", "aqi", "air_quality_score", "gas")
+
+STAGE_LATENCY = Histogram(
+    "monacos_ingest_stage_duration_seconds",
+    "Time spent in each ingest pipeline stage",
+    ("stage",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01, 0.1),
+)
+INGEST_ORDERING = Counter(
+    "monacos_ingest_ordering_total",
+    "Readings by ordering outcome (in_order, late, stale, duplicate)",
+    ("outcome",),
+)
+INGEST_RECOMPUTE = Counter(
+    "monacos_ingest_recompute_total",
+    "Derived / alert evaluations per ingest stage, computed or skipped as unchanged",
+    ("stage", "outcome"),
+)
+
+log = get_logger("ingest")
+
+
+class ReadingRejected(ValueError):
+    pass
+
+
+class IngestContext:
+    __slots__ = ("reading", "device_id", "derived", "alerts", "status", "server_stamped", "skip", "dropped",
+                 "bands", "bands_changed")
+
+    def __init__(self, reading: Reading):
+        self.reading = reading
+        self.device_id = reading.device_id
+        self.derived = {}
+        self.alerts = []
+        self.status = "ingested"      # ingested | late | duplicate
+        self.server_stamped = False   # no device timestamp, validate stamped it
+        self.skip = None              # stage names to skip for this reading
+        self.dropped = False          # stop here, run no further stages
+        self.bands = None             # band_vector, set by the derived stage and shared by the engines
+        self.bands_changed = True     # set by the derived stage
+
+
+class IngestPipeline:
+    def __init__(self, stages=()):
+        self.stages = list(stages)  # [(name, fn), ...]
+        self.stats = {"processed": 0, "rejected": 0, "late": 0, "duplicates": 0}
+
+    def _index(self, name):
+        for i, (stage_name, _) in enumerate(self.stages):
+            if stage_name == name:
+                return i
+        raise KeyError(f"No ingest stage named {name!r}")
+
+    def add_stage(self, name, fn, before=None, after=None):
+        if before is not None:
+            self.stages.insert(self._index(before), (name, fn))
+        elif after is not None:
+            self.stages.insert(self._index(after) + 1, (name, fn))
+        else:
+            self.stages.append((name, fn))
+
+    def replace_stage(self, name, fn):
+        self.stages[self._index(name)] = (name, fn)
+
+    def remove_stage(self, name):
+        del self.stages[self._index(name)]
+
+    def process(self, reading) -> IngestContext:
+        """Runs one Reading (or reading dict) through every stage. Raises ReadingRejected."""
+        if not isinstance(reading, Reading):
+            reading = Reading.from_dict(reading)
+        ctx = IngestContext(reading)
+        perf_counter = time.perf_counter
+        for name, fn in self.stages:
+            if ctx.dropped:
+                break
+            if ctx.skip and name in ctx.skip:
+                continue
+            started = perf_counter()
+            try:
+                fn(ctx)
+            except ReadingRejected:
+                self.stats["rejected"] += 1
+                raise
+            finally:
+                STAGE_LATENCY.observe(perf_counter() - started, name)
+        if ctx.status == "duplicate":
+            self.stats["duplicates"] += 1
+        else:
+            self.stats["processed"] += 1
+            if ctx.status == "late":
+                self.stats["late"] += 1
+        return ctx
+
+    def process_many(self, readings) -> dict:
+        """Batch variant: rejected readings are skipped and counted, not raised."""
+        accepted = rejected = late = duplicates = 0
+        for reading in readings:
+            try:
+                status = self.process(reading).status
+            except ReadingRejected as e:
+                rejected += 1
+                log_sampled(log, "/api/ingest/batch", logging.WARNING, "reading rejected", reason=str(e))
+                continue
+            if status == "duplicate":
+                duplicates += 1
+            else:
+                accepted += 1
+                late += status == "late"
+        return {"status": "ingested", "count": accepted, "rejected": rejected, "late": late, "duplicates": duplicates}
+
+
+# ---------------------------
+# DEFAULT STAGES
+# ---------------------------
+
+def validate_stage(ctx: IngestContext):
+    reading = ctx.reading
+    if not ctx.device_id:
+        raise ReadingRejected("missing device_id")
+    for field in NUMERIC_FIELDS:
+        value = reading.get(field)
+        if value is None or not math.isfinite(value):
+            raise ReadingRejected(f"{field} must be a finite number")
+    # Optional metrics are dropped rather than rejected; inf/NaN would
+    # otherwise be stored and break the cold-tier encoder later on.
+    for field in OPTIONAL_FIELDS:
+        value = reading.get(field)
+        if value is not None and not math.isfinite(value):
+            setattr(reading, field, None)
+
+    # Naive UTC everywhere so list_devices / history comparisons line up
+    timestamp = reading.timestamp
+    if timestamp is None:
+        reading.timestamp = datetime.utcnow()
+        ctx.server_stamped = True
+    elif timestamp.tzinfo:
+        reading.timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------------------
+# ORDERING / DEDUP
+# ---------------------------
+
+class OrderTracker:
+    """
+    Per-device timestamp watermark plus a small recent-fingerprint set.
+
+    A reading newer than the watermark advances it. An exact repeat of a
+    reading seen within REORDER_WINDOW of the watermark is a duplicate;
+    anything else at or behind the watermark is late. Readings further
+    back than the window can no longer be matched and are treated as late
+    ("stale" in the metrics); if they were already stored, the persist
+    path drops them (unique device_id + timestamp). State is per process:
+    each worker filters the readings it receives.
+    """
+
+    def __init__(self, window=REORDER_WINDOW, capacity=DEDUP_CAPACITY):
+        self.window = window
+        self.capacity = capacity
+        self._watermarks = {}   # device_id -> newest timestamp accepted
+        self._seen = {}         # device_id -> {fingerprint: timestamp}, insertion ordered
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(reading: dict) -> int:
+        return hash((reading["timestamp"], *[reading.get(f) for f in NUMERIC_FIELDS]))
+
+    def _watermark(self, device_id):
+        watermark = self._watermarks.get(device_id)
+        if watermark is None:
+            # First reading in this process: start from warm-started / shared live state
+            latest = DEVICE_STATE.get(device_id)
+            watermark = latest.get("timestamp") if latest else None
+            if not isinstance(watermark, datetime):
+                watermark = None
+        return watermark
+
+    def classify(self, device_id: str, reading: dict) -> str:
+        """Returns "in_order", "late", "stale" or "duplicate" and records the reading."""
+        timestamp = reading["timestamp"]
+        key = self.fingerprint(reading)
+        with self._lock:
+            watermark = self._watermark(device_id)
+            seen = self._seen.setdefault(device_id, {})
+            if key in seen:
+                return "duplicate"
+
+            if watermark is None or timestamp > watermark:
+                outcome = "in_order"
+                watermark = self._watermarks[device_id] = timestamp
+            elif watermark - timestamp <= self.window:
+                outcome = "late"
+            else:
+                return "stale"
+
+            seen[key] = timestamp
+            horizon = watermark - self.window
+            while seen:
+                oldest = next(iter(seen))
+                if len(seen) <= self.capacity and seen[oldest] >= horizon:
+                    break
+                del seen[oldest]
+            return outcome
+
+    def reset(self):
+        with self._lock:
+            self._watermarks.clear()
+            self._seen.clear()
+
+
+ORDER = OrderTracker()
+
+
+def order_stage(ctx: IngestContext):
+    # Server-stamped readings are "now" by definition and have nothing to dedupe on
+    if ctx.server_stamped:
+        INGEST_ORDERING.inc("in_order")
+        return
+    outcome = ORDER.classify(ctx.device_id, ctx.reading)
+    INGEST_ORDERING.inc(outcome)
+    if outcome == "duplicate":
+        ctx.status = "duplicate"
+        ctx.dropped = True
+    elif outcome != "in_order":
+        ctx.status = "late"
+        ctx.skip = LIVE_STAGES
+
+
+# ---------------------------
+# CHANGE DETECTION
+# ---------------------------
+
+class ChangeDetector:
+    """
+    Remembers, per device, the metric values and band vector the derived
+    results were last computed from. A reading counts as changed when a
+    metric moved at least its deadband from those values (drift adds up,
+    it is not compared reading to reading) or its band vector differs.
+    Per process, like OrderTracker.
+    """
+
+    def __init__(self, deadbands=DEADBANDS):
+        self.deadbands = tuple(deadbands.items())
+        self.derived = {}   # device_id -> derived dict last computed
+        self._ref = {}      # device_id -> (values, bands)
+        self.stats = {"derived_computed": 0, "derived_skipped": 0, "alerts_computed": 0, "alerts_skipped": 0}
+
+    def _moved(self, reading: dict, values: tuple) -> bool:
+        for (field, deadband), ref in zip(self.deadbands, values):
+            value = reading.get(field)
+            if value is None or ref is None:
+                if value is not ref:
+                    return True
+            elif abs(value - ref) >= deadband:
+                return True
+        return False
+
+    def observe(self, device_id: str, reading: dict, bands: tuple):
+        """Returns (changed, bands_changed) and re-bases the device when changed."""
+        ref = self._ref.get(device_id)
+        if ref is not None and device_id in self.derived:
+            bands_changed = bands != ref[1]
+            if not bands_changed and not self._moved(reading, ref[0]):
+                return False, False
+        else:
+            bands_changed = True
+        self._ref[device_id] = (tuple(reading.get(f) for f, _ in self.deadbands), bands)
+        return True, bands_changed
+
+    def skip_rate(self, stage: str) -> float:
+        skipped = self.stats[f"{stage}_skipped"]
+        total = skipped + self.stats[f"{stage}_computed"]
+        return skipped / total if total else 0.0
+
+    def reset(self):
+        self.derived.clear()
+        self._ref.clear()
+
+
+CHANGES = ChangeDetector()
+
+
+def state_stage(ctx: IngestContext):
+    device_id = ctx.device_id
+    INGEST_READINGS.inc(device_id)
+
+    # latest snapshot + history buffer
+    with device_lock(device_id):
+        DEVICE_STATE[device_id] = ctx.reading
+        append_history(device_id, ctx.reading, MAX_HISTORY)
+    log_sampled(log, "/api/ingest", logging.DEBUG, "reading ingested", device_id=device_id, reading=ctx.reading)
+
+
+def derived_stage(ctx: IngestContext):
+    reading = ctx.reading
+    bands = ctx.bands = band_vector(reading)
+    changed, ctx.bands_changed = CHANGES.observe(ctx.device_id, reading, bands)
+    if not changed:
+        ctx.derived = CHANGES.derived[ctx.device_id]
+        CHANGES.stats["derived_skipped"] += 1
+        INGEST_RECOMPUTE.inc("derived", "skipped")
+        return
+
+    ctx.derived = {
+        "health": calculate_health_score(reading, bands),
+        "aqi": calculate_pm_aqi(reading["pm25"], reading["pm10"]),
+        "recommendations": generate_recommendations(reading, bands),
+    }
+    CHANGES.derived[ctx.device_id] = ctx.derived
+    DEVICE_DERIVED[ctx.device_id] = ctx.derived
+
+    # Invalidates cached chat answers for this device. Only here: readings
+    # within the deadbands would otherwise expire the chat cache every few
+    # seconds while the answer stays the same
+    bump_version(ctx.device_id)
+    CHANGES.stats["derived_computed"] += 1
+    INGEST_RECOMPUTE.inc("derived", "computed")
+
+
+def alerts_stage(ctx: IngestContext):
+    # Same bands as last time and nothing was firing: the result would be empty
+    if not ctx.bands_changed and not has_active_conditions(ctx.device_id):
+        CHANGES.stats["alerts_skipped"] += 1
+        INGEST_RECOMPUTE.inc("alerts", "skipped")
+        return
+    CHANGES.stats["alerts_computed"] += 1
+    INGEST_RECOMPUTE.inc("alerts", "computed")
+
+    new_alerts = generate_alerts(ctx.reading, ctx.bands)
+    if not new_alerts:
+        return
+    ctx.alerts = new_alerts
+    DEVICE_ALERTS[ctx.device_id] = merge_alerts(DEVICE_ALERTS.get(ctx.device_id, []), new_alerts)
+
+
+def merge_alerts(alerts: list, new_alerts: list) -> list:
+    """Keeps only the latest alert per title, capped at MAX_ALERTS."""
+    titles = {a["title"] for a in new_alerts}
+    merged = [a for a in alerts if a["title"] not in titles] + new_alerts
+    return merged[-MAX_ALERTS:]
+
+
+# ---------------------------
+# PERSISTENCE
+# ---------------------------
+
+class PersistenceWriter:
+    """
+    Background thread that drains queued readings into the repository in
+    batches (one transaction per batch) so ingest requests never wait on a write.
+    The repository skips readings already stored for the same device and
+    timestamp, which catches replays too old for OrderTracker to match.
+    """
+
+    def __init__(self, batch_size=PERSIST_BATCH_SIZE, flush_interval=PERSIST_FLUSH_INTERVAL,
+                 max_queue=PERSIST_MAX_QUEUE, write=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write = write or REPOSITORY.insert_readings
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "dropped": 0, "failed": 0, "already_stored": 0}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def submit(self, row: dict):
+        try:
+            self.queue.put_nowait(row)
+            self.stats["queued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+            log_sampled(log, "persist", logging.WARNING, "persistence queue full, reading dropped", device_id=row.get("device_id"))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            written = self.write(batch)
+            if written is None:   # writers that don't report inserted rows
+                written = len(batch)
+            self.stats["written"] += written
+            self.stats["already_stored"] += len(batch) - written
+            self.stats["batches"] += 1
+        except Exception:
+            self.stats["failed"] += len(batch)
+            log.exception("failed to persist readings", extra={"fields": {"count": len(batch)}})
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes whatever is queued, then stops the thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+
+WRITER = PersistenceWriter()
+
+
+def persist_stage(ctx: IngestContext):
+    row = ctx.reading
+    if row.aqi is None:
+        # From this row's own PM values, not ctx.derived: that is cached from
+        # an earlier reading when nothing changed, and empty for late ones
+        aqi = calculate_pm_aqi(row.pm25, row.pm10)
+        if aqi:
+            # Copy: the live state keeps what the device actually sent
+            row = row.replace(aqi=aqi["aqi"])
+    WRITER.submit(row)
+
+
+PIPELINE = IngestPipeline([
+    ("validate", validate_stage),
+    ("order", order_stage),
+    ("state", state_stage),
+    ("derived", derived_stage),
+    ("alerts", alerts_stage),
+    ("persist", persist_stage),
+])
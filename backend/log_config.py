@@ -0,0 +1,127 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+# ---------------------------
+# STRUCTURED, QUEUE-BASED LOGGING
+# ---------------------------
+# Request handlers only put records on an in-memory queue; a background
+# QueueListener thread formats them as JSON lines and writes to stdout, so
+# log I/O never blocks a request.
+#
+#   log = get_logger("ingest")
+#   log.info("reading ingested", extra={"fields": {"device_id": d}})
+#   log_sampled(log, "/api/ingest", logging.DEBUG, "reading ingested", device_id=d)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Fraction of requests logged per route by log_sampled (1.0 = all, 0 = none).
+# Routes not listed are always logged.
+LOG_SAMPLE_RATES = {
+    "/api/ingest": 0.01,
+    "/api/ingest/batch": 0.01,
+    "/api/ingest/binary": 0.01,
+    "/api/latest": 0.01,
+    "/api/history": 0.1,
+}
+
+ROOT_LOGGER = "monacos"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_listener = None
+_queue_handler = None
+_output = None   # the stdout handler, written to by the listener thread
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Idempotent. Installs the queue handler and starts the writer thread."""
+    global _listener, _queue_handler, _output
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    if _output is None:
+        _output = logging.StreamHandler(sys.stdout)
+        _output.setFormatter(JsonFormatter())
+    else:
+        # Set up again after shutdown_logging: stop writing synchronously
+        root.removeHandler(_output)
+
+    root.setLevel(level)
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, _output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Drains the queue and stops the writer thread. Later records (uvicorn
+    teardown, background jobs finishing) are written to stdout directly
+    instead of going to a queue nobody reads.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(_output)
+        root.removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+# ---------------------------
+# PER-ROUTE SAMPLING
+# ---------------------------
+
+_counters = {}
+
+
+def _sampled(route: str) -> bool:
+    rate = LOG_SAMPLE_RATES.get(route, 1.0)
+    if rate >= 1.0:
+        return True
+    if rate <= 0.0:
+        return False
+    counter = _counters.get(route)
+    if counter is None:
+        counter = _counters.setdefault(route, itertools.count())
+    # Deterministic 1-in-N; itertools.count is atomic under the GIL
+    return next(counter) % round(1 / rate) == 0
+
+
+def log_sampled(logger: logging.Logger, route: str, level: int, msg: str, **fields):
+    """Logs `msg` for a sample of requests on `route` (see LOG_SAMPLE_RATES)."""
+    if logger.isEnabledFor(level) and _sampled(route):
+        logger.log(level, msg, extra={"fields": {"route": route, **fields}})
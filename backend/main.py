@@ -1,23 +1,35 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import Dict, List
+import csv
+import io
+import logging
 
 from recommendation_engine import generate_recommendations
-from aqi_engine import calculate_pm_aqi
-from alerts_engine import generate_alerts
 from health_engine import calculate_health_score
 import auth
-from db import create_user, get_user_by_username, init_db
+from fast_json import FastJSONResponse
+from log_config import setup_logging, shutdown_logging, get_logger, log_sampled
+import metrics
+import warm_start
+from retention import RETENTION
+from cold_storage import COLD_COLUMNS, COMPACTOR, read_history
+from metrics import MetricsMiddleware
+from repository import REPOSITORY, get_user_by_username_cached, invalidate_user, update_user_password_hash
 from schemas import UserCreate, Token, UserResponse
+from routes.monacos import router as monacos_router
 
 # ---------------------------
 # APP SETUP
 # ---------------------------
 
-app = FastAPI(title="Monacos Indoor Health API")
+setup_logging()
+log = get_logger("api")
+
+app = FastAPI(title="Monacos Indoor Health API", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,13 +44,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# per-route latency histograms (see /metrics)
+app.add_middleware(MetricsMiddleware)
+
 # ---------------------------
 # IN-MEMORY STORAGE
 # ---------------------------
 
-from shared_state import DEVICE_STATE, DEVICE_HISTORY, DEVICE_ALERTS
+from shared_state import DEVICE_STATE, DEVICE_ALERTS, DEVICE_DERIVED
+from ingest_pipeline import CHANGES, MAX_HISTORY, WRITER
 
-MAX_HISTORY = 60          # last 60 readings
 ONLINE_TIMEOUT = 30      # seconds
 
 # ---------------------------
@@ -47,17 +62,43 @@ ONLINE_TIMEOUT = 30      # seconds
 
 @app.on_event("startup")
 def startup_event():
-    init_db()
+    REPOSITORY.init_schema()
+    # Rebuild live state from the DB in the background; traffic is served meanwhile
+    warm_start.start_background(MAX_HISTORY)
+    WRITER.start()
+    # Partition retention and the cold tier are SQLite-specific
+    if REPOSITORY.supports_maintenance:
+        RETENTION.start()
+        COMPACTOR.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    COMPACTOR.stop()
+    RETENTION.stop()
+    WRITER.stop()
+    REPOSITORY.close()
+    auth.shutdown_hash_pool()
+    shutdown_logging()
+
+def _hashing_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy. Please retry shortly.",
+        headers={"Retry-After": "1"}
+    )
+
+# signup/login are async so bcrypt can be awaited on the hashing process pool;
+# the (fast) SQLite calls are pushed to the threadpool to keep the loop free.
 
 @app.post("/auth/signup", response_model=UserResponse)
-def signup(user: UserCreate):
+async def signup(user: UserCreate):
     try:
-        existing_user = get_user_by_username(user.username)
+        existing_user = await run_in_threadpool(REPOSITORY.get_user_by_username, user.username)
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already registered")
         
-        hashed_password = auth.get_password_hash(user.password)
-        user_id = create_user(user.username, hashed_password)
+        hashed_password = await auth.hash_password_async(user.password)
+        user_id = await run_in_threadpool(REPOSITORY.create_user, user.username, hashed_password)
         
         if not user_id:
             # Check if it was collision that wasn't caught?
@@ -69,18 +110,33 @@ def signup(user: UserCreate):
             "username": user.username,
             "created_at": datetime.utcnow()
         }
+    except auth.HashQueueFull:
+        raise _hashing_busy()
     except Exception as e:
-        print(f"Signup Error: {e}")
+        log.error("signup failed", extra={"fields": {"username": user.username, "error": str(e)}})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/auth/login", response_model=Token)
-def login(user: UserCreate):
-    db_user = get_user_by_username(user.username)
+async def login(user: UserCreate):
+    db_user = await run_in_threadpool(REPOSITORY.get_user_by_username, user.username)
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    if not auth.verify_password(user.password, db_user["password_hash"]):
-        raise HTTPException(status_code=401, detail="Invalid username or password")
+    try:
+        if not await auth.verify_password_async(user.password, db_user["password_hash"]):
+            raise HTTPException(status_code=401, detail="Invalid username or password")
+    except auth.HashQueueFull:
+        raise _hashing_busy()
+
+    # Cost factor changed since this hash was made: upgrade it transparently.
+    # Optional work: with the pool saturated the login still succeeds and the
+    # upgrade waits for a later login.
+    if auth.needs_rehash(db_user["password_hash"]):
+        try:
+            new_hash = await auth.hash_password_async(user.password)
+            await run_in_threadpool(update_user_password_hash, user.username, new_hash)
+        except auth.HashQueueFull:
+            log.info("rehash skipped, hash pool busy", extra={"fields": {"username": user.username}})
     
     access_token = auth.create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -90,11 +146,11 @@ from fastapi.security import OAuth2PasswordBearer
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
-    payload = auth.decode_access_token(token)
+    payload = auth.decode_access_token_cached(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     username = payload.get("sub")
-    user = get_user_by_username(username)
+    user = get_user_by_username_cached(username)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -116,74 +172,16 @@ class UserUpdate(BaseModel):
 
 @app.put("/auth/me")
 def update_me(payload: UserUpdate, current_user: dict = Depends(get_current_user)):
-    from db import update_user_profile
-    update_user_profile(current_user["username"], payload.email, payload.full_name)
+    # The cached user row changed; the token's claims didn't, so it stays cached
+    REPOSITORY.update_user_profile(current_user["username"], payload.email, payload.full_name)
+    invalidate_user(current_user["username"])
     return {"status": "updated", "email": payload.email, "full_name": payload.full_name}
 
 # ---------------------------
-# DATA MODEL
+# INGEST (routes/monacos.py -> ingest_pipeline)
 # ---------------------------
 
-class SensorPayload(BaseModel):
-    device_id: str
-
-    temperature: float
-    humidity: float
-
-    pm25: float
-    pm10: float
-
-    noise: float
-    light: float
-
-    timestamp: datetime | None = None
-    
-    # New Standard Fields
-    altitude: float | None = None
-    pressure: float | None = None
-    co2: float | None = None
-    vocs: float | None = None
-    aqi: float | None = None
-    air_quality_score: float | None = None
-
-    # Arduino specific/Optional (Legacy or specific)
-    gas: float | None = None
-
-# ---------------------------
-# INGEST SENSOR DATA
-# ---------------------------
-
-@app.post("/api/ingest")
-def ingest(payload: SensorPayload):
-    from db import ensure_device_exists
-    
-    timestamp = payload.timestamp or datetime.utcnow()
-
-    data = payload.dict()
-    data["timestamp"] = timestamp
-
-    # Ensure device is registered in DB
-    ensure_device_exists(payload.device_id)
-
-    # latest snapshot
-    print(f"DEBUG: Ingesting for {payload.device_id}. Data: {data}")
-    DEVICE_STATE[payload.device_id] = data
-    print(f"DEBUG: Current DEVICE_STATE keys: {list(DEVICE_STATE.keys())}")
-
-    # history buffer
-    DEVICE_HISTORY.setdefault(payload.device_id, []).append(data)
-    DEVICE_HISTORY[payload.device_id] = DEVICE_HISTORY[payload.device_id][-MAX_HISTORY:]
-
-    return {
-        "status": "ingested",
-        "device_id": payload.device_id,
-        "timestamp": timestamp,
-    }
-
-@app.post("/data")
-def ingest_arduino(payload: SensorPayload):
-    # Compatibility route for Arduino which uses /data
-    return ingest(payload)
+app.include_router(monacos_router)
 
 # ---------------------------
 # GET LATEST DATA
@@ -191,30 +189,14 @@ def ingest_arduino(payload: SensorPayload):
 
 @app.get("/api/latest/{device_id}")
 def get_latest(device_id: str):
-    print(f"DEBUG: Request for {device_id}. Keys in memory: {list(DEVICE_STATE.keys())}")
-    
     if device_id in DEVICE_STATE:
         return DEVICE_STATE[device_id]
 
-    print(f"DEBUG: Memory miss for {device_id}. Checking DB...")
-    from db import get_db
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get latest reading from DB
-    cursor.execute("""
-        SELECT * FROM sensor_readings 
-        WHERE device_id = ? 
-        ORDER BY timestamp DESC 
-        LIMIT 1
-    """, (device_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        data = dict(row)
-        # Type conversion if needed (sqlite returns basic types)
+    log_sampled(log, "/api/latest", logging.DEBUG, "memory miss, checking DB", device_id=device_id)
+
+    # Latest reading from the DB (newest partition first)
+    data = REPOSITORY.get_latest_reading(device_id)
+    if data:
         # Ensure it matches SensorPayload structure roughly for frontend
         return data
         
@@ -226,28 +208,51 @@ def get_latest(device_id: str):
 
 @app.get("/api/history/{device_id}")
 def get_history(device_id: str):
-    print(f"DEBUG: Fetching history for {device_id} from DB")
-    from db import get_db
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get last 7 days of data
-    # We generated data with timestamp being stored. 
-    # SQLite stores DATETIME as strings usually.
+    # Get last 7 days of data: compacted cold chunks + hot partitions, merged
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
-    cursor.execute("""
-        SELECT * FROM sensor_readings 
-        WHERE device_id = ? AND timestamp >= ? 
-        ORDER BY timestamp ASC
-    """, (device_id, seven_days_ago))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    results = [dict(row) for row in rows]
-    print(f"DEBUG: Found {len(results)} history records for {device_id}")
-    return results
+    results = read_history(device_id, since=seven_days_ago)
+
+    log_sampled(log, "/api/history", logging.DEBUG, "history fetched", device_id=device_id, rows=len(results))
+    # Returned as a response so FastAPI skips jsonable_encoder over every row
+    return FastJSONResponse(results)
+
+# ---------------------------
+# EXPORT
+# ---------------------------
+
+EXPORT_COLUMNS = ("timestamp", "device_id") + COLD_COLUMNS
+
+@app.get("/api/export/{device_id}")
+def export_history(device_id: str, days: int = 30, format: str = "csv"):
+    """A device's readings over the last `days` days (cold + hot tiers), as CSV or JSON."""
+    if format not in ("csv", "json"):
+        raise HTTPException(400, "format must be csv or json")
+    since = datetime.utcnow() - timedelta(days=days)
+    rows = read_history(device_id, since=since)
+
+    if format == "json":
+        return FastJSONResponse(
+            [{c: row.get(c) for c in EXPORT_COLUMNS} for row in rows],
+            headers={"Content-Disposition": f'attachment; filename="{device_id}.json"'},
+        )
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{device_id}.csv"'},
+    )
 
 # ---------------------------
 # HEALTH SCORE
@@ -258,6 +263,10 @@ def get_health_score(device_id: str):
     if device_id not in DEVICE_STATE:
         raise HTTPException(404, "Device offline")
 
+    # Computed at ingest by the pipeline; warm-started devices fall back to computing it here
+    derived = DEVICE_DERIVED.get(device_id)
+    if derived is not None:
+        return derived["health"]
     return calculate_health_score(DEVICE_STATE[device_id])
 
 # ---------------------------
@@ -269,25 +278,8 @@ def get_alerts(device_id: str):
     if device_id not in DEVICE_STATE:
         raise HTTPException(404, "Device offline")
 
-    new_alerts = generate_alerts(DEVICE_STATE[device_id])
-
-    DEVICE_ALERTS.setdefault(device_id, [])
-
-    # Deduplicate by title: Remove old alerts that match the title of new alerts
-    # This ensures we only keep the LATEST alert of a specific type (e.g., "High PM2.5 Pollution")
-    for new_alert in new_alerts:
-        # Remove existing alerts with the same title
-        DEVICE_ALERTS[device_id] = [
-            a for a in DEVICE_ALERTS[device_id] 
-            if a["title"] != new_alert["title"]
-        ]
-        # Append the new one
-        DEVICE_ALERTS[device_id].append(new_alert)
-
-    # Optional: Keep only last 20 alerts total to prevent unbounded growth if many types exist
-    DEVICE_ALERTS[device_id] = DEVICE_ALERTS[device_id][-20:]
-
-    return DEVICE_ALERTS[device_id]
+    # Alerts are generated at ingest (ingest_pipeline.alerts_stage)
+    return DEVICE_ALERTS.get(device_id, [])
 
 # ---------------------------
 # LIST DEVICES
@@ -295,8 +287,6 @@ def get_alerts(device_id: str):
 
 @app.get("/api/devices")
 def list_devices():
-    from db import get_all_devices
-    
     now = datetime.utcnow()
     devices = []
     
@@ -305,7 +295,7 @@ def list_devices():
         return d.get(key, 0.0)
 
     # Get all persisted devices
-    db_devices = get_all_devices()
+    db_devices = REPOSITORY.get_all_devices()
     
     for db_dev in db_devices:
         d_id = db_dev["device_id"]
@@ -355,7 +345,7 @@ def list_devices():
                 "time": str(ls) # For debugging/display
             })
 
-    return devices
+    return FastJSONResponse(devices)
 
 
 class DeviceCreate(BaseModel):
@@ -363,8 +353,7 @@ class DeviceCreate(BaseModel):
 
 @app.post("/api/devices")
 def add_device(payload: DeviceCreate):
-    from db import ensure_device_exists
-    ensure_device_exists(payload.device_id)
+    REPOSITORY.ensure_device_exists(payload.device_id)
     return {"status": "created", "device_id": payload.device_id}
 
 
@@ -377,6 +366,10 @@ def recommendations(device_id: str):
     if device_id not in DEVICE_STATE:
         raise HTTPException(404, "Device offline")
 
+    # Kept current by the pipeline's derived stage (recomputed only on change)
+    derived = DEVICE_DERIVED.get(device_id)
+    if derived is not None and "recommendations" in derived:
+        return derived["recommendations"]
     return generate_recommendations(DEVICE_STATE[device_id])
 
 # ---------------------------
@@ -399,7 +392,9 @@ def get_aqi(device_id: str):
     # FIX: Handle None values safely
     aqi_val = data.get("aqi")
     if aqi_val is None:
-        aqi_val = 0
+        # Not sent by the device: use the PM-based AQI from the ingest pipeline
+        derived = DEVICE_DERIVED.get(device_id) or {}
+        aqi_val = (derived.get("aqi") or {}).get("aqi", 0)
     
     # Simple categorization for display if not provided
     category = "Good"
@@ -425,19 +420,62 @@ def get_aqi(device_id: str):
 # AGENT / CHAT
 # ---------------------------
 
+from rate_limiter import KeyedLimiter, ConcurrencyLimiter, retry_after_header
+
+CHAT_USER_LIMIT = KeyedLimiter(rate=10 / 60, capacity=5)      # 10/min per user, burst 5
+CHAT_DEVICE_LIMIT = KeyedLimiter(rate=20 / 60, capacity=10)   # 20/min per device, burst 10
+CHAT_CONCURRENCY = ConcurrencyLimiter(limit=4)                # in-flight LLM calls
+
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
+
 class ChatRequest(BaseModel):
     message: str
     device_id: str
 
+def _chat_rejected(detail: str, retry_after: str):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": detail, "source": "Local rate limit"},
+        headers={"Retry-After": retry_after}
+    )
+
 @app.post("/api/chat")
-def chat_agent(payload: ChatRequest):
+def chat_agent(payload: ChatRequest, request: Request, token: str | None = Depends(optional_oauth2_scheme)):
+    # Local limits are checked before any upstream work so that a burst (or an
+    # exhausted Gemini quota) is shed here instead of tying up worker threads.
+    claims = auth.decode_access_token_cached(token) if token else None
+    if claims and claims.get("sub"):
+        user_key = f"user:{claims['sub']}"
+    else:
+        user_key = f"ip:{request.client.host if request.client else 'unknown'}"
+
+    wait = CHAT_USER_LIMIT.check(user_key)
+    if wait:
+        return _chat_rejected("Too many chat requests. Please slow down.", retry_after_header(wait))
+
+    wait = CHAT_DEVICE_LIMIT.check(payload.device_id)
+    if wait:
+        CHAT_USER_LIMIT.refund(user_key)
+        return _chat_rejected("Too many chat requests for this device.", retry_after_header(wait))
+
+    if not CHAT_CONCURRENCY.try_enter():
+        CHAT_USER_LIMIT.refund(user_key)
+        CHAT_DEVICE_LIMIT.refund(payload.device_id)
+        return _chat_rejected("Chat assistant is busy. Please retry shortly.", retry_after_header(1))
+
+    try:
+        return _run_chat(payload)
+    finally:
+        CHAT_CONCURRENCY.leave()
+
+def _run_chat(payload: ChatRequest):
     from agent_engine import run_agent
     try:
         response = run_agent(payload.message, payload.device_id)
         return {"response": response, "actions_taken": []}
     except Exception as e:
         error_msg = str(e)
-        print(f"Agent Error: {error_msg}")
+        log.warning("agent error", extra={"fields": {"device_id": payload.device_id, "error": error_msg}})
         
         # Handle quota exceeded
         if ("quota" in error_msg.lower() or "resource_exhausted" in error_msg.lower() or 
@@ -446,14 +484,8 @@ def chat_agent(payload: ChatRequest):
             # Extract wait time if available in error message (simplified)
             retry_after = "60" 
             
-            # USER REQUEST: "Show me how to increase the limit for local development"
             # NOTE: Since the limit is from Google Gemini (Upstream), you cannot increase it locally 
-            # without upgrading your Google Cloud plan.
-            # 
-            # If you wanted to add LOCAL rate limiting (e.g., to prevent spam),
-            # you would use 'slowapi' here. Example:
-            # @limiter.limit("5/minute")
-            # def chat_agent...
+            # without upgrading your Google Cloud plan. Local limits are enforced in chat_agent.
             
             return JSONResponse(
                 status_code=429,
@@ -468,3 +500,17 @@ def chat_agent(payload: ChatRequest):
         # Handle other errors with helpful message
         raise HTTPException(status_code=500, detail=f"Chatbot temporarily unavailable: {error_msg[:100]}")
 
+# ---------------------------
+# METRICS
+# ---------------------------
+
+metrics.Gauge("monacos_chat_in_flight", "Chat requests currently running", lambda: CHAT_CONCURRENCY.in_flight)
+metrics.Gauge("monacos_hash_queue_depth", "Password hashing jobs pending", lambda: auth.HASH_STATS["pending"])
+metrics.Gauge("monacos_persist_queue_depth", "Readings waiting for the batched DB writer", WRITER.depth)
+metrics.Gauge("monacos_live_devices", "Devices with live in-memory state", lambda: len(DEVICE_STATE))
+metrics.Gauge("monacos_ingest_derived_skip_ratio", "Share of readings reusing cached derived results", lambda: CHANGES.skip_rate("derived"))
+metrics.Gauge("monacos_ingest_alerts_skip_ratio", "Share of readings skipping alert evaluation", lambda: CHANGES.skip_rate("alerts"))
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render_all(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,210 @@
+import bisect
+import re
+import threading
+import time
+
+# ---------------------------
+# PROMETHEUS-STYLE METRICS
+# ---------------------------
+# Recording is a dict lookup plus an increment under a lock; nothing is
+# formatted until /metrics is scraped, so unscraped metrics cost ~nothing.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Sampled only at scrape time via `fn()`; returns a number or {labels_tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+def render_all() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# METRICS
+# ---------------------------
+
+HTTP_LATENCY = Histogram(
+    "monacos_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+INGEST_READINGS = Counter(
+    "monacos_ingest_readings_total",
+    "Readings ingested per device",
+    ("device_id",),
+)
+DB_QUERY_LATENCY = Histogram(
+    "monacos_db_query_duration_seconds",
+    "SQLite statement execution time",
+    ("op", "table"),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+ALERTS_EMITTED = Counter(
+    "monacos_alerts_emitted_total",
+    "Alerts emitted by type",
+    ("alert_type",),
+)
+LLM_CALL_LATENCY = Histogram(
+    "monacos_llm_call_duration_seconds",
+    "Gemini call duration by outcome",
+    ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0),
+)
+LLM_RETRIES = Counter(
+    "monacos_llm_retries_total",
+    "Gemini calls retried after a quota / rate-limit error",
+)
+
+
+# ---------------------------
+# DB STATEMENT LABELS
+# ---------------------------
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_PARTITION_SUFFIX_RE = re.compile(r"_\d{6}$")
+_STATEMENT_LABELS = {}
+
+
+def statement_labels(sql: str):
+    """(op, table) for a SQL string; cached since statements are constants."""
+    labels = _STATEMENT_LABELS.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        op = words[0].upper() if words else "?"
+        match = _TABLE_RE.search(sql)
+        # Monthly partitions (sensor_readings_202610) share one label
+        table = _PARTITION_SUFFIX_RE.sub("", match.group(1)) if match else ""
+        labels = (op, table)
+        if len(_STATEMENT_LABELS) < 1000:
+            _STATEMENT_LABELS[sql] = labels
+    return labels
+
+
+# ---------------------------
+# ASGI MIDDLEWARE
+# ---------------------------
+
+class MetricsMiddleware:
+    """Records per-route latency using the matched route template (/api/latest/{device_id})."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, scope["method"], path, status["code"])
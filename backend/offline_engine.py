@@ -0,0 +1,225 @@
+import re
+
+from aqi_engine import calculate_pm_aqi, get_aqi_category
+from health_engine import calculate_health_score
+from recommendation_engine import generate_recommendations
+
+# ---------------------------
+# LOCAL RULE-BASED ANSWERS
+# ---------------------------
+# Answers chat questions straight from a structured snapshot
+# (see agent_engine.get_live_snapshot):
+#
+#   {"device_id": str, "reading": dict | None,
+#    "forecast": {"temperature": [...], "humidity": [...], "pm25": [...]} | None}
+#
+# Used as the fallback when the LLM quota is exhausted, and as a fast path
+# for simple factual questions before calling the LLM at all.
+
+OFFLINE_PREFIX = "Offline Mode: "
+
+# Questions containing these need real reasoning -> never take the fast path
+_COMPLEX_CUES = {
+    "why", "explain", "compare", "should", "could", "would", "if",
+    "safe", "cause", "causes", "reason", "difference", "vs", "versus",
+}
+FAST_PATH_MAX_WORDS = 8
+
+_METRICS = {
+    # intent: (reading key, label, unit)
+    "temperature": ("temperature", "temperature", "°C"),
+    "humidity": ("humidity", "humidity", "%"),
+    "pm25": ("pm25", "PM2.5", " µg/m³"),
+    "pm10": ("pm10", "PM10", " µg/m³"),
+    "co2": ("co2", "CO2", " ppm"),
+    "vocs": ("vocs", "VOC level", " ppb"),
+    "noise": ("noise", "noise level", " dB"),
+    "light": ("light", "light level", " lux"),
+    "pressure": ("pressure", "air pressure", " hPa"),
+}
+
+# Checked in order; first keyword hit wins for each intent
+_INTENT_KEYWORDS = (
+    ("forecast", {"forecast", "predict", "prediction", "future", "later", "will", "trend", "hours"}),
+    ("recommendations", {"recommend", "recommendations", "advice", "tips", "improve", "suggest", "suggestions", "do"}),
+    ("summary", {"summary", "overview", "status", "everything", "stats", "report", "all"}),
+    ("score", {"score", "health", "healthy", "rating"}),
+    ("aqi", {"aqi", "air", "quality", "pollution", "polluted"}),
+    ("temperature", {"temperature", "temp", "hot", "cold", "warm", "degrees", "heat"}),
+    ("humidity", {"humidity", "humid", "dry", "moisture", "damp"}),
+    ("pm25", {"pm25", "pm2", "particulate", "particles", "fine"}),
+    ("pm10", {"pm10", "dust", "dusty", "coarse"}),
+    ("co2", {"co2", "carbon", "ventilation", "stuffy"}),
+    ("vocs", {"voc", "vocs", "chemicals", "odor", "odour", "smell"}),
+    ("noise", {"noise", "noisy", "loud", "quiet", "decibels", "db", "sound"}),
+    ("light", {"light", "lighting", "bright", "dark", "lux", "dim"}),
+    ("pressure", {"pressure", "barometric", "barometer"}),
+    ("greeting", {"hello", "hi", "hey", "hola", "morning", "evening"}),
+    ("help", {"help", "commands", "capabilities"}),
+)
+
+_FACTUAL_INTENTS = set(_METRICS) | {"aqi", "score", "greeting"}
+
+
+def _tokens(message: str):
+    return re.findall(r"[a-z0-9]+", message.lower().replace("pm2.5", "pm25"))
+
+
+def detect_intents(message: str):
+    words = set(_tokens(message))
+    return [intent for intent, keywords in _INTENT_KEYWORDS if words & keywords]
+
+
+def _fmt(value):
+    if value is None:
+        return "Unknown"
+    if isinstance(value, float):
+        return f"{value:.1f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _aqi(reading: dict):
+    aqi_val = reading.get("aqi")
+    if aqi_val is not None:
+        return aqi_val, get_aqi_category(aqi_val)
+
+    pm25, pm10 = reading.get("pm25"), reading.get("pm10")
+    if pm25 is None or pm10 is None:
+        return None, None
+
+    result = calculate_pm_aqi(pm25, pm10)
+    if not result:
+        return None, None
+    return result["aqi"], result["category"]
+
+
+# ---------------------------
+# INTENT HANDLERS
+# ---------------------------
+
+def _answer_metric(intent, reading, snapshot, intents):
+    key, label, unit = _METRICS[intent]
+    value = reading.get(key)
+    if value is None:
+        return f"This device doesn't report {label}."
+    return f"The current {label} is {_fmt(value)}{unit}."
+
+
+def _answer_aqi(intent, reading, snapshot, intents):
+    aqi_val, category = _aqi(reading)
+    if aqi_val is None:
+        return "The Air Quality Index (AQI) is not available yet."
+    return f"The air quality is {category}. AQI is {_fmt(aqi_val)} and PM2.5 is {_fmt(reading.get('pm25'))} µg/m³."
+
+
+def _answer_score(intent, reading, snapshot, intents):
+    health = calculate_health_score(reading)
+    text = f"Your room health score is {health['score']}/100 ({health['level']})."
+    if health["reasons"]:
+        text += " Main factors: " + ", ".join(health["reasons"][:3]) + "."
+    return text
+
+
+def _answer_forecast(intent, reading, snapshot, intents):
+    forecast = snapshot.get("forecast")
+    if not forecast:
+        return "Not enough data to predict trends yet."
+
+    # "What will the temperature be?" -> only the asked metric
+    metrics = [m for m in intents if m in forecast] or ["temperature", "humidity", "pm25"]
+
+    lines = []
+    for metric in metrics:
+        series = forecast.get(metric)
+        if not series:
+            continue
+        _, label, unit = _METRICS[metric]
+        lines.append(f"{label} is expected to reach {_fmt(series[-1])}{unit} in 5 hours")
+    if not lines:
+        return "Not enough data to predict trends yet."
+    return "Forecast: " + "; ".join(lines) + "."
+
+
+def _answer_recommendations(intent, reading, snapshot, intents):
+    recs = generate_recommendations(reading)
+    return " ".join(f"{r['title']}: {r['action']}" for r in recs[:3])
+
+
+def _answer_summary(intent, reading, snapshot, intents):
+    aqi_val, category = _aqi(reading)
+    health = calculate_health_score(reading)
+    return (
+        f"Temp: {_fmt(reading.get('temperature'))}°C, "
+        f"Humidity: {_fmt(reading.get('humidity'))}%, "
+        f"PM2.5: {_fmt(reading.get('pm25'))} µg/m³, "
+        f"AQI: {_fmt(aqi_val)} ({category or 'Unknown'}), "
+        f"Score: {health['score']}/100."
+    )
+
+
+def _answer_greeting(intent, reading, snapshot, intents):
+    return "Hello! I can read your sensors. Ask me about temperature, humidity, air quality or your health score."
+
+
+def _answer_help(intent, reading, snapshot, intents):
+    return (
+        "You can ask about temperature, humidity, PM2.5, PM10, CO2, VOCs, noise, light, "
+        "pressure, AQI, your health score, the 5-hour forecast or recommendations."
+    )
+
+
+_HANDLERS = {
+    "forecast": _answer_forecast,
+    "recommendations": _answer_recommendations,
+    "summary": _answer_summary,
+    "score": _answer_score,
+    "aqi": _answer_aqi,
+    "greeting": _answer_greeting,
+    "help": _answer_help,
+}
+for _metric in _METRICS:
+    _HANDLERS[_metric] = _answer_metric
+
+
+# ---------------------------
+# PUBLIC API
+# ---------------------------
+
+def answer(message: str, snapshot: dict, offline: bool = True):
+    """
+    Answers from structured state. Always returns a string in offline mode;
+    in fast-path mode (offline=False) returns None unless the question is a
+    short, single-intent factual one.
+    """
+    intents = detect_intents(message)
+
+    if not offline:
+        if len(intents) != 1 or intents[0] not in _FACTUAL_INTENTS:
+            return None
+        words = _tokens(message)
+        if len(words) > FAST_PATH_MAX_WORDS or _COMPLEX_CUES.intersection(words):
+            return None
+
+    reading = snapshot.get("reading")
+    prefix = OFFLINE_PREFIX if offline else ""
+
+    if intents and intents[0] in ("greeting", "help"):
+        return prefix + _HANDLERS[intents[0]](intents[0], reading, snapshot, intents)
+
+    if reading is None:
+        return prefix + "No recent data found for this device." if offline else None
+
+    if not intents:
+        return (
+            "Offline Mode (API Quota)\n\n"
+            "I can't chat normally right now, but here are your stats:\n"
+            + _answer_summary("summary", reading, snapshot, intents)
+        )
+
+    # The forecast answer already covers any metric it was asked about
+    if "forecast" in intents:
+        intents = ["forecast"] + [i for i in intents if i != "forecast"]
+        return prefix + _answer_forecast("forecast", reading, snapshot, intents)
+
+    answers = [_HANDLERS[intent](intent, reading, snapshot, intents) for intent in intents[:2]]
+    return prefix + " ".join(answers)
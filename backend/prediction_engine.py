@@ -28,7 +28,7 @@ def fetch_historical_data(device_id, metric, limit=1000):
 
     query = f"""
         SELECT timestamp, {metric}
-        FROM sensor_readings
+        FROM sensor_readings_all
         WHERE device_id = ?
         ORDER BY timestamp ASC
         LIMIT ?
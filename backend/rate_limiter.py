@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------
+# TOKEN BUCKET
+# ---------------------------
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at
+    `rate` tokens per second. Not thread-safe on its own (see KeyedLimiter).
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now: float, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens if available and returns 0.
+        Otherwise returns the number of seconds until enough tokens exist.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class KeyedLimiter:
+    """
+    One token bucket per key (user, device, ...). Idle buckets are evicted
+    LRU-style once more than `max_keys` are tracked.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self, key) -> float:
+        """Returns 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+
+            wait = bucket.try_acquire(now)
+            if wait:
+                self.rejected += 1
+            return wait
+
+    def refund(self, key):
+        """Gives back a token taken by check() when the request was rejected elsewhere."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+
+# ---------------------------
+# CONCURRENCY CAP
+# ---------------------------
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking cap on in-flight requests. When full, callers are rejected
+    immediately instead of queueing on the worker pool. Shared by threadpool
+    workers: the counters only change under the lock, so `in_flight` is
+    exact (it backs the monacos_chat_in_flight gauge).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.in_flight = 0
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def leave(self):
+        with self._lock:
+            if self.in_flight <= 0:
+                raise ValueError("leave() called without a matching try_enter()")
+            self.in_flight -= 1
+
+
+def retry_after_header(wait_seconds: float) -> str:
+    """Retry-After is whole seconds; always round up so clients don't retry early."""
+    return str(max(1, math.ceil(wait_seconds)))
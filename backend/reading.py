@@ -0,0 +1,191 @@
+import json
+import math
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:  # optional: only makes decoding faster
+    orjson = None
+
+# ---------------------------
+# READING MODEL
+# ---------------------------
+# The one in-memory shape of a sensor reading, from request bytes through
+# the ingest pipeline into DEVICE_STATE / DEVICE_HISTORY. A slotted object
+# is a fraction of the size of the dict it replaces, and it still answers
+# .get() / [] / keys() so the engines, the persistence writer and FastAPI
+# treat it like the dicts loaded back from the database.
+#
+# decode_json() / decode_json_batch() build Readings straight from the
+# request body, with the same coercions SensorPayload (schemas.py) applied.
+
+METRIC_FIELDS = (
+    "temperature", "humidity", "pm25", "pm10", "noise", "light",
+    "altitude", "pressure", "co2", "vocs", "aqi", "air_quality_score", "gas",
+)
+REQUIRED_FIELDS = ("temperature", "humidity", "pm25", "pm10", "noise", "light")
+FIELDS = ("device_id",) + METRIC_FIELDS + ("timestamp",)
+
+_FIELD_SET = frozenset(FIELDS)
+
+
+class ReadingDecodeError(ValueError):
+    pass
+
+
+class Reading:
+    __slots__ = FIELDS
+
+    def __init__(self, device_id, temperature, humidity, pm25, pm10, noise, light,
+                 altitude=None, pressure=None, co2=None, vocs=None, aqi=None,
+                 air_quality_score=None, gas=None, timestamp=None):
+        self.device_id = device_id
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pm25 = pm25
+        self.pm10 = pm10
+        self.noise = noise
+        self.light = light
+        self.altitude = altitude
+        self.pressure = pressure
+        self.co2 = co2
+        self.vocs = vocs
+        self.aqi = aqi
+        self.air_quality_score = air_quality_score
+        self.gas = gas
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, data) -> "Reading":
+        """Unknown keys (e.g. a DB row's id) are ignored; no coercion."""
+        reading = cls.__new__(cls)
+        get = data.get
+        for field in FIELDS:
+            setattr(reading, field, get(field))
+        return reading
+
+    # dict-style access
+    def get(self, key, default=None):
+        # Every field is present (None when not sent), as in payload.dict()
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in _FIELD_SET
+
+    def keys(self):
+        return FIELDS
+
+    def items(self):
+        return [(f, getattr(self, f)) for f in FIELDS]
+
+    def to_dict(self) -> dict:
+        return {f: getattr(self, f) for f in FIELDS}
+
+    def replace(self, **changes) -> "Reading":
+        reading = Reading.from_dict(self)
+        for key, value in changes.items():
+            reading[key] = value
+        return reading
+
+    def __eq__(self, other):
+        if isinstance(other, Reading):
+            return all(getattr(self, f) == getattr(other, f) for f in FIELDS)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Reading({self.to_dict()!r})"
+
+
+# ---------------------------
+# DECODING
+# ---------------------------
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _number(obj, field, required):
+    value = obj.get(field)
+    if value is None:
+        if required:
+            raise ReadingDecodeError(f"{field}: field required")
+        return None
+    if type(value) is float:
+        return value
+    if isinstance(value, (int, str)):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    raise ReadingDecodeError(f"{field}: expected a number, got {value!r}")
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise ReadingDecodeError(f"timestamp: invalid datetime {value!r}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return datetime.fromtimestamp(value, timezone.utc)
+    raise ReadingDecodeError(f"timestamp: invalid datetime {value!r}")
+
+
+def from_object(obj) -> Reading:
+    """One decoded JSON object -> Reading (SensorPayload's coercions)."""
+    if not isinstance(obj, dict):
+        raise ReadingDecodeError("expected a JSON object")
+    device_id = obj.get("device_id")
+    if not isinstance(device_id, str):
+        raise ReadingDecodeError("device_id: field required (string)")
+
+    reading = Reading.__new__(Reading)
+    reading.device_id = device_id
+    for field in METRIC_FIELDS:
+        setattr(reading, field, _number(obj, field, field in REQUIRED_FIELDS))
+    reading.timestamp = _timestamp(obj.get("timestamp"))
+    return reading
+
+
+def _parse(body: bytes):
+    try:
+        return _loads(body)
+    except ValueError as e:  # json.JSONDecodeError and orjson.JSONDecodeError
+        raise ReadingDecodeError(f"invalid JSON: {e}")
+
+
+def decode_json(body: bytes) -> Reading:
+    return from_object(_parse(body))
+
+
+def decode_json_batch(body: bytes, errors: list = None) -> list:
+    """
+    With `errors`, malformed items are skipped and their messages appended
+    to it, so one bad reading doesn't fail the whole batch. A body that
+    isn't a JSON array always raises.
+    """
+    items = _parse(body)
+    if not isinstance(items, list):
+        raise ReadingDecodeError("expected a JSON array of readings")
+    readings = []
+    for i, obj in enumerate(items):
+        try:
+            readings.append(from_object(obj))
+        except ReadingDecodeError as e:
+            if errors is None:
+                raise ReadingDecodeError(f"[{i}] {e}")
+            errors.append(f"[{i}] {e}")
+    return readings
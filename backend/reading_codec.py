@@ -0,0 +1,142 @@
+import math
+import struct
+from datetime import datetime, timezone
+
+from reading import METRIC_FIELDS, Reading
+
+# ---------------------------
+# BINARY READING FORMAT (v1)
+# ---------------------------
+# Fixed 80-byte little-endian record, small enough for one BLE notification
+# at a 185-byte MTU (the same reading as JSON is ~300 bytes):
+#
+#   offset  type      field
+#   0       u8        version (= 1)
+#   1       u8        reserved
+#   2       u16       presence bitmask for the 13 float fields below
+#   4       char[16]  device_id (ASCII, NUL padded)
+#   20      u32       timestamp, unix seconds (0 = no device clock; the gateway
+#                     stamps the receive time, see stamp_record)
+#   24      u16       timestamp milliseconds
+#   26      u16       reserved
+#   28      f32 x 13  FIELDS, in order (absent fields are NaN, bit cleared)
+#
+# Records can be concatenated back to back (batch uploads). JSON stays
+# supported everywhere as the fallback format.
+
+VERSION = 1
+CONTENT_TYPE = "application/vnd.monacos.reading"
+
+FIELDS = METRIC_FIELDS   # same order as Reading's positional arguments
+REQUIRED_FIELDS = ("temperature", "humidity", "pm25", "pm10", "noise", "light")
+
+_HEADER = struct.Struct("<BBH16sIHH")
+_STAMP = struct.Struct("<IH")   # timestamp seconds + milliseconds, at offset 20
+_STAMP_OFFSET = 20
+_VALUES = struct.Struct("<" + "f" * len(FIELDS))
+RECORD = struct.Struct("<BBH16sIHH" + "f" * len(FIELDS))
+RECORD_SIZE = RECORD.size
+
+_REQUIRED_MASK = sum(1 << FIELDS.index(f) for f in REQUIRED_FIELDS)
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def is_binary(data) -> bool:
+    """JSON packets start with '{'; binary records start with the version byte."""
+    return len(data) > 0 and data[0] == VERSION
+
+
+def encode_reading(reading: dict) -> bytes:
+    mask = 0
+    values = []
+    for i, field in enumerate(FIELDS):
+        value = reading.get(field)
+        if value is None:
+            values.append(math.nan)
+        else:
+            mask |= 1 << i
+            values.append(float(value))
+
+    ts = reading.get("timestamp")
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts is None:
+        seconds, millis = 0, 0
+    else:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        epoch = ts.timestamp()
+        seconds = int(epoch)
+        millis = int(round((epoch - seconds) * 1000)) % 1000
+
+    device_id = reading["device_id"].encode("ascii")
+    if len(device_id) > 16:
+        raise ValueError(f"device_id longer than 16 bytes: {reading['device_id']}")
+
+    return RECORD.pack(VERSION, 0, mask, device_id, seconds, millis, 0, *values)
+
+
+def stamp_record(record: bytes, when: float) -> bytes:
+    """
+    Fills in the timestamp (unix seconds `when`) of a record sent without
+    one. Records that already carry a timestamp are returned unchanged.
+    """
+    if _STAMP.unpack_from(record, _STAMP_OFFSET)[0]:
+        return record
+    stamped = bytearray(record)
+    seconds = int(when)
+    _STAMP.pack_into(stamped, _STAMP_OFFSET, seconds, int((when - seconds) * 1000))
+    return bytes(stamped)
+
+
+def decode_reading(buf, offset: int = 0) -> Reading:
+    """
+    Decodes one record straight out of `buf` (bytes, bytearray, memoryview)
+    without slicing or copying it first.
+    """
+    if len(buf) - offset < RECORD_SIZE:
+        raise DecodeError(f"record truncated: {len(buf) - offset} < {RECORD_SIZE} bytes")
+
+    version, _, mask, raw_id, seconds, millis, _ = _HEADER.unpack_from(buf, offset)
+    if version != VERSION:
+        raise DecodeError(f"unsupported reading version {version}")
+    if mask & _REQUIRED_MASK != _REQUIRED_MASK:
+        raise DecodeError("record is missing required fields")
+
+    try:
+        device_id = raw_id.rstrip(b"\0").decode("ascii")
+    except UnicodeDecodeError:
+        raise DecodeError(f"record device_id is not ASCII: {bytes(raw_id)!r}")
+    if not device_id:
+        raise DecodeError("record has an empty device_id")
+
+    values = _VALUES.unpack_from(buf, offset + _HEADER.size)
+
+    # f32 -> 2 decimals so 24.3 doesn't come back as 24.299999237
+    metrics = [round(v, 2) if mask >> i & 1 else None for i, v in enumerate(values)]
+
+    timestamp = None
+    if seconds:
+        timestamp = datetime.fromtimestamp(seconds + millis / 1000, timezone.utc).replace(tzinfo=None)
+    return Reading(device_id, *metrics, timestamp=timestamp)
+
+
+def iter_readings(buf, errors: list = None):
+    """
+    Decodes a batch of back-to-back records. With `errors`, malformed
+    records are skipped and their messages appended to it; a batch that
+    isn't a whole number of records always raises.
+    """
+    view = memoryview(buf)
+    if len(view) % RECORD_SIZE:
+        raise DecodeError(f"batch length {len(view)} is not a multiple of {RECORD_SIZE}")
+    for offset in range(0, len(view), RECORD_SIZE):
+        try:
+            yield decode_reading(view, offset)
+        except DecodeError as e:
+            if errors is None:
+                raise
+            errors.append(f"[{offset // RECORD_SIZE}] {e}")
@@ -1,105 +1,92 @@
-def generate_recommendations(data: dict):
-    recs = []
+from functools import lru_cache
+
+from bands import above, band_vector, below, default_vector, with_defaults
+
+# ---------------------------
+# RECOMMENDATIONS
+# ---------------------------
+# The output depends only on the band vector (bands.py), so each distinct
+# vector is computed once and the same tuple of read-only dicts is returned
+# to every caller. Don't mutate the result; copy it first.
+
+
+class _FrozenDict(dict):
+    """A dict (so it serializes like one) that refuses modification."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("recommendations are shared; copy before modifying")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __hash__(self):
+        return hash(tuple(self.items()))
+
+
+def _rec(title, action, priority, icon):
+    return _FrozenDict(title=title, action=action, priority=priority, icon=icon)
+
+
+IMPROVE_AIR = _rec("Improve Air Quality", "Run an air purifier on high or ventilate if outdoor air is clean.", "high", "wind")
+MONITOR_AIR = _rec("Monitor Air Quality", "Air quality is moderate. Keep windows closed if traffic is heavy.", "medium", "wind")
+REDUCE_NOISE = _rec("Reduce Noise", "Noise levels are hazardous. Wear protection or isolate source.", "high", "volume-x")
+QUIET_DOWN = _rec("Quiet Down Environment", "Background noise is intrusive. Consider soundproofing.", "medium", "volume-1")
+COOL_DOWN = _rec("Cool Down Room", "Temperature is above comfort zone. Use fans or AC.", "medium", "thermometer")
+INCREASE_HEATING = _rec("Increase Heating", "Room is too cold. Check heating system.", "medium", "thermometer")
+DEHUMIDIFY = _rec("Dehumidify", "High humidity detected. Ventilate or use a dehumidifier to prevent mold.", "medium", "droplet")
+HUMIDIFY = _rec("Humidify Air", "Air is too dry. Use a humidifier or add plants.", "low", "droplet")
+IMPROVE_LIGHTING = _rec("Improve Lighting", "Light levels are low. Open blinds or turn on lights if working.", "low", "sun")
+OPTIMAL = _rec("Optimal Conditions", "Environment is comfortable and healthy.", "low", "check")
 
-    pm25 = data.get("pm25", 0)
-    pm10 = data.get("pm10", 0)
-    noise = data.get("noise", 0)
-    temperature = data.get("temperature", 0)
-    humidity = data.get("humidity", 0)
-    light = data.get("light", 0)
+# Missing metrics count as 0
+_DEFAULT_BANDS = default_vector({
+    "pm25": 0, "pm10": 0, "noise": 0, "temperature": 0, "humidity": 0, "light": 0,
+})
+
+
+@lru_cache(maxsize=4096)
+def recommendations_for_bands(bands: tuple) -> tuple:
+    """`bands`: a reading's band_vector, MISSING entries allowed."""
+    bands = with_defaults(bands, _DEFAULT_BANDS)
+    recs = []
 
-    # -------------------------------
     # Air Quality (PM-based)
-    # -------------------------------
-    if pm25 > 35 or pm10 > 75:
-        recs.append({
-            "title": "Improve Air Quality",
-            "action": "Run an air purifier on high or ventilate if outdoor air is clean.",
-            "priority": "high",
-            "icon": "wind"
-        })
-    elif pm25 > 15:
-        recs.append({
-            "title": "Monitor Air Quality",
-            "action": "Air quality is moderate. Keep windows closed if traffic is heavy.",
-            "priority": "medium",
-            "icon": "wind"
-        })
-
-    # -------------------------------
+    if above(bands, "pm25", 35) or above(bands, "pm10", 75):
+        recs.append(IMPROVE_AIR)
+    elif above(bands, "pm25", 15):
+        recs.append(MONITOR_AIR)
+
     # Noise
-    # -------------------------------
-    if noise > 80:
-        recs.append({
-            "title": "Reduce Noise",
-            "action": "Noise levels are hazardous. Wear protection or isolate source.",
-            "priority": "high",
-            "icon": "volume-x"
-        })
-    elif noise > 70:
-        recs.append({
-            "title": "Quiet Down Environment",
-            "action": "Background noise is intrusive. Consider soundproofing.",
-            "priority": "medium",
-            "icon": "volume-1"
-        })
-
-    # -------------------------------
+    if above(bands, "noise", 80):
+        recs.append(REDUCE_NOISE)
+    elif above(bands, "noise", 70):
+        recs.append(QUIET_DOWN)
+
     # Temperature
-    # -------------------------------
-    if temperature > 28:
-        recs.append({
-            "title": "Cool Down Room",
-            "action": "Temperature is above comfort zone. Use fans or AC.",
-            "priority": "medium",
-            "icon": "thermometer"
-        })
-    elif temperature < 18:
-        recs.append({
-            "title": "Increase Heating",
-            "action": "Room is too cold. Check heating system.",
-            "priority": "medium",
-            "icon": "thermometer"
-        })
-
-    # -------------------------------
+    if above(bands, "temperature", 28):
+        recs.append(COOL_DOWN)
+    elif below(bands, "temperature", 18):
+        recs.append(INCREASE_HEATING)
+
     # Humidity (40-60 is ideal)
-    # -------------------------------
-    if humidity > 65:
-        recs.append({
-            "title": "Dehumidify",
-            "action": "High humidity detected. Ventilate or use a dehumidifier to prevent mold.",
-            "priority": "medium",
-            "icon": "droplet"
-        })
-    elif humidity < 30:
-        recs.append({
-            "title": "Humidify Air",
-            "action": "Air is too dry. Use a humidifier or add plants.",
-            "priority": "low",
-            "icon": "droplet"
-        })
-
-    # -------------------------------
+    if above(bands, "humidity", 65):
+        recs.append(DEHUMIDIFY)
+    elif below(bands, "humidity", 30):
+        recs.append(HUMIDIFY)
+
     # Lighting
-    # -------------------------------
-    if light < 50:
-        recs.append({
-            "title": "Improve Lighting",
-            "action": "Light levels are low. Open blinds or turn on lights if working.",
-            "priority": "low",
-            "icon": "sun"
-        })
-
-    # -------------------------------
+    if below(bands, "light", 50):
+        recs.append(IMPROVE_LIGHTING)
+
     # Fallback
-    # -------------------------------
     if not recs:
-        recs.append({
-            "title": "Optimal Conditions",
-            "action": "Environment is comfortable and healthy.",
-            "priority": "low",
-            "icon": "check"
-        })
-
-    return recs
+        recs.append(OPTIMAL)
+
+    return tuple(recs)
+
+
+def generate_recommendations(data: dict, bands: tuple = None):
+    """`bands`: the reading's band_vector, when the caller already has it."""
+    if bands is None:
+        bands = band_vector(data)
+    return recommendations_for_bands(bands)
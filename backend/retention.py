@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import LEGACY_TABLE, drop_partition, get_db, partition_bounds, tables_for_range
+from log_config import get_logger
+
+# ---------------------------
+# RETENTION
+# ---------------------------
+# Background job that keeps sensor storage bounded. Raw readings older than
+# the retention period are first folded into hourly sensor_rollups (merged
+# with any existing bucket), then removed:
+#
+#   - monthly partitions entirely past the cutoff are folded in id-range
+#     batches (progress kept in retention_progress) and then dropped whole
+#   - the partition straddling the cutoff, and the legacy sensor_readings
+#     table, are folded and deleted RETENTION_BATCH rows at a time
+#   - expired cold_chunks (already folded when compacted) are deleted
+#
+# Every batch is its own short transaction with a pause in between so the
+# ingest writer is never locked out for long. Freed pages are then returned
+# to the OS with PRAGMA incremental_vacuum.
+
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))   # seconds between runs
+RETENTION_BATCH = 2000                 # rows per transaction
+RETENTION_BATCH_PAUSE = 0.05           # seconds between batches
+VACUUM_PAGES_PER_STEP = 1000           # pages freed per incremental_vacuum call
+
+# Existing databases created before auto_vacuum=INCREMENTAL need one full
+# VACUUM to switch modes; that locks the DB, so it only runs when asked.
+RETENTION_CONVERT_VACUUM = os.getenv("RETENTION_CONVERT_VACUUM", "0") == "1"
+
+AVG_COLUMNS = ("temperature", "humidity", "pm25", "pm10", "noise", "light", "co2", "vocs", "pressure")
+MAX_COLUMNS = ("pm25", "pm10", "noise")
+
+log = get_logger("retention")
+
+
+_FOLD_SQL = {}
+
+
+def fold_sql(table: str, where: str) -> str:
+    """INSERT ... SELECT that folds the rows of `table` matching `where` into sensor_rollups."""
+    key = (table, where)
+    sql = _FOLD_SQL.get(key)
+    if sql is not None:
+        return sql
+
+    avgs = ", ".join(f"AVG({c})" for c in AVG_COLUMNS)
+    maxes = ", ".join(f"MAX({c})" for c in MAX_COLUMNS)
+    # Weighted merge with an existing bucket (late rows for an hour already rolled up)
+    merge_avgs = ", ".join(
+        f"{c} = COALESCE(({c} * count + excluded.{c} * excluded.count) / (count + excluded.count), {c}, excluded.{c})"
+        for c in AVG_COLUMNS
+    )
+    merge_maxes = ", ".join(
+        f"{c}_max = COALESCE(MAX({c}_max, excluded.{c}_max), {c}_max, excluded.{c}_max)" for c in MAX_COLUMNS
+    )
+    sql = _FOLD_SQL[key] = f"""
+        INSERT INTO sensor_rollups (
+            device_id, bucket, count, {", ".join(AVG_COLUMNS)}, {", ".join(c + "_max" for c in MAX_COLUMNS)}
+        )
+        SELECT device_id, strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), {avgs}, {maxes}
+        FROM {table}
+        WHERE {where}
+        GROUP BY device_id, strftime('%Y-%m-%d %H:00:00', timestamp)
+        ON CONFLICT (device_id, bucket) DO UPDATE SET
+            {merge_avgs}, {merge_maxes}, count = count + excluded.count
+    """
+    return sql
+
+
+class RetentionManager:
+    def __init__(self, retention_days=RETENTION_DAYS, interval=RETENTION_INTERVAL,
+                 batch_size=RETENTION_BATCH, batch_pause=RETENTION_BATCH_PAUSE):
+        self.retention = timedelta(days=retention_days)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.stats = {"runs": 0, "rows_aged_out": 0, "partitions_dropped": 0, "pages_vacuumed": 0, "last_run": None}
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------------------------
+    # ONE PASS
+    # ---------------------------
+
+    def run_once(self, now: datetime = None) -> dict:
+        cutoff = (now or datetime.utcnow()) - self.retention
+        conn = get_db()
+        try:
+            deleted = dropped = 0
+            for table in tables_for_range(conn, None, cutoff):
+                if self._stop.is_set():
+                    break
+                if table != LEGACY_TABLE and partition_bounds(table)[1] <= cutoff:
+                    folded, folded_to = self._fold_partition(conn, table)
+                    deleted += folded
+                    # Interrupted fold, or rows arrived meanwhile: keep the
+                    # table, the next pass resumes from retention_progress
+                    if folded_to is None or not drop_partition(table, max_id=folded_to):
+                        continue
+                    conn.execute("DELETE FROM retention_progress WHERE table_name = ?", (table,))
+                    conn.commit()
+                    dropped += 1
+                else:
+                    deleted += self._fold_and_delete(conn, table, cutoff)
+
+            deleted += self._delete_cold_chunks(conn, cutoff)
+
+            pages = self._incremental_vacuum(conn) if deleted else 0
+        finally:
+            conn.close()
+
+        self.stats["runs"] += 1
+        self.stats["rows_aged_out"] += deleted
+        self.stats["partitions_dropped"] += dropped
+        self.stats["pages_vacuumed"] += pages
+        self.stats["last_run"] = datetime.utcnow().isoformat()
+        if deleted:
+            log.info("retention pass", extra={"fields": {
+                "deleted": deleted, "partitions_dropped": dropped, "pages_vacuumed": pages,
+            }})
+        return {"deleted": deleted, "partitions_dropped": dropped, "pages_vacuumed": pages}
+
+    def _fold_partition(self, conn, table):
+        """
+        Folds a fully expired partition into rollups, resumable via
+        retention_progress. Returns (rows folded, id folded up to), the id
+        being None when stopped before reaching MAX(id).
+        """
+        row = conn.execute("SELECT folded_to_id FROM retention_progress WHERE table_name = ?", (table,)).fetchone()
+        done = row[0] if row else 0
+        max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+
+        folded = 0
+        while done < max_id and not self._stop.is_set():
+            upper = min(done + self.batch_size, max_id)
+            folded += conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id > ? AND id <= ?", (done, upper)).fetchone()[0]
+            try:
+                conn.execute(fold_sql(table, "id > ? AND id <= ?"), (done, upper))
+                conn.execute(
+                    "INSERT OR REPLACE INTO retention_progress (table_name, folded_to_id) VALUES (?, ?)",
+                    (table, upper),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            done = upper
+            time.sleep(self.batch_pause)
+        return folded, (done if done >= max_id else None)
+
+    def _fold_and_delete(self, conn, table, cutoff) -> int:
+        deleted = 0
+        while not self._stop.is_set():
+            n = self._fold_and_delete_batch(conn, table, cutoff)
+            deleted += n
+            if n < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def _fold_and_delete_batch(self, conn, table, cutoff) -> int:
+        # Rowid order: the oldest rows have the lowest ids, so LIMIT stops early
+        ids = [r[0] for r in conn.execute(
+            f"SELECT id FROM {table} WHERE timestamp < ? ORDER BY id LIMIT ?",
+            (cutoff, self.batch_size),
+        ).fetchall()]
+        if not ids:
+            return 0
+
+        id_list = "[" + ",".join(map(str, ids)) + "]"
+        try:
+            conn.execute(fold_sql(table, "id IN (SELECT value FROM json_each(?))"), (id_list,))
+            conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (id_list,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(ids)
+
+    def _delete_cold_chunks(self, conn, cutoff) -> int:
+        """Returns the number of readings the deleted chunks held."""
+        deleted = 0
+        while not self._stop.is_set():
+            chunks = conn.execute(
+                "SELECT rowid, count FROM cold_chunks WHERE end_ts <= ? LIMIT ?", (cutoff, self.batch_size)
+            ).fetchall()
+            if not chunks:
+                break
+            conn.execute(
+                "DELETE FROM cold_chunks WHERE rowid IN (SELECT value FROM json_each(?))",
+                ("[" + ",".join(str(c[0]) for c in chunks) + "]",),
+            )
+            conn.commit()
+            deleted += sum(c[1] for c in chunks)
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def _incremental_vacuum(self, conn) -> int:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:  # 2 = INCREMENTAL
+            if not RETENTION_CONVERT_VACUUM:
+                return 0
+            log.warning("switching database to auto_vacuum=INCREMENTAL (full VACUUM)")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+        freed = 0
+        while not self._stop.is_set():
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            # executescript steps the pragma to completion; execute() frees one page
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})")
+            step = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if step <= 0:
+                break
+            freed += step
+            time.sleep(self.batch_pause)
+        return freed
+
+    # ---------------------------
+    # BACKGROUND LOOP
+    # ---------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("retention pass failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+RETENTION = RetentionManager()
@@ -1,170 +1,100 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime, timedelta
-from schemas import SensorData
-from db import get_db, ensure_device_exists
+import logging
+from typing import List
 
-router = APIRouter(prefix="/api", tags=["Monacos"])
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
 
-# In-memory cache for latest device data
-LATEST_DATA = {}
-
-# -------------------------------------------------
-# GET latest data (frontend dashboard)
-# -------------------------------------------------
-@router.get("/latest/{device_id}")
-def get_latest(device_id: str):
-    if device_id not in LATEST_DATA:
-        raise HTTPException(status_code=404, detail="No data for device")
-    return LATEST_DATA[device_id]
+import reading_codec
+from ingest_pipeline import PIPELINE, ReadingRejected
+from log_config import get_logger, log_sampled
+from reading import ReadingDecodeError, decode_json, decode_json_batch
+from schemas import SensorPayload
 
+# Every ingest entry point goes through ingest_pipeline.PIPELINE
+# (validate -> order -> state -> derived -> alerts -> persist).
+#
+# JSON bodies are decoded straight into reading.Reading objects; no
+# Pydantic model or intermediate dict per reading. SensorPayload only
+# documents the body in the OpenAPI schema.
 
-# -------------------------------------------------
-# HEALTH SCORE
-# -------------------------------------------------
-@router.get("/health-score/{device_id}")
-def get_health_score(device_id: str):
-    if device_id not in LATEST_DATA:
-        raise HTTPException(status_code=404, detail="No data for device")
 
-    data = LATEST_DATA[device_id]
+def _json_body(schema) -> dict:
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
 
-    score = 100
-    reasons = []
 
-    if data["pm25"] > 35:
-        score -= 20
-        reasons.append("High PM2.5 concentration")
+_SINGLE_BODY = _json_body(SensorPayload.model_json_schema())
+_BATCH_BODY = _json_body(TypeAdapter(List[SensorPayload]).json_schema())
 
-    if data["pm10"] > 50:
-        score -= 20
-        reasons.append("Elevated PM10 levels")
+router = APIRouter(tags=["Monacos"])
 
-    if data["noise"] > 70:
-        score -= 20
-        reasons.append("Noise exposure exceeds comfort limits")
+log = get_logger("ingest")
 
-    if data["humidity"] > 65:
-        score -= 10
-        reasons.append("High humidity may increase mold risk")
 
-    score = max(score, 0)
-
-    level = (
-        "Good" if score >= 80 else
-        "Moderate" if score >= 60 else
-        "Poor" if score >= 40 else
-        "Hazardous"
-    )
-
-    return {
-        "score": score,
-        "level": level,
-        "reasons": reasons
-    }
+def _process_batch(readings, invalid: list, route: str) -> dict:
+    """
+    Like PIPELINE.process_many, with items that failed to decode counted as
+    rejected too: one malformed reading must not fail (and, on the gateway,
+    re-spool) the rest of its batch.
+    """
+    result = PIPELINE.process_many(readings)
+    if invalid:
+        result["rejected"] += len(invalid)
+        log_sampled(log, route, logging.WARNING, "readings rejected", count=len(invalid), reason=invalid[0])
+    return result
 
 
 # -------------------------------------------------
-# ALERTS
+# INGEST SENSOR DATA (ESP32 / gateway → Backend)
 # -------------------------------------------------
-@router.get("/alerts/{device_id}")
-def get_alerts(device_id: str):
-    if device_id not in LATEST_DATA:
-        return []
-
-    data = LATEST_DATA[device_id]
-    alerts = []
-
-    def add_alert(parameter, message, severity):
-        alerts.append({
-            "id": f"{parameter}-{datetime.utcnow().timestamp()}",
-            "parameter": parameter,
-            "message": message,
-            "severity": severity,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+def _ingest_one(body: bytes):
+    try:
+        ctx = PIPELINE.process(decode_json(body))
+    except (ReadingDecodeError, ReadingRejected) as e:
+        raise HTTPException(422, str(e))
 
-    if data["pm25"] > 35:
-        add_alert("PM2.5", "PM2.5 levels are unhealthy", "warning")
-
-    if data["pm10"] > 50:
-        add_alert("PM10", "PM10 levels are elevated", "warning")
+    # Duplicates still get a 200 so the gateway stops retransmitting
+    return {
+        "status": ctx.status,
+        "device_id": ctx.device_id,
+        "timestamp": ctx.reading["timestamp"],
+    }
 
-    if data["noise"] > 80:
-        add_alert("Noise", "Noise levels are hazardous", "critical")
 
-    return alerts
+@router.post("/api/ingest", openapi_extra=_SINGLE_BODY)
+async def ingest(request: Request):
+    return await run_in_threadpool(_ingest_one, await request.body())
 
 
-# -------------------------------------------------
-# HISTORICAL DATA
-# -------------------------------------------------
-@router.get("/history/{device_id}")
-def get_history(device_id: str):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get data from last 7 days
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
-    cursor.execute("""
-        SELECT * FROM sensor_readings
-        WHERE device_id = ? AND timestamp >= ?
-        ORDER BY timestamp ASC
-    """, (device_id, seven_days_ago))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    return [dict(row) for row in rows]
+@router.post("/data", openapi_extra=_SINGLE_BODY)
+async def ingest_arduino(request: Request):
+    # Compatibility route for Arduino which uses /data
+    return await ingest(request)
 
 
-# -------------------------------------------------
-# INGEST SENSOR DATA (ESP32 → Backend)
-# -------------------------------------------------
-@router.post("/ingest")
-def ingest_data(data: SensorData):
-    device_id = data.device_id
-    ensure_device_exists(device_id)
+@router.post("/api/ingest/batch", openapi_extra=_BATCH_BODY)
+async def ingest_batch(request: Request):
+    # Bulk endpoint used by the BLE gateway
+    invalid = []
+    try:
+        readings = decode_json_batch(await request.body(), invalid)
+    except ReadingDecodeError as e:
+        raise HTTPException(422, str(e))
+    return await run_in_threadpool(_process_batch, readings, invalid, "/api/ingest/batch")
 
-    timestamp = datetime.utcnow()
 
-    # ✅ Update in-memory cache (frontend uses this)
-    LATEST_DATA[device_id] = {
-        **data.dict(exclude={"timestamp"}),
-        "timestamp": timestamp.isoformat()
-    }
+@router.post("/api/ingest/binary")
+async def ingest_binary(request: Request):
+    # Fast path for gateways relaying the fixed-layout binary format
+    # (see reading_codec.py): no JSON parsing and no Pydantic model per reading.
+    if request.headers.get("content-type", "").split(";")[0].strip() != reading_codec.CONTENT_TYPE:
+        raise HTTPException(415, f"Expected Content-Type {reading_codec.CONTENT_TYPE}")
 
-    # ✅ Persist to SQLite
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO sensor_readings (
-            device_id,
-            temperature,
-            humidity,
-            pm25,
-            pm10,
-            noise,
-            light,
-            timestamp
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        device_id,
-        data.temperature,
-        data.humidity,
-        data.pm25,
-        data.pm10,
-        data.noise,
-        data.light,
-        timestamp
-    ))
-
-    conn.commit()
-    conn.close()
+    body = await request.body()
+    invalid = []
+    try:
+        readings = list(reading_codec.iter_readings(body, invalid))
+    except reading_codec.DecodeError as e:
+        raise HTTPException(400, f"Invalid binary reading: {e}")
 
-    return {
-        "status": "ok",
-        "device_id": device_id,
-        "timestamp": timestamp
-    }
+    return await run_in_threadpool(_process_batch, readings, invalid, "/api/ingest/binary")
@@ -2,18 +2,31 @@ from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 
-class SensorData(BaseModel):
+class SensorPayload(BaseModel):
     device_id: str
-    location: Optional[str] = None
-    timestamp: Optional[datetime] = None
 
     temperature: float
     humidity: float
+
     pm25: float
     pm10: float
+
     noise: float
     light: float
 
+    timestamp: Optional[datetime] = None
+
+    # New Standard Fields
+    altitude: Optional[float] = None
+    pressure: Optional[float] = None
+    co2: Optional[float] = None
+    vocs: Optional[float] = None
+    aqi: Optional[float] = None
+    air_quality_score: Optional[float] = None
+
+    # Arduino specific/Optional (Legacy or specific)
+    gas: Optional[float] = None
+
 class UserCreate(BaseModel):
     username: str
     password: str
@@ -1,9 +1,43 @@
-from typing import Dict, List
+import threading
+from typing import List, MutableMapping
+
+from state_backend import create_backend
 
 # ---------------------------
-# IN-MEMORY STORAGE
+# LIVE STORAGE
 # ---------------------------
+# Plain dicts with the default memory backend. With STATE_BACKEND set to
+# sqlite:// or redis:// these are shared mappings, so every uvicorn worker
+# sees the same devices. Lists must be replaced by assignment (or grown with
+# append_history), never mutated in place, or the change stays in this process.
+
+BACKEND = create_backend()
+
+DEVICE_STATE: MutableMapping[str, dict] = BACKEND.mapping("state")
+DEVICE_HISTORY: MutableMapping[str, List[dict]] = BACKEND.mapping("history", "list")
+DEVICE_ALERTS: MutableMapping[str, List[dict]] = BACKEND.mapping("alerts", "list")
+
+# Health score / AQI computed at ingest by the pipeline's derived stage
+DEVICE_DERIVED: MutableMapping[str, dict] = BACKEND.mapping("derived")
+
+# Bumped when a device's derived results change; keys caches that depend on live context
+DEVICE_VERSION: MutableMapping[str, int] = BACKEND.mapping("version")
+
+
+def append_history(device_id: str, reading: dict, maxlen: int):
+    BACKEND.push("history", device_id, reading, maxlen)
+
+
+def bump_version(device_id: str) -> int:
+    return BACKEND.incr("version", device_id)
+
+
+# Striped per-device locks, held while a device's DEVICE_STATE entry and
+# history window are written together (ingest state stage, warm start), so
+# a check-then-set on one device can't interleave with a live reading.
+# Per process, like the memory backend.
+_DEVICE_LOCKS = tuple(threading.Lock() for _ in range(64))
+
 
-DEVICE_STATE: Dict[str, dict] = {}
-DEVICE_HISTORY: Dict[str, List[dict]] = {}
-DEVICE_ALERTS: Dict[str, List[dict]] = {}
+def device_lock(device_id: str) -> threading.Lock:
+    return _DEVICE_LOCKS[hash(device_id) % len(_DEVICE_LOCKS)]
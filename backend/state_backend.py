@@ -0,0 +1,336 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from reading import Reading
+
+# ---------------------------
+# SHARED LIVE-STATE BACKENDS
+# ---------------------------
+# shared_state asks a backend for one mapping per namespace ("state",
+# "history", "alerts", "version") plus two atomic operations:
+#
+#   backend.mapping(ns, kind)              -> MutableMapping (kind "value" or "list")
+#   backend.push(ns, key, item, maxlen)    append to a list value, keep last maxlen
+#   backend.incr(ns, key)                  -> new integer value
+#
+# MemoryBackend hands out plain dicts (single worker, zero overhead).
+# SQLiteBackend shares state between uvicorn workers on one host.
+# RedisBackend shares it across hosts; it speaks the Redis protocol through
+# redis-py (imported lazily) or any client object with the same methods,
+# e.g. fakeredis for local testing.
+#
+# Selected with STATE_BACKEND:
+#   memory (default) | sqlite:///path/to/state.db | redis://host:6379/0
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+
+
+# ---------------------------
+# SERIALIZATION
+# ---------------------------
+# Readings carry datetime timestamps that list_devices does arithmetic on,
+# so they are tagged on the way out and restored on the way back in.
+
+def _default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, Reading):
+        return value.to_dict()  # comes back as a plain dict
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _object_hook(obj):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=_default, separators=(",", ":"))
+
+
+def loads(raw):
+    return json.loads(raw, object_hook=_object_hook)
+
+
+# ---------------------------
+# IN-PROCESS
+# ---------------------------
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self):
+        self._maps = {}
+
+    def mapping(self, ns, kind="value"):
+        return self._maps.setdefault(ns, {})
+
+    def push(self, ns, key, item, maxlen):
+        items = self._maps.setdefault(ns, {}).get(key)
+        if items is None:
+            items = []
+        items.append(item)
+        self._maps[ns][key] = items[-maxlen:]
+
+    def incr(self, ns, key):
+        values = self._maps.setdefault(ns, {})
+        values[key] = values.get(key, 0) + 1
+        return values[key]
+
+    def close(self):
+        pass
+
+
+# ---------------------------
+# SQLITE (single host, many workers)
+# ---------------------------
+
+class SQLiteBackend:
+    """
+    One key/value table in a WAL-mode SQLite file shared by every worker.
+    Each thread keeps its own connection; list pushes run in an IMMEDIATE
+    transaction so concurrent workers never lose an append.
+    """
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS live_state (
+            ns TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (ns, key)
+        ) WITHOUT ROWID
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def mapping(self, ns, kind="value"):
+        return _SQLiteMapping(self, ns)
+
+    def get(self, ns, key):
+        row = self._conn().execute(
+            "SELECT value FROM live_state WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return loads(row[0])
+
+    def set(self, ns, key, value):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO live_state (ns, key, value) VALUES (?, ?, ?)", (ns, key, dumps(value))
+        )
+
+    def push(self, ns, key, item, maxlen):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM live_state WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+            items = loads(row[0]) if row else []
+            items.append(item)
+            conn.execute(
+                "INSERT OR REPLACE INTO live_state (ns, key, value) VALUES (?, ?, ?)",
+                (ns, key, dumps(items[-maxlen:])),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def incr(self, ns, key):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM live_state WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+            value = (loads(row[0]) if row else 0) + 1
+            conn.execute("INSERT OR REPLACE INTO live_state (ns, key, value) VALUES (?, ?, ?)", (ns, key, str(value)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _SQLiteMapping(MutableMapping):
+    def __init__(self, backend, ns):
+        self.backend = backend
+        self.ns = ns
+
+    def __getitem__(self, key):
+        return self.backend.get(self.ns, key)
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.ns, key, value)
+
+    def __delitem__(self, key):
+        cur = self.backend._conn().execute("DELETE FROM live_state WHERE ns = ? AND key = ?", (self.ns, key))
+        if cur.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.backend._conn().execute(
+            "SELECT 1 FROM live_state WHERE ns = ? AND key = ?", (self.ns, key)
+        ).fetchone() is not None
+
+    def __iter__(self):
+        rows = self.backend._conn().execute("SELECT key FROM live_state WHERE ns = ?", (self.ns,)).fetchall()
+        return iter([r[0] for r in rows])
+
+    def __len__(self):
+        return self.backend._conn().execute("SELECT COUNT(*) FROM live_state WHERE ns = ?", (self.ns,)).fetchone()[0]
+
+
+# ---------------------------
+# REDIS PROTOCOL (multi host)
+# ---------------------------
+
+class RedisBackend:
+    """
+    "value" namespaces are one Redis hash each ({prefix}:{ns}); "list"
+    namespaces are one Redis list per key ({prefix}:{ns}:{key}) indexed by a
+    set, so push is RPUSH + LTRIM in a single MULTI/EXEC round trip.
+    """
+    name = "redis"
+
+    def __init__(self, url=None, client=None, prefix="monacos"):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _hash(self, ns):
+        return f"{self.prefix}:{ns}"
+
+    def _list(self, ns, key):
+        return f"{self.prefix}:{ns}:{key}"
+
+    def _index(self, ns):
+        return f"{self.prefix}:{ns}:_keys"
+
+    def mapping(self, ns, kind="value"):
+        if kind == "list":
+            return _RedisListMapping(self, ns)
+        return _RedisHashMapping(self, ns)
+
+    def push(self, ns, key, item, maxlen):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(self._list(ns, key), dumps(item))
+        pipe.ltrim(self._list(ns, key), -maxlen, -1)
+        pipe.sadd(self._index(ns), key)
+        pipe.execute()
+
+    def incr(self, ns, key):
+        return int(self.client.hincrby(self._hash(ns), key, 1))
+
+    def close(self):
+        close = getattr(self.client, "close", None)
+        if close:
+            close()
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class _RedisHashMapping(MutableMapping):
+    def __init__(self, backend, ns):
+        self.client = backend.client
+        self.name = backend._hash(ns)
+
+    def __getitem__(self, key):
+        raw = self.client.hget(self.name, key)
+        if raw is None:
+            raise KeyError(key)
+        return loads(raw)
+
+    def __setitem__(self, key, value):
+        self.client.hset(self.name, key, dumps(value))
+
+    def __delitem__(self, key):
+        if not self.client.hdel(self.name, key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(self.client.hexists(self.name, key))
+
+    def __iter__(self):
+        return iter([_text(k) for k in self.client.hkeys(self.name)])
+
+    def __len__(self):
+        return int(self.client.hlen(self.name))
+
+
+class _RedisListMapping(MutableMapping):
+    def __init__(self, backend, ns):
+        self.backend = backend
+        self.client = backend.client
+        self.ns = ns
+
+    def __getitem__(self, key):
+        raw = self.client.lrange(self.backend._list(self.ns, key), 0, -1)
+        if not raw:
+            raise KeyError(key)
+        return [loads(r) for r in raw]
+
+    def __setitem__(self, key, items):
+        name = self.backend._list(self.ns, key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(name)
+        if items:
+            pipe.rpush(name, *[dumps(i) for i in items])
+        pipe.sadd(self.backend._index(self.ns), key)
+        pipe.execute()
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self.backend._list(self.ns, key))
+        pipe.srem(self.backend._index(self.ns), key)
+        pipe.execute()
+
+    def __contains__(self, key):
+        return bool(self.client.exists(self.backend._list(self.ns, key)))
+
+    def __iter__(self):
+        return iter([_text(k) for k in self.client.smembers(self.backend._index(self.ns))])
+
+    def __len__(self):
+        return int(self.client.scard(self.backend._index(self.ns)))
+
+
+# ---------------------------
+# FACTORY
+# ---------------------------
+
+def create_backend(url: str = STATE_BACKEND):
+    if not url or url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown STATE_BACKEND: {url}")
@@ -0,0 +1,179 @@
+import math
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import cold_storage
+import db
+from cold_storage import COLD_COLUMNS, ChunkFormatError, ColdCompactor, decode_chunk, encode_chunk, read_history
+from ingest_pipeline import IngestContext, validate_stage
+from reading import from_object
+
+
+def _row(timestamp, **metrics):
+    row = {column: None for column in COLD_COLUMNS}
+    row.update(temperature=21.5, humidity=45.0, pm25=12.3, pm10=20.0, noise=40.0, light=300.0)
+    row.update(metrics)
+    row["timestamp"] = timestamp
+    return row
+
+
+def _ts(row):
+    return datetime.fromisoformat(str(row["timestamp"]))
+
+
+# ---------------------------
+# VARINTS
+# ---------------------------
+
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, -65, 127, 128, 8191, -8192, 2 ** 40, -(2 ** 40), 2 ** 62, -(2 ** 63)])
+def test_varint_round_trip(value):
+    out = bytearray()
+    cold_storage._put_varint(out, value)
+    assert cold_storage._get_varint(out, 0) == (value, len(out))
+
+
+def test_varint_byte_boundaries():
+    # zigzag: 63 -> 126 fits one byte, 64 -> 128 needs two
+    for value, size in ((63, 1), (-64, 1), (64, 2), (-65, 2)):
+        out = bytearray()
+        cold_storage._put_varint(out, value)
+        assert len(out) == size
+
+
+def test_truncated_varint():
+    with pytest.raises(ChunkFormatError):
+        cold_storage._get_varint(b"\x80\x80", 0)
+
+
+# ---------------------------
+# CHUNK ROUND TRIP
+# ---------------------------
+
+def test_round_trip_with_nulls():
+    start = datetime(2026, 1, 1)
+    rows = [
+        _row(start, co2=815.0, vocs=120.5),
+        _row(start + timedelta(minutes=1)),
+        _row(start + timedelta(minutes=2), co2=790.25, aqi=42.0),
+        _row(start + timedelta(minutes=3), temperature=None),
+    ]
+    decoded = decode_chunk(encode_chunk(rows), "cold_test_01")
+
+    assert [_ts(r) for r in decoded] == [r["timestamp"] for r in rows]
+    assert [r["co2"] for r in decoded] == [815.0, None, 790.25, None]
+    assert [r["vocs"] for r in decoded] == [120.5, None, None, None]
+    assert [r["aqi"] for r in decoded] == [None, None, 42.0, None]
+    assert decoded[3]["temperature"] is None
+    assert all(r["device_id"] == "cold_test_01" and r["pm25"] == 12.3 for r in decoded)
+
+
+def test_round_trip_empty_and_single_row():
+    assert decode_chunk(encode_chunk([]), "cold_test_01") == []
+    decoded = decode_chunk(encode_chunk([_row("2026-01-01T00:00:00.250000")]), "cold_test_01")
+    assert len(decoded) == 1
+    assert _ts(decoded[0]) == datetime(2026, 1, 1, 0, 0, 0, 250000)
+
+
+def test_delta_of_delta_irregular_timestamps():
+    """Regular steps encode as zeros; gaps, bursts and equal timestamps still round-trip."""
+    start = datetime(2026, 1, 1, 0, 0, 0, 123456)
+    offsets = [0, 10, 20, 30, 30, 31, 3600, 3600.000001, 86399.999999]
+    rows = [_row(start + timedelta(seconds=s)) for s in offsets]
+    decoded = decode_chunk(encode_chunk(rows), "cold_test_01")
+    assert [_ts(r) for r in decoded] == [r["timestamp"] for r in rows]
+
+
+def test_value_deltas_large_and_negative():
+    values = [0.0, -40.0, 9999.99, -9999.99, 0.01, -0.01, 1e9, -1e9, 0.0]
+    rows = [_row(datetime(2026, 1, 1) + timedelta(seconds=i), temperature=v) for i, v in enumerate(values)]
+    decoded = decode_chunk(encode_chunk(rows), "cold_test_01")
+    assert [r["temperature"] for r in decoded] == values
+
+
+def test_values_quantized_to_two_decimals():
+    decoded = decode_chunk(encode_chunk([_row(datetime(2026, 1, 1), humidity=45.256)]), "cold_test_01")
+    assert decoded[0]["humidity"] == 45.26
+
+
+def test_non_finite_values_are_stored_as_null():
+    rows = [
+        _row(datetime(2026, 1, 1), co2=float("inf")),
+        _row(datetime(2026, 1, 1, 0, 1), co2=float("nan"), vocs=float("-inf")),
+        _row(datetime(2026, 1, 1, 0, 2), co2=800.0),
+    ]
+    decoded = decode_chunk(encode_chunk(rows), "cold_test_01")
+    assert [r["co2"] for r in decoded] == [None, None, 800.0]
+    assert decoded[1]["vocs"] is None
+
+
+def test_bad_chunks():
+    with pytest.raises(ChunkFormatError):
+        decode_chunk(b"", "cold_test_01")
+    with pytest.raises(ChunkFormatError):
+        decode_chunk(bytes([cold_storage.FORMAT_VERSION + 1]) + encode_chunk([])[1:], "cold_test_01")
+    with pytest.raises(ChunkFormatError):
+        decode_chunk(bytes([cold_storage.FORMAT_VERSION]) + b"not zlib", "cold_test_01")
+
+
+def test_validate_stage_drops_non_finite_optional_metrics():
+    reading = from_object({
+        "device_id": "cold_test_01", "temperature": 21.5, "humidity": 45.0, "pm25": 12.3, "pm10": 20.0,
+        "noise": 40.0, "light": 300.0, "co2": "inf", "vocs": float("nan"), "pressure": 1013.25,
+    })
+    validate_stage(IngestContext(reading))
+    assert reading.co2 is None and reading.vocs is None
+    assert reading.pressure == 1013.25
+
+
+# ---------------------------
+# HOT / COLD MERGE
+# ---------------------------
+
+def test_read_history_merges_cold_chunks_and_hot_rows():
+    old_db_name = db.DB_NAME
+    db.DB_NAME = path = tempfile.mktemp(suffix=".db")
+    device_id = "cold_test_02"
+    day = datetime(2026, 1, 1)
+
+    def insert(timestamps, **metrics):
+        db.insert_readings([dict(_row(ts, **metrics), device_id=device_id) for ts in timestamps])
+
+    try:
+        db.init_db()
+        insert([day + timedelta(hours=h) for h in (0, 6, 18)], co2=800.0)
+        # An inf that got stored before validate_stage dropped it must not stall compaction
+        insert([day + timedelta(hours=20)], co2=float("inf"))
+        insert([day + timedelta(days=8, hours=h) for h in (0, 1)])
+
+        compactor = ColdCompactor(cold_after_days=7, batch_pause=0)
+        assert compactor.run_once(now=day + timedelta(days=9)) == {"chunks": 1, "rows": 4}
+
+        # A late row for the compacted day lands in the hot tier, behind the cold chunk
+        insert([day + timedelta(hours=12)], co2=810.0)
+
+        history = read_history(device_id, since=day - timedelta(days=1))
+        assert [_ts(r) for r in history] == [
+            day, day + timedelta(hours=6), day + timedelta(hours=12), day + timedelta(hours=18),
+            day + timedelta(hours=20), day + timedelta(days=8), day + timedelta(days=8, hours=1),
+        ]
+        assert [r["co2"] for r in history[:5]] == [800.0, 800.0, 810.0, 800.0, None]
+
+        # The window applies to cold rows too
+        history = read_history(device_id, since=day + timedelta(hours=6), until=day + timedelta(hours=19))
+        assert [_ts(r) for r in history] == [day + timedelta(hours=h) for h in (6, 12, 18)]
+
+        # Recompacting folds the late row into the existing chunk
+        assert compactor.run_once(now=day + timedelta(days=9)) == {"chunks": 1, "rows": 1}
+        history = read_history(device_id, since=day - timedelta(days=1))
+        assert len(history) == 7 and not any(isinstance(r.get("co2"), float) and math.isinf(r["co2"]) for r in history)
+    finally:
+        db.DB_NAME = old_db_name
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,230 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import ble_gateway
+import gateway_spool
+from ble_gateway import ApiForwarder
+from gateway_spool import HEADER, RECORD, Spool
+
+
+def _reading(i, device_id="spool_test_01"):
+    return {
+        "device_id": device_id, "temperature": 21.0, "humidity": 45.0, "pm25": float(i), "pm10": 20.0,
+        "noise": 40.0, "light": 300.0, "timestamp": f"2026-01-01T00:00:{i:02d}",
+    }
+
+
+def _spool_path():
+    return tempfile.mktemp(suffix=".spool")
+
+
+# ---------------------------
+# CRASH RECOVERY
+# ---------------------------
+
+def test_reopen_recovers_pending_records():
+    path = _spool_path()
+    try:
+        spool = Spool(path, capacity=64 * 1024)
+        spool.append_many([_reading(i) for i in range(3)])
+        spool.append_many([b"\x01" + bytes(79)])
+        spool.close()
+
+        spool = Spool(path, capacity=64 * 1024)
+        assert spool.pending == 4
+        assert spool.stats["recovered"] == 4
+        batch, _ = spool.read_batch(10)
+        assert batch[:3] == [_reading(i) for i in range(3)]
+        assert batch[3] == b"\x01" + bytes(79)
+        spool.close()
+    finally:
+        os.remove(path)
+
+
+def test_torn_record_is_discarded_on_reopen():
+    """A crash mid-append: the header already counts a record whose body never made it."""
+    path = _spool_path()
+    try:
+        spool = Spool(path, capacity=64 * 1024)
+        spool.append_many([_reading(i) for i in range(2)])
+        offset = spool.write_offset
+        # Record header for a 100-byte body, but the body bytes don't match its CRC
+        RECORD.pack_into(spool._mm, offset, 100, 12345)
+        HEADER.pack_into(spool._mm, 0, gateway_spool.MAGIC, gateway_spool.VERSION, 0,
+                         spool.read_offset, offset + RECORD.size + 100)
+        spool.close()
+
+        spool = Spool(path, capacity=64 * 1024)
+        assert spool.pending == 2
+        assert spool.stats["corrupt_bytes"] == RECORD.size + 100
+        assert spool.read_batch(10)[0] == [_reading(0), _reading(1)]
+        # Appends continue right after the last good record
+        spool.append_many([_reading(2)])
+        assert spool.read_batch(10)[0] == [_reading(i) for i in range(3)]
+        spool.close()
+    finally:
+        os.remove(path)
+
+
+def test_invalid_header_starts_empty():
+    path = _spool_path()
+    try:
+        with open(path, "wb") as f:
+            f.write(b"JUNK" + bytes(HEADER.size))
+        spool = Spool(path, capacity=64 * 1024)
+        assert spool.pending == 0
+        spool.append_many([_reading(0)])
+        assert spool.read_batch(10)[0] == [_reading(0)]
+        spool.close()
+    finally:
+        os.remove(path)
+
+
+# ---------------------------
+# REPLAY ORDERING
+# ---------------------------
+
+def test_replay_is_oldest_first_and_commit_releases_only_read_records():
+    path = _spool_path()
+    try:
+        spool = Spool(path, capacity=64 * 1024)
+        spool.append_many([_reading(i) for i in range(5)])
+
+        batch, first_seq = spool.read_batch(2)
+        assert batch == [_reading(0), _reading(1)]
+        spool.append_many([_reading(5)])   # arrives while the replay POST is in flight
+        spool.commit(first_seq, len(batch))
+
+        batch, first_seq = spool.read_batch(10)
+        assert batch == [_reading(i) for i in range(2, 6)]
+        spool.commit(first_seq, len(batch))
+        assert spool.pending == 0
+        assert spool.stats["replayed"] == 6
+        spool.close()
+    finally:
+        os.remove(path)
+
+
+def test_commit_after_size_cap_drops_does_not_release_newer_records():
+    path = _spool_path()
+    try:
+        record = RECORD.size + len(b"\x01" + bytes(79))
+        spool = Spool(path, capacity=HEADER.size + 4 * record)
+        spool.append_many([bytes([1, i]) + bytes(78) for i in range(4)])
+
+        batch, first_seq = spool.read_batch(2)
+        # Cap hit during the POST: the two oldest (the ones being replayed) are dropped
+        spool.append_many([bytes([1, i]) + bytes(78) for i in range(4, 6)])
+        spool.commit(first_seq, len(batch))
+
+        remaining, _ = spool.read_batch(10)
+        assert [r[1] for r in remaining] == [2, 3, 4, 5]
+        assert spool.stats["dropped"] == 2
+        spool.close()
+    finally:
+        os.remove(path)
+
+
+# ---------------------------
+# FORWARDER REPLAY vs. BACKEND REPLIES
+# ---------------------------
+
+def test_rejected_batch_does_not_block_replay():
+    """A 4xx for one spooled batch drops it; the batches behind it still go out, in order."""
+    path = _spool_path()
+    received = []
+    replies = iter([422, 200, 200])
+
+    async def handler(request):
+        status = next(replies, 200)
+        if status == 200:
+            received.extend(r["pm25"] for r in await request.json())
+        return web.json_response({}, status=status)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/batch", handler)
+        server = TestServer(app)
+        await server.start_server()
+        forwarder = ApiForwarder(url=str(server.make_url("/batch")), spool=Spool(path, capacity=64 * 1024))
+        await forwarder.start()
+        try:
+            forwarder.spool.append_many([_reading(i) for i in range(6)])
+            await forwarder.replay()
+            return forwarder.stats, forwarder.spool.pending
+        finally:
+            await forwarder.close()
+            await server.close()
+
+    old_batch = ble_gateway.REPLAY_BATCH
+    ble_gateway.REPLAY_BATCH = 2
+    try:
+        stats, pending = asyncio.run(scenario())
+    finally:
+        ble_gateway.REPLAY_BATCH = old_batch
+        os.remove(path)
+
+    assert pending == 0
+    assert stats["rejected"] == 2
+    assert received == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_server_error_keeps_batch_spooled():
+    path = _spool_path()
+
+    async def handler(request):
+        return web.json_response({}, status=503)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/batch", handler)
+        server = TestServer(app)
+        await server.start_server()
+        forwarder = ApiForwarder(url=str(server.make_url("/batch")), spool=Spool(path, capacity=64 * 1024))
+        await forwarder.start()
+        try:
+            forwarder.spool.append_many([_reading(i) for i in range(3)])
+            await forwarder.replay()
+            return forwarder.stats, forwarder.spool.pending
+        finally:
+            await forwarder.close()
+            await server.close()
+
+    try:
+        stats, pending = asyncio.run(scenario())
+    finally:
+        os.remove(path)
+
+    assert pending == 3
+    assert stats["rejected"] == 0
+
+
+def test_batch_route_skips_malformed_items():
+    from routes.monacos import router
+
+    app = FastAPI()
+    app.include_router(router)
+    bad = dict(_reading(1, "spool_test_02"), pm25="not a number")
+    with TestClient(app) as client:
+        response = client.post("/api/ingest/batch", json=[_reading(0, "spool_test_02"), bad, _reading(2, "spool_test_02")])
+        assert response.status_code == 200
+        assert response.json()["count"] == 2
+        assert response.json()["rejected"] == 1
+
+        # Not an array at all is still a 422
+        assert client.post("/api/ingest/batch", json={"device_id": "x"}).status_code == 422
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+    print("✅ Gateway spool tests passed")
+    sys.exit(0)
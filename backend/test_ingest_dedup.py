@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import db
+import ingest_pipeline
+from ingest_pipeline import ORDER, PIPELINE, REORDER_WINDOW, PersistenceWriter
+from reading import from_object
+from repository import REPOSITORY
+
+
+def _reading(device_id, timestamp, pm25=10.0):
+    # Decoded the way the ingest routes decode a JSON body
+    return from_object({
+        "device_id": device_id,
+        "temperature": 21.5, "humidity": 45.0, "pm25": pm25, "pm10": 20.0,
+        "noise": 40.0, "light": 300.0,
+        "timestamp": timestamp.isoformat(),
+    })
+
+
+def test_replay_older_than_reorder_window_is_stored_once():
+    """
+    A gateway spool replay lands far behind the device's watermark, where
+    OrderTracker can no longer match it. Replaying the same batch twice
+    must still leave one row per reading.
+    """
+    path = tempfile.mktemp(suffix=".db")
+    old_db_name, old_writer = db.DB_NAME, ingest_pipeline.WRITER
+    db.DB_NAME = path
+    ingest_pipeline.WRITER = writer = PersistenceWriter(flush_interval=0.05)
+    ORDER.reset()
+    try:
+        REPOSITORY.init_schema()
+        now = datetime.utcnow().replace(microsecond=0)
+        device_id = "dedup_test_01"
+
+        # Live reading first: the replayed batch is behind the watermark
+        PIPELINE.process(_reading(device_id, now))
+        replay = [
+            _reading(device_id, now - REORDER_WINDOW * 10 + timedelta(seconds=5 * i), pm25=10.0 + i)
+            for i in range(20)
+        ]
+        first = PIPELINE.process_many(replay)
+        second = PIPELINE.process_many(replay)
+        assert first["count"] == second["count"] == len(replay)
+
+        writer.start()
+        writer.stop()
+        assert writer.stats["failed"] == 0
+        assert writer.stats["already_stored"] == len(replay)
+
+        conn = db.get_db()
+        try:
+            rows = conn.execute(
+                f"SELECT COUNT(*), COUNT(DISTINCT timestamp) FROM {db.ALL_READINGS_VIEW} WHERE device_id = ?",
+                (device_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        assert tuple(rows) == (len(replay) + 1, len(replay) + 1)
+    finally:
+        ingest_pipeline.WRITER = old_writer
+        db.DB_NAME = old_db_name
+        ORDER.reset()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    test_replay_older_than_reorder_window_is_stored_once()
+    print("✅ Replayed batch stored once")
+    sys.exit(0)
@@ -0,0 +1,143 @@
+import struct
+import sys
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import reading_codec
+from reading_codec import RECORD_SIZE, DecodeError, decode_reading, encode_reading, iter_readings, stamp_record
+
+
+def _reading(**overrides):
+    reading = {
+        "device_id": "codec_test_01", "temperature": 21.5, "humidity": 45.25, "pm25": 12.3, "pm10": 20.0,
+        "noise": 40.0, "light": 300.0, "timestamp": datetime(2026, 1, 2, 3, 4, 5, 678000),
+    }
+    reading.update(overrides)
+    return reading
+
+
+def _with_device_id(record: bytes, raw_id: bytes) -> bytes:
+    patched = bytearray(record)
+    patched[4:20] = raw_id.ljust(16, b"\0")
+    return bytes(patched)
+
+
+# ---------------------------
+# ROUND TRIP
+# ---------------------------
+
+def test_round_trip_required_fields():
+    record = encode_reading(_reading())
+    assert len(record) == RECORD_SIZE
+    decoded = decode_reading(record)
+    assert decoded.device_id == "codec_test_01"
+    assert decoded.temperature == 21.5
+    assert decoded.humidity == 45.25
+    assert decoded.pm25 == 12.3          # f32 rounded back to 2 decimals
+    assert decoded.timestamp == datetime(2026, 1, 2, 3, 4, 5, 678000)
+    assert decoded.co2 is None and decoded.gas is None
+
+
+def test_round_trip_optional_fields_and_iso_timestamp():
+    original = _reading(co2=815.0, vocs=120.5, pressure=1013.25, gas=0.0, timestamp="2026-01-02T03:04:05")
+    decoded = decode_reading(encode_reading(original))
+    assert (decoded.co2, decoded.vocs, decoded.pressure, decoded.gas) == (815.0, 120.5, 1013.25, 0.0)
+    assert decoded.timestamp == datetime(2026, 1, 2, 3, 4, 5)
+
+
+def test_round_trip_without_timestamp_and_stamping():
+    record = encode_reading(_reading(timestamp=None))
+    assert decode_reading(record).timestamp is None
+
+    stamped = stamp_record(record, datetime(2026, 1, 2, 3, 4, 5, 250000, tzinfo=timezone.utc).timestamp())
+    assert decode_reading(stamped).timestamp == datetime(2026, 1, 2, 3, 4, 5, 250000)
+    # A record that already has a timestamp is left alone
+    assert stamp_record(stamped, 0.0) == stamped
+
+
+def test_sixteen_byte_device_id_and_batches():
+    records = [encode_reading(_reading(device_id="x" * 16, pm25=float(i))) for i in range(3)]
+    decoded = list(iter_readings(b"".join(records)))
+    assert [r.device_id for r in decoded] == ["x" * 16] * 3
+    assert [r.pm25 for r in decoded] == [0.0, 1.0, 2.0]
+
+    # decode_reading works on a memoryview at an offset, without slicing
+    assert decode_reading(memoryview(b"".join(records)), RECORD_SIZE).pm25 == 1.0
+
+
+def test_encode_rejects_long_or_non_ascii_device_id():
+    with pytest.raises(ValueError):
+        encode_reading(_reading(device_id="x" * 17))
+    with pytest.raises(ValueError):
+        encode_reading(_reading(device_id="capteur_é"))
+
+
+# ---------------------------
+# MALFORMED RECORDS
+# ---------------------------
+
+def test_truncated_record():
+    with pytest.raises(DecodeError):
+        decode_reading(encode_reading(_reading())[:-1])
+
+
+def test_unsupported_version():
+    record = bytearray(encode_reading(_reading()))
+    record[0] = 2
+    with pytest.raises(DecodeError):
+        decode_reading(bytes(record))
+
+
+def test_missing_required_field():
+    record = bytearray(encode_reading(_reading()))
+    mask = struct.unpack_from("<H", record, 2)[0] & ~1   # clear temperature
+    struct.pack_into("<H", record, 2, mask)
+    with pytest.raises(DecodeError):
+        decode_reading(bytes(record))
+
+
+def test_non_ascii_device_id_is_a_decode_error():
+    record = _with_device_id(encode_reading(_reading()), b"dev\xff\xfe")
+    with pytest.raises(DecodeError):
+        decode_reading(record)
+
+
+def test_empty_device_id():
+    with pytest.raises(DecodeError):
+        decode_reading(_with_device_id(encode_reading(_reading()), b""))
+
+
+def test_batch_length_not_a_multiple_of_the_record_size():
+    with pytest.raises(DecodeError):
+        list(iter_readings(encode_reading(_reading()) + b"\x01"))
+
+
+def test_batch_skips_malformed_records_when_collecting_errors():
+    good = encode_reading(_reading())
+    bad = _with_device_id(good, b"\xff")
+    errors = []
+    decoded = list(iter_readings(good + bad + good, errors))
+    assert len(decoded) == 2
+    assert len(errors) == 1 and errors[0].startswith("[1]")
+
+
+def test_binary_route_returns_client_errors_not_500():
+    from routes.monacos import router
+
+    app = FastAPI()
+    app.include_router(router)
+    headers = {"Content-Type": reading_codec.CONTENT_TYPE}
+    good = encode_reading(_reading(device_id="codec_test_02"))
+    bad = _with_device_id(good, b"dev\xff")
+    with TestClient(app) as client:
+        response = client.post("/api/ingest/binary", content=good + bad, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["rejected"] == 1
+        assert client.post("/api/ingest/binary", content=good[:-1], headers=headers).status_code == 400
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import db
+import retention
+from retention import RetentionManager
+
+
+def _fresh_db():
+    path = tempfile.mktemp(suffix=".db")
+    db.DB_NAME = path
+    db.init_db()
+    return path
+
+
+def _insert(count, start, device_id="retention_test_01"):
+    db.insert_readings([
+        {
+            "device_id": device_id, "temperature": 21.0, "humidity": 45.0, "pm25": 10.0, "pm10": 20.0,
+            "noise": 40.0, "light": 300.0, "timestamp": start + timedelta(minutes=10 * i),
+        }
+        for i in range(count)
+    ])
+
+
+def _count(sql):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_stop_mid_fold_keeps_the_partition():
+    """
+    A shutdown in the middle of folding an expired partition must not drop
+    it: the rows that were never rolled up stay, and the next pass finishes.
+    """
+    old_db_name, old_sleep = db.DB_NAME, retention.time.sleep
+    path = _fresh_db()
+    manager = RetentionManager(retention_days=30, batch_size=10, batch_pause=0)
+    try:
+        _insert(50, datetime(2026, 1, 1))
+        # Stop after the first batch
+        retention.time.sleep = lambda _: manager._stop.set()
+        result = manager.run_once(now=datetime(2026, 6, 1))
+
+        assert result["partitions_dropped"] == 0
+        assert _count("SELECT COUNT(*) FROM sensor_readings_202601") == 50
+        assert _count("SELECT SUM(count) FROM sensor_rollups") == 10
+
+        manager._stop.clear()
+        retention.time.sleep = lambda _: None
+        result = manager.run_once(now=datetime(2026, 6, 1))
+
+        assert result["partitions_dropped"] == 1
+        assert "sensor_readings_202601" not in db.list_partitions(refresh=True)
+        assert _count("SELECT SUM(count) FROM sensor_rollups") == 50
+    finally:
+        retention.time.sleep = old_sleep
+        db.DB_NAME = old_db_name
+        os.remove(path)
+
+
+def test_rows_inserted_after_the_fold_keep_the_partition():
+    old_db_name = db.DB_NAME
+    path = _fresh_db()
+    try:
+        _insert(5, datetime(2026, 1, 1))
+        # Folded up to id 5, then a late row lands before the drop
+        _insert(1, datetime(2026, 1, 20))
+        assert not db.drop_partition("sensor_readings_202601", max_id=5)
+        assert _count("SELECT COUNT(*) FROM sensor_readings_202601") == 6
+        assert db.drop_partition("sensor_readings_202601", max_id=6)
+    finally:
+        db.DB_NAME = old_db_name
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    test_stop_mid_fold_keeps_the_partition()
+    test_rows_inserted_after_the_fold_keep_the_partition()
+    print("✅ Retention keeps partitions until fully folded")
+    sys.exit(0)
@@ -0,0 +1,307 @@
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+import pytest
+
+from reading import Reading
+from state_backend import MemoryBackend, RedisBackend, SQLiteBackend, create_backend, dumps, loads
+
+
+# ---------------------------
+# REDIS STAND-IN
+# ---------------------------
+# The subset of redis-py RedisBackend uses, with redis-py's reply types
+# (bytes, ints). Used when fakeredis isn't installed.
+
+def _b(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class StubRedis:
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def pipeline(self, transaction=True):
+        return _StubPipeline(self)
+
+    # keys
+    def exists(self, name):
+        return int(_b(name) in self.data)
+
+    def delete(self, *names):
+        return sum(self.data.pop(_b(n), None) is not None for n in names)
+
+    # hashes
+    def hget(self, name, key):
+        return self.data.get(_b(name), {}).get(_b(key))
+
+    def hset(self, name, key, value):
+        h = self.data.setdefault(_b(name), {})
+        new = _b(key) not in h
+        h[_b(key)] = _b(value)
+        return int(new)
+
+    def hdel(self, name, *keys):
+        h = self.data.get(_b(name), {})
+        removed = sum(h.pop(_b(k), None) is not None for k in keys)
+        if not h:
+            self.data.pop(_b(name), None)
+        return removed
+
+    def hexists(self, name, key):
+        return _b(key) in self.data.get(_b(name), {})
+
+    def hkeys(self, name):
+        return list(self.data.get(_b(name), {}))
+
+    def hlen(self, name):
+        return len(self.data.get(_b(name), {}))
+
+    def hincrby(self, name, key, amount=1):
+        h = self.data.setdefault(_b(name), {})
+        value = int(h.get(_b(key), b"0")) + amount
+        h[_b(key)] = _b(value)
+        return value
+
+    # lists
+    def rpush(self, name, *values):
+        items = self.data.setdefault(_b(name), [])
+        items.extend(_b(v) for v in values)
+        return len(items)
+
+    def ltrim(self, name, start, end):
+        items = self.data.get(_b(name), [])
+        n = len(items)
+        start = max(start + n if start < 0 else start, 0)
+        end = end + n if end < 0 else min(end, n - 1)
+        kept = items[start:end + 1]
+        if kept:
+            self.data[_b(name)] = kept
+        else:
+            self.data.pop(_b(name), None)
+        return True
+
+    def lrange(self, name, start, end):
+        items = self.data.get(_b(name), [])
+        end = len(items) if end == -1 else end + 1
+        return list(items[start:end])
+
+    # sets
+    def sadd(self, name, *members):
+        s = self.data.setdefault(_b(name), set())
+        before = len(s)
+        s.update(_b(m) for m in members)
+        return len(s) - before
+
+    def srem(self, name, *members):
+        s = self.data.get(_b(name), set())
+        before = len(s)
+        s.difference_update(_b(m) for m in members)
+        if not s:
+            self.data.pop(_b(name), None)
+        return before - len(s)
+
+    def smembers(self, name):
+        return set(self.data.get(_b(name), set()))
+
+    def scard(self, name):
+        return len(self.data.get(_b(name), set()))
+
+
+class _StubPipeline:
+    """Queues commands and runs them under one lock, like MULTI/EXEC."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, command):
+        def queue(*args):
+            self.commands.append((command, args))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            return [getattr(self.client, command)(*args) for command, args in self.commands]
+
+
+def _redis_clients():
+    clients = [("stub", StubRedis)]
+    try:
+        import fakeredis
+    except ImportError:
+        pass
+    else:
+        clients.append(("fakeredis", fakeredis.FakeRedis))
+    return clients
+
+
+# ---------------------------
+# FIXTURES
+# ---------------------------
+
+@pytest.fixture
+def sqlite_path():
+    path = tempfile.mktemp(suffix=".db")
+    yield path
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+@pytest.fixture(params=["memory", "sqlite"] + [name for name, _ in _redis_clients()])
+def backend(request, sqlite_path):
+    if request.param == "memory":
+        backend = MemoryBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(sqlite_path)
+    else:
+        backend = RedisBackend(client=dict(_redis_clients())[request.param](), prefix="test")
+    yield backend
+    backend.close()
+
+
+def _reading(timestamp):
+    return Reading("state_test_01", 21.5, 45.0, 12.3, 20.0, 40.0, 300.0, co2=815.0, timestamp=timestamp)
+
+
+# ---------------------------
+# SERIALIZATION
+# ---------------------------
+
+def test_datetime_round_trip_nested():
+    value = {"last_seen": datetime(2026, 1, 2, 3, 4, 5, 678000), "nested": [{"at": datetime(2026, 1, 1)}]}
+    assert loads(dumps(value)) == value
+
+
+def test_reading_serializes_as_dict_with_datetime():
+    restored = loads(dumps(_reading(datetime(2026, 1, 2, 3, 4, 5))))
+    assert restored["timestamp"] == datetime(2026, 1, 2, 3, 4, 5)
+    assert restored["device_id"] == "state_test_01" and restored["co2"] == 815.0
+
+
+# ---------------------------
+# BACKEND CONTRACT (every backend)
+# ---------------------------
+
+def test_push_keeps_the_last_maxlen(backend):
+    for i in range(7):
+        backend.push("history", "dev1", {"i": i}, maxlen=3)
+    backend.push("history", "dev2", {"i": 99}, maxlen=3)
+
+    history = backend.mapping("history", "list")
+    assert history["dev1"] == [{"i": 4}, {"i": 5}, {"i": 6}]
+    assert history["dev2"] == [{"i": 99}]
+    assert sorted(history) == ["dev1", "dev2"]
+    assert len(history) == 2
+
+
+def test_incr(backend):
+    assert [backend.incr("version", "dev1") for _ in range(3)] == [1, 2, 3]
+    assert backend.incr("version", "dev2") == 1
+    assert backend.mapping("version")["dev1"] == 3
+
+
+def test_value_mapping(backend):
+    state = backend.mapping("state")
+    state["dev1"] = {"pm25": 12.3, "status": "ok"}
+    state["dev2"] = {"pm25": 1.0}
+    state["dev1"] = {"pm25": 15.0}
+
+    assert state["dev1"] == {"pm25": 15.0}
+    assert "dev1" in state and "missing" not in state
+    assert sorted(state) == ["dev1", "dev2"]
+    assert len(state) == 2
+    assert state.get("missing") is None
+    with pytest.raises(KeyError):
+        state["missing"]
+
+    del state["dev2"]
+    assert sorted(state) == ["dev1"]
+    with pytest.raises(KeyError):
+        del state["dev2"]
+
+
+def test_list_mapping_assignment_and_delete(backend):
+    history = backend.mapping("history", "list")
+    history["dev1"] = [{"i": 1}, {"i": 2}]
+    backend.push("history", "dev1", {"i": 3}, maxlen=10)
+    assert history["dev1"] == [{"i": 1}, {"i": 2}, {"i": 3}]
+
+    history["dev1"] = [{"i": 9}]
+    assert history["dev1"] == [{"i": 9}]
+
+    del history["dev1"]
+    assert "dev1" not in history and len(history) == 0
+    with pytest.raises(KeyError):
+        history["dev1"]
+    with pytest.raises(KeyError):
+        del history["dev1"]
+
+
+def test_datetimes_and_readings_round_trip_through_the_backend(backend):
+    seen = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    backend.mapping("state")["dev1"] = {"timestamp": seen, "reading": _reading(seen)}
+    backend.push("history", "dev1", _reading(seen), maxlen=5)
+
+    state = backend.mapping("state")["dev1"]
+    assert state["timestamp"] == seen
+    assert state["reading"]["timestamp"] == seen
+    (item,) = backend.mapping("history", "list")["dev1"]
+    assert item["timestamp"] == seen and item["pm25"] == 12.3
+
+
+# ---------------------------
+# SHARING BETWEEN WORKERS
+# ---------------------------
+
+def test_sqlite_backends_on_one_file_share_state(sqlite_path):
+    """Two backends on one file stand in for two uvicorn workers."""
+    a, b = SQLiteBackend(sqlite_path), SQLiteBackend(sqlite_path)
+    try:
+        a.mapping("state")["dev1"] = {"pm25": 1.0}
+        a.push("history", "dev1", {"i": 1}, maxlen=5)
+        b.push("history", "dev1", {"i": 2}, maxlen=5)
+        a.incr("version", "dev1")
+        assert b.incr("version", "dev1") == 2
+        assert b.mapping("state")["dev1"] == {"pm25": 1.0}
+        assert a.mapping("history", "list")["dev1"] == [{"i": 1}, {"i": 2}]
+    finally:
+        a.close()
+        b.close()
+
+
+def test_concurrent_pushes_are_not_lost(backend):
+    if backend.name == "memory":
+        pytest.skip("single worker only")
+
+    def worker(n):
+        for i in range(50):
+            backend.push("history", "dev1", {"w": n, "i": i}, maxlen=1000)
+            backend.incr("version", "dev1")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(backend.mapping("history", "list")["dev1"]) == 200
+    assert backend.mapping("version")["dev1"] == 200
+
+
+def test_create_backend():
+    assert isinstance(create_backend("memory"), MemoryBackend)
+    with pytest.raises(ValueError):
+        create_backend("mongodb://localhost")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
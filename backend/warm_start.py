@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from log_config import get_logger
+from reading import Reading
+from repository import REPOSITORY
+from shared_state import DEVICE_STATE, DEVICE_HISTORY, device_lock
+
+# ---------------------------
+# WARM START
+# ---------------------------
+# Rebuilds DEVICE_STATE and the DEVICE_HISTORY windows from sensor_readings
+# after a restart, so devices don't show offline / 404 until they report
+# again. Runs on a background thread; the server takes traffic meanwhile and
+# live readings always win over warm-start rows (see device_lock).
+
+WARM_START_LOOKBACK = timedelta(days=1)
+
+WARM_START_STATS = {
+    "status": "idle",    # idle | running | done | failed
+    "devices": 0,
+    "readings": 0,
+    "skipped_live": 0,
+    "seconds": 0.0,
+}
+
+log = get_logger("warm_start")
+
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value is not None and value.tzinfo:
+        value = value.replace(tzinfo=None)
+    return value
+
+
+def _to_state(row: dict) -> Reading:
+    """sensor_readings row -> the Reading the ingest pipeline keeps in memory."""
+    reading = Reading.from_dict(row)
+    reading.timestamp = _parse_timestamp(reading.timestamp)
+    return reading
+
+
+def warm_start(max_history: int, lookback: timedelta = WARM_START_LOOKBACK):
+    WARM_START_STATS["status"] = "running"
+    started = time.perf_counter()
+    try:
+        windows = REPOSITORY.get_recent_readings_by_device(max_history, datetime.utcnow() - lookback)
+
+        devices = readings = skipped = 0
+        for device_id, rows in windows.items():
+            history = [_to_state(r) for r in rows]
+            # Check and fill under the state stage's lock, so a live reading
+            # can't land between the two and be overwritten by older rows
+            with device_lock(device_id):
+                # A reading arrived while we were loading: it is newer, keep it
+                if device_id in DEVICE_STATE:
+                    skipped += 1
+                    continue
+                DEVICE_HISTORY[device_id] = history
+                DEVICE_STATE[device_id] = history[-1]
+            devices += 1
+            readings += len(history)
+
+        WARM_START_STATS.update(
+            status="done", devices=devices, readings=readings, skipped_live=skipped,
+            seconds=round(time.perf_counter() - started, 3),
+        )
+        log.info("warm start complete", extra={"fields": dict(WARM_START_STATS)})
+    except Exception:
+        WARM_START_STATS.update(status="failed", seconds=round(time.perf_counter() - started, 3))
+        log.exception("warm start failed")
+
+
+def start_background(max_history: int) -> threading.Thread:
+    thread = threading.Thread(target=warm_start, args=(max_history,), name="warm-start", daemon=True)
+    thread.start()
+    return thread